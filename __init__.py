@@ -4,6 +4,9 @@
 from .server import *
 from .gallery_node import NODE_CLASS_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS
 
+# Opt-in background indexing of the gallery root, see warmupOnStartup in user_settings.json
+start_startup_warmup()
+
 # Add ComfyUI root to sys.path HERE
 import sys
 import os
@@ -0,0 +1,179 @@
+# generate_tree.py
+"""Generates a synthetic ComfyUI output tree for the benchmarks.
+
+Same arguments give the same files, timestamps included, so runs on different commits compare."""
+import argparse
+import json
+import os
+import random
+
+from PIL import Image, PngImagePlugin
+
+# Fixed mtime base so entry dates and sort orders are identical between generated trees
+BASE_TIMESTAMP = 1700000000
+
+_WORDS = (
+    "portrait landscape cyberpunk city neon night rain street detailed cinematic lighting masterpiece "
+    "forest river mountain sunset golden hour bokeh photorealistic painting watercolor anime girl "
+    "knight castle dragon fog volumetric octane render 8k sharp focus highly intricate"
+).split()
+_NEGATIVE = "blurry, lowres, bad anatomy, bad hands, watermark, text, jpeg artifacts, deformed"
+_CHECKPOINTS = ["sd_xl_base_1.0.safetensors", "juggernautXL_v9.safetensors", "dreamshaper_8.safetensors", "flux1-dev-fp8.safetensors"]
+_LORAS = ["add_detail.safetensors", "neon_style.safetensors", "film_grain.safetensors", "pixel_art_xl.safetensors"]
+_SAMPLERS = ["euler", "euler_ancestral", "dpmpp_2m", "dpmpp_2m_sde", "uni_pc"]
+_SCHEDULERS = ["normal", "karras", "exponential", "simple"]
+
+
+def make_prompt_text(rng, words=40):
+    return ", ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+def make_workflow(rng, extra_nodes=20):
+    """Returns (prompt, workflow) shaped like what ComfyUI's SaveImage embeds: the API prompt graph and
+    the UI workflow with node positions, widget values and links. extra_nodes pads the workflow the
+    way reroutes, notes and groups do in real graphs."""
+    checkpoint = rng.choice(_CHECKPOINTS)
+    lora = rng.choice(_LORAS)
+    positive = make_prompt_text(rng)
+    seed = rng.randrange(2 ** 48)
+    steps = rng.choice([20, 25, 30, 40])
+    cfg = rng.choice([4.5, 6.0, 7.0, 8.0])
+    sampler = rng.choice(_SAMPLERS)
+    scheduler = rng.choice(_SCHEDULERS)
+    prompt = {
+        "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": checkpoint}},
+        "10": {"class_type": "LoraLoader", "inputs": {"lora_name": lora, "strength_model": 0.8, "strength_clip": 0.8, "model": ["4", 0], "clip": ["4", 1]}},
+        "6": {"class_type": "CLIPTextEncode", "inputs": {"text": positive, "clip": ["10", 1]}},
+        "7": {"class_type": "CLIPTextEncode", "inputs": {"text": _NEGATIVE, "clip": ["10", 1]}},
+        "5": {"class_type": "EmptyLatentImage", "inputs": {"width": 1024, "height": 1024, "batch_size": 1}},
+        "3": {"class_type": "KSampler", "inputs": {
+            "seed": seed, "steps": steps, "cfg": cfg, "sampler_name": sampler, "scheduler": scheduler, "denoise": 1.0,
+            "model": ["10", 0], "positive": ["6", 0], "negative": ["7", 0], "latent_image": ["5", 0]}},
+        "8": {"class_type": "VAEDecode", "inputs": {"samples": ["3", 0], "vae": ["4", 2]}},
+        "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI", "images": ["8", 0]}},
+    }
+    widgets = {
+        "4": [checkpoint], "10": [lora, 0.8, 0.8], "6": [positive], "7": [_NEGATIVE], "5": [1024, 1024, 1],
+        "3": [seed, "randomize", steps, cfg, sampler, scheduler, 1.0], "8": [], "9": ["ComfyUI"],
+    }
+    nodes = []
+    links = []
+    for node_id, node in prompt.items():
+        inputs = []
+        for name, value in node["inputs"].items():
+            if isinstance(value, list):
+                link_id = len(links) + 1
+                links.append([link_id, int(value[0]), value[1], int(node_id), len(inputs), "*"])
+                inputs.append({"name": name, "type": name.upper(), "link": link_id})
+        nodes.append({
+            "id": int(node_id), "type": node["class_type"], "pos": [rng.randrange(2000), rng.randrange(1200)],
+            "size": [315, 98], "flags": {}, "order": len(nodes), "mode": 0, "inputs": inputs, "outputs": [],
+            "properties": {"Node name for S&R": node["class_type"]}, "widgets_values": widgets[node_id],
+        })
+    for i in range(extra_nodes):
+        nodes.append({
+            "id": 100 + i, "type": "Note" if i % 3 == 0 else "Reroute", "pos": [rng.randrange(2000), rng.randrange(1200)],
+            "size": [400, 60], "flags": {}, "order": len(nodes), "mode": 0, "inputs": [], "outputs": [],
+            "properties": {}, "widgets_values": [make_prompt_text(rng, 12)] if i % 3 == 0 else [],
+        })
+    workflow = {
+        "last_node_id": 100 + extra_nodes, "last_link_id": len(links), "nodes": nodes, "links": links,
+        "groups": [], "config": {}, "extra": {"ds": {"scale": 0.8, "offset": [0, 0]}}, "version": 0.4,
+    }
+    return prompt, workflow
+
+
+def _write_png(path, rng, size):
+    prompt, workflow = make_workflow(rng)
+    info = PngImagePlugin.PngInfo()
+    info.add_text("prompt", json.dumps(prompt))
+    info.add_text("workflow", json.dumps(workflow))
+    Image.new("RGB", (size, size), tuple(rng.randrange(256) for _ in range(3))).save(path, pnginfo=info)
+
+
+def _write_jpeg(path, rng, size):
+    exif = Image.Exif()
+    exif[0x010F] = "Synthetic"  # Make
+    exif[0x0110] = "Benchmark Camera"  # Model
+    exif[0x0131] = "ComfyUI"  # Software
+    exif[0x0132] = "2023:11:14 22:13:20"  # DateTime
+    exif[0x010E] = make_prompt_text(rng, 20)  # ImageDescription
+    exif_ifd = exif.get_ifd(0x8769)
+    exif_ifd[0x829A] = 1 / 125  # ExposureTime
+    exif_ifd[0x9286] = b"ASCII\0\0\0" + make_prompt_text(rng, 20).encode()  # UserComment
+    Image.new("RGB", (size, size), tuple(rng.randrange(256) for _ in range(3))).save(path, exif=exif, quality=85)
+
+
+def _folder_paths(folders, depth):
+    """Relative folder paths: a few top-level folders with nested subfolders up to depth levels."""
+    paths = []
+    for i in range(folders):
+        parts = [f"batch_{i % max(1, folders // 4):03d}"]
+        for level in range(1, depth):
+            if i % (level + 1) == 0:
+                parts.append(f"sub_{level}_{i:04d}")
+        paths.append(os.path.join(*parts) if len(parts) > 1 else f"{parts[0]}_{i:04d}")
+    return paths
+
+
+def generate_tree(root, folders=20, pngs=50, jpegs=5, depth=3, symlinks=True, image_size=64, seed=0):
+    """Writes the synthetic tree under root and returns a summary dict. Existing files are overwritten."""
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    folder_paths = _folder_paths(folders, depth)
+    counter = 0
+    files = 0
+    for folder in folder_paths:
+        folder_path = os.path.join(root, folder)
+        os.makedirs(folder_path, exist_ok=True)
+        for i in range(pngs + jpegs):
+            is_png = i < pngs
+            name = f"ComfyUI_{counter:05d}_.png" if is_png else f"photo_{counter:05d}.jpg"
+            path = os.path.join(folder_path, name)
+            if is_png:
+                _write_png(path, rng, image_size)
+            else:
+                _write_jpeg(path, rng, image_size)
+            os.utime(path, (BASE_TIMESTAMP + counter, BASE_TIMESTAMP + counter))
+            counter += 1
+            files += 1
+
+    links = []
+    if symlinks and folder_paths:
+        candidates = [
+            # Same folder reachable twice (deduplicated by deduplicate_symlinks)
+            (os.path.join(root, folder_paths[0]), os.path.join(root, "linked_batch")),
+            # Cycle back to the root from a nested folder
+            (root, os.path.join(root, folder_paths[-1], "loop_to_root")),
+        ]
+        for target, link in candidates:
+            try:
+                if not os.path.lexists(link):
+                    os.symlink(target, link, target_is_directory=True)
+                links.append(os.path.relpath(link, root))
+            except OSError:
+                pass  # No symlink permission (e.g. Windows without developer mode)
+
+    # Old enough directory mtimes for the walker to reuse listings, as on a settled output folder
+    for dir_path, _, _ in os.walk(root):
+        os.utime(dir_path, (BASE_TIMESTAMP, BASE_TIMESTAMP))
+    return {"root": root, "folders": len(folder_paths), "files": files, "pngs_per_folder": pngs,
+            "jpegs_per_folder": jpegs, "symlinks": links, "seed": seed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic ComfyUI output tree.")
+    parser.add_argument("root")
+    parser.add_argument("--folders", type=int, default=20)
+    parser.add_argument("--pngs", type=int, default=50, help="PNGs with prompt/workflow chunks per folder")
+    parser.add_argument("--jpegs", type=int, default=5, help="JPEGs with EXIF per folder")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--no-symlinks", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    summary = generate_tree(args.root, args.folders, args.pngs, args.jpegs, args.depth, not args.no_symlinks, seed=args.seed)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
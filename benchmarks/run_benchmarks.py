@@ -0,0 +1,314 @@
+# run_benchmarks.py
+"""Times the gallery hot paths on a synthetic output tree and writes the results as JSON.
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --compare results.json   # also prints ratios to an older run
+
+The custom node package is loaded against stub server/folder_paths modules (benchmarks/stubs), with
+its caches and index redirected to a temporary directory, so no ComfyUI install is needed and the
+repository is left untouched."""
+import argparse
+import asyncio
+import contextlib
+import copy
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+STUBS_DIR = os.path.join(BENCH_DIR, "stubs")
+PACKAGE_NAME = "comfyui_gallery_bench"
+# Bumped when result names or fields change meaning
+SCHEMA_VERSION = 1
+
+sys.path.insert(0, BENCH_DIR)
+from generate_tree import generate_tree  # noqa: E402
+
+
+def load_gallery(output_dir, work_dir):
+    """Imports the custom node package with the stub ComfyUI modules, its caches living in work_dir."""
+    sys.path.insert(0, STUBS_DIR)
+    import folder_paths
+    folder_paths.output_directory = output_dir
+
+    spec = importlib.util.spec_from_file_location(PACKAGE_NAME, os.path.join(REPO_DIR, "__init__.py"), submodule_search_locations=[REPO_DIR])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE_NAME] = package
+    spec.loader.exec_module(package)
+
+    modules = {name: importlib.import_module(f"{PACKAGE_NAME}.{name}") for name in (
+        "server", "folder_scanner", "folder_monitor", "metadata_extractor", "metadata_cache",
+        "search_index", "thumbnail_service", "raw_json", "gallery_config", "image_hash", "json_fragments", "warmup")}
+    modules["gallery_config"].disable_logs = True
+    warmup = modules["warmup"].get_warmup()
+    if warmup is not None:
+        warmup.stop()  # Enabled in the user's own settings, it would index the tree during the timed scans
+    hasher = modules["image_hash"].get_image_hasher()
+    if hasher is not None:
+        hasher.background = False  # Background hashing would run during the timed scans
+    modules["server"].SETTINGS_FILE = os.path.join(work_dir, "user_settings.json")
+    modules["metadata_cache"]._cache = modules["metadata_cache"].MetadataCache(db_path=os.path.join(work_dir, "metadata_cache.db"))
+    modules["search_index"]._index = modules["search_index"].SearchIndex(db_path=os.path.join(work_dir, "search_index.db"))
+    modules["thumbnail_service"]._service = modules["thumbnail_service"].ThumbnailService(cache_dir=os.path.join(work_dir, "thumbnail_cache"))
+    return modules
+
+
+def summarize(times, items=None):
+    result = {
+        "unit": "s",
+        "runs": len(times),
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+        "max": max(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+    }
+    if items:
+        result["items"] = items
+        result["median_per_item"] = result["median"] / items
+    return result
+
+
+def measure(func, repeat, setup=None, items=None):
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return summarize(times, items)
+
+
+async def measure_async(func, repeat, setup=None, items=None):
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        await func()
+        times.append(time.perf_counter() - start)
+    return summarize(times, items)
+
+
+@contextlib.contextmanager
+def without_metadata_cache(metadata_cache):
+    """Makes get_metadata_cache() return None, so metadata is extracted from every file."""
+    cache, failed = metadata_cache._cache, metadata_cache._cache_failed
+    metadata_cache._cache, metadata_cache._cache_failed = None, True
+    try:
+        yield
+    finally:
+        metadata_cache._cache, metadata_cache._cache_failed = cache, failed
+
+
+def modified_snapshot(fingerprints, ratio=0.05):
+    """Copy of scanned fingerprints with about ratio of the files updated, removed and added."""
+    new_fingerprints = copy.deepcopy(fingerprints)
+    for i, (folder_key, folder) in enumerate(sorted(new_fingerprints.items())):
+        names = sorted(folder)
+        step = max(1, int(1 / ratio))
+        for j, name in enumerate(names[::step]):
+            if j % 3 == 0:
+                folder[name] = b"modified" + folder[name]  # Fingerprints are opaque, any other value differs
+            elif j % 3 == 1:
+                del folder[name]
+            else:
+                folder[f"added_{i}_{j}.png"] = b"added" + folder[name]
+    return new_fingerprints
+
+
+def run_core(m, root, repeat):
+    """Benchmarks of the scanner, metadata extraction, change detection and JSON encoding."""
+    scanner = m["folder_scanner"]
+    base_name = os.path.basename(root)
+    results = {}
+
+    def walk():
+        return list(scanner._walk_folders(root, base_name, True, None, True, True))
+
+    def clear_listings():
+        with scanner._listing_lock:
+            scanner._listings.clear()
+            scanner._listed_files = 0
+
+    results["scan.walk.cold"] = measure(walk, repeat, setup=clear_listings)
+    results["scan.walk.warm"] = measure(walk, repeat)
+
+    tasks = [(full_path, cache_key) for _, _, folder_tasks, _ in walk() for _, _, full_path, cache_key in folder_tasks]
+    with without_metadata_cache(m["metadata_cache"]):
+        results["scan.metadata.extract"] = measure(lambda: scanner.resolve_metadata(tasks), max(1, repeat // 2), items=len(tasks))
+    scanner.resolve_metadata(tasks)  # Fill the cache
+    results["scan.metadata.cached"] = measure(lambda: scanner.resolve_metadata(tasks), repeat, items=len(tasks))
+    results["scan.full"] = measure(lambda: scanner._scan_for_images(root, base_name, True), repeat)
+    results["scan.full.light"] = measure(lambda: scanner._scan_for_images(root, base_name, True, extract_metadata=False), repeat)
+
+    extractor = m["metadata_extractor"]
+    for extension, label in ((".png", "png"), (".jpg", "jpeg")):
+        sample = [path for path, _ in tasks if path.endswith(extension)][:100]
+        if not sample:
+            continue
+        results[f"metadata.build.{label}"] = measure(lambda: [extractor.buildMetadata(path)[0].close() for path in sample], repeat, items=len(sample))
+        results[f"metadata.build_fast.{label}"] = measure(lambda: [extractor.buildMetadataFast(path) for path in sample], repeat, items=len(sample))
+
+    folders, folder_fingerprints = scanner._scan_for_images(root, base_name, True)
+    _, fingerprints, _ = scanner.scan_fingerprints(root, base_name)
+    new_fingerprints = modified_snapshot(fingerprints)
+    detect = m["folder_monitor"].detect_folder_changes
+    results["monitor.detect_folder_changes"] = measure(lambda: detect(fingerprints, new_fingerprints), repeat, items=sum(len(f) for f in fingerprints.values()))
+    handler = m["folder_monitor"].GalleryEventHandler(root)
+    handler.full_rescan()
+    results["monitor.full_rescan.unchanged"] = measure(handler.full_rescan, repeat, items=sum(len(f) for f in fingerprints.values()))
+
+    image_hash = m["image_hash"]
+    if image_hash.get_image_hasher() is not None:
+        images = [(path, cache_key) for path, cache_key in tasks if not path.endswith((".mp4", ".webm", ".wav", ".mp3"))][:200]
+        with without_metadata_cache(m["metadata_cache"]):
+            results["image_hash.compute"] = measure(lambda: image_hash.get_image_hasher().compute(images), max(1, repeat // 2), items=len(images))
+        hashes = dict(enumerate(image_hash.np.random.default_rng(0).integers(0, 2 ** 63, 20000, dtype=image_hash.np.int64).tolist()))
+        results["image_hash.group"] = measure(lambda: image_hash.group_near_duplicates(hashes), repeat, items=len(hashes))
+
+    raw_json = m["raw_json"]
+    results["json.sanitize_dumps"] = measure(lambda: json.dumps(raw_json.sanitize_json_data({"folders": folders})), repeat)
+    results["json.sanitize_dumps_json"] = measure(lambda: raw_json.dumps_json(raw_json.sanitize_json_data({"folders": folders})), repeat)
+    fragment_cache = m["json_fragments"].FragmentCache
+    results["json.fragments.cold"] = measure(lambda: fragment_cache().encode_folders(folders, folder_fingerprints), repeat)
+    warm_fragments = fragment_cache()
+    warm_fragments.encode_folders(folders, folder_fingerprints)
+    results["json.fragments.warm"] = measure(lambda: warm_fragments.encode_folders(folders, folder_fingerprints), repeat)
+    return results, tasks
+
+
+async def run_http(m, root, repeat, tasks):
+    """End-to-end benchmarks of the HTTP handlers, served by aiohttp's test server."""
+    from aiohttp.test_utils import TestClient, TestServer
+    server = m["server"]
+    prompt_server = server.PromptServer.instance
+    if not prompt_server.app.router.routes():
+        prompt_server.app.add_routes(prompt_server.routes)
+    results = {}
+    async with TestClient(TestServer(prompt_server.app)) as client:
+
+        async def get(url, headers=None, expect=200):
+            response = await client.get(url, headers=headers)
+            await response.read()
+            assert response.status == expect, (url, response.status)
+            return response
+
+        results["http.images.full"] = await measure_async(lambda: get("/Gallery/images"), repeat, setup=server.invalidate_listings)
+        results["http.images.repeat"] = await measure_async(lambda: get("/Gallery/images"), repeat)
+        results["http.images.light_page"] = await measure_async(lambda: get("/Gallery/images?mode=light&limit=500"), repeat, setup=server.invalidate_listings)
+        results["http.images.ndjson"] = await measure_async(lambda: get("/Gallery/images?format=ndjson"), repeat, setup=server.invalidate_listings)
+
+        static_dir = os.path.realpath(root)
+        url_prefix = m["folder_scanner"].static_url_prefix(root)  # Mounted by the listings above
+        urls = [url_prefix + os.path.relpath(path, root).replace(os.sep, "/") for path, _ in tasks[:200] if os.path.realpath(path).startswith(static_dir)]
+
+        async def post_metadata():
+            response = await client.post("/Gallery/metadata", json={"urls": urls})
+            await response.read()
+            assert response.status == 200
+
+        results["http.metadata.batch"] = await measure_async(post_metadata, repeat, items=len(urls))
+        results["http.static_file"] = await measure_async(lambda: get(urls[0]), repeat)
+        results["http.search"] = await measure_async(lambda: get("/Gallery/search?q=cyberpunk&limit=100"), repeat)
+        results["http.facets"] = await measure_async(lambda: get("/Gallery/facets"), repeat)
+        if m["image_hash"].get_image_hasher() is not None:
+            results["http.duplicates"] = await measure_async(lambda: get("/Gallery/duplicates"), repeat)
+
+        # With a running monitor listings are versioned and served from the response cache
+        response = await client.post("/Gallery/monitor/start", json={"relative_path": root, "disable_logs": True})
+        assert response.status == 200, await response.text()
+        for _ in range(600):
+            current = server.get_monitor_registry().get(root)
+            if current and current.event_handler.index_ready:
+                break
+            await asyncio.sleep(0.1)
+        try:
+            first = await get("/Gallery/images")
+            etag = first.headers.get("ETag")
+            results["http.images.monitored"] = await measure_async(lambda: get("/Gallery/images"), repeat)
+            results["http.images.not_modified"] = await measure_async(lambda: get("/Gallery/images", {"If-None-Match": etag}, 304), repeat)
+        finally:
+            await client.post("/Gallery/monitor/stop")
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """Prints median ratios against an older results file to stderr, > 1 means slower now."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    for name, result in results.items():
+        if name in baseline and baseline[name]["median"] > 0:
+            ratio = result["median"] / baseline[name]["median"]
+            print(f"{name:40s} {baseline[name]['median'] * 1000:10.2f}ms -> {result['median'] * 1000:10.2f}ms  x{ratio:.2f}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the gallery scanner, metadata and HTTP handlers.")
+    parser.add_argument("--folders", type=int, default=20)
+    parser.add_argument("--pngs", type=int, default=50, help="PNGs with prompt/workflow chunks per folder")
+    parser.add_argument("--jpegs", type=int, default=5, help="JPEGs with EXIF per folder")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tree", help="Use (or generate once into) this directory instead of a temporary one")
+    parser.add_argument("--skip-http", action="store_true")
+    parser.add_argument("--output", help="Write the results JSON here instead of stdout")
+    parser.add_argument("--compare", help="Older results JSON to print median ratios against")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="gallery_bench_")
+    try:
+        root = args.tree or os.path.join(work_dir, "output")
+        if args.tree and os.path.isdir(args.tree) and os.listdir(args.tree):
+            tree = {"root": root, "reused": True}
+        else:
+            tree = generate_tree(root, args.folders, args.pngs, args.jpegs, seed=args.seed)
+        m = load_gallery(root, work_dir)
+
+        results, tasks = run_core(m, root, args.repeat)
+        if not args.skip_http:
+            results.update(asyncio.run(run_http(m, root, args.repeat, tasks)))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "schema": SCHEMA_VERSION,
+        "meta": {
+            "revision": git_revision(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+        },
+        "tree": tree,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+# folder_paths.py
+"""Stand-in for ComfyUI's folder_paths module, the output directory is set by the benchmark runner."""
+import os
+
+output_directory = os.environ.get("GALLERY_BENCH_OUTPUT", os.path.join(os.getcwd(), "output"))
+
+
+def get_output_directory():
+    return output_directory
@@ -0,0 +1,19 @@
+# server.py
+"""Stand-in for ComfyUI's server module: a PromptServer with an aiohttp app and route table that
+records send_sync messages instead of pushing them over websockets."""
+from aiohttp import web
+
+
+class PromptServer:
+    instance = None
+
+    def __init__(self):
+        self.app = web.Application()
+        self.routes = web.RouteTableDef()
+        self.sent = []  # (event, data) passed to send_sync
+
+    def send_sync(self, event, data, sid=None):
+        self.sent.append((event, data))
+
+
+PromptServer.instance = PromptServer()
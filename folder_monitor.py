@@ -1,43 +1,100 @@
 # folder_monitor.py
+import json
 import os
 import time
+import uuid
 import threading
+from collections import deque
 from watchdog.observers import Observer
 from watchdog.observers.polling import PollingObserver
 from watchdog.events import FileSystemEventHandler, PatternMatchingEventHandler
-from .folder_scanner import _scan_for_images  # Import folder scanner
+from .folder_scanner import _fill_metadata, entry_url, scan_fingerprints, scan_single_file, resolve_metadata, static_mount_id, sync_root_caches  # Import folder scanner
+from .metadata_cache import get_metadata_cache
+from .search_index import get_search_index
+from .json_fragments import get_fragment_cache, encode_fields, join_object, json_key
 import asyncio
 from server import PromptServer
 import queue
 from .gallery_config import gallery_log
+from .thumbnail_service import get_thumbnail_service
+from .gallery_stats import get_stats
+
+# Number of Gallery.file_change messages kept for /Gallery/changes catch-up
+CHANGE_LOG_SIZE = 1000
+
+
+def send_encoded(event, data):
+    """send_sync for data that is already encoded JSON. Servers that can write pre-encoded text (a
+    send_encoded_sync(event, message) method) get the whole message as it is, others get the decoded data
+    through send_sync, in the order of the server's message queue."""
+    server = PromptServer.instance
+    send_encoded_sync = getattr(server, "send_encoded_sync", None)
+    if callable(send_encoded_sync):
+        send_encoded_sync(event, join_object([*encode_fields({"type": event}), json_key("data") + data]).decode("utf-8"))
+    else:
+        server.send_sync(event, json.loads(data))
 
 
 class GalleryEventHandler(PatternMatchingEventHandler):
-    """Handles file system events, including symlinks, recursively."""
+    """Handles file system events, including symlinks, recursively.
+
+    Keeps an in-memory index (last_known_folders) and applies debounced watchdog events per path,
+    only a periodic reconcile (or an event it cannot map to files) rescans the whole tree. Changes
+    are detected by file fingerprints (inode, mtime_ns, size), never by comparing entries.
 
-    def __init__(self, base_path, patterns=None, ignore_patterns=None, ignore_directories=False, case_sensitive=True, debounce_interval=0.5, extensions=None, deduplicate_symlinks=True):
+    The index keeps only a packed fingerprint per file: URLs are derived from the folder key when
+    needed, metadata stays in the on-disk metadata cache and is only loaded for changed files."""
+
+    def __init__(self, base_path, patterns=None, ignore_patterns=None, ignore_directories=False, case_sensitive=True, debounce_interval=0.5, extensions=None, deduplicate_symlinks=True, reconcile_interval=300.0):
         super().__init__(patterns=patterns, ignore_patterns=ignore_patterns, ignore_directories=ignore_directories, case_sensitive=case_sensitive)
+        self.watch_path = base_path  # Path given to the observer, event paths are relative to it
         self.base_path = os.path.realpath(base_path)  # Use realpath for base_path
+        self.root_id = static_mount_id(base_path)  # Static mount of the root, tags every change message
         self.debounce_timer = None
         self.debounce_interval = debounce_interval
+        self.reconcile_interval = reconcile_interval
+        self.reconcile_timer = None
         # Use a dictionary to track events, keyed by (event_type, real_path)
         self.processed_events = {}
+        # Paths touched since the last update: path -> True if it may exist now, False if it was removed
+        self.pending_paths = {}
+        self.pending_lock = threading.Lock()
+        self.needs_full_rescan = False
         self.result_queue = queue.Queue()  # Queue for results.
-        self.running_scan = False # Flag to avoid multiple scans at the same time
+        self.scan_lock = threading.Lock()  # Held while a scan runs, to avoid multiple scans at the same time
         self.extensions = extensions
         self.deduplicate_symlinks = deduplicate_symlinks
-        self.last_known_folders = {} # Ensure last_known_folders is initialized empty
+        self.last_known_folders = {}  # folder_key -> filename -> file_fingerprint
+        self.index_ready = False  # Set once the initial full scan populated last_known_folders
+        # Every sent change gets the next seq, clients compare epoch to detect a restarted monitor
+        self.epoch = uuid.uuid4().hex
+        self.seq = 0
+        self.change_log = deque(maxlen=CHANGE_LOG_SIZE)  # (seq, encoded message) of recent changes
+        self.change_lock = threading.Lock()
 
     def on_any_event(self, event):
         """Handles events, including symlinks, with debouncing and duplicate prevention."""
         if event.is_directory:
+            # A moved or deleted folder carries files that produced no events of their own
+            if event.event_type in ('deleted', 'moved'):
+                gallery_log(f"Watchdog detected directory {event.event_type}: {event.src_path} - scheduling full rescan")
+                get_stats().incr("gallery_watchdog_events_total", type=f"directory_{event.event_type}", result="queued")
+                self.needs_full_rescan = True
+                self.debounce_event()
             return
 
-        # Ignore temporary files
-        if event.src_path.endswith(('.swp', '.tmp', '~')):
+        # {path: may_exist} to queue, ignoring temporary files. A save written to a temporary file and
+        # renamed over the target arrives as a move from the temporary path, so the destination still counts
+        if event.event_type == 'moved':
+            event_paths = {event.src_path: False, event.dest_path: True}
+        else:
+            event_paths = {event.src_path: event.event_type != 'deleted'}
+        event_paths = {path: may_exist for path, may_exist in event_paths.items() if not path.endswith(('.swp', '.tmp', '~'))}
+        if not event_paths:
+            get_stats().incr("gallery_watchdog_events_total", type=event.event_type, result="ignored")
             return
 
-        real_path = os.path.realpath(event.src_path)
+        real_path = os.path.realpath(next(iter(event_paths)))
 
         # Check if this event (type + path) has been processed recently
         event_key = (event.event_type, real_path)
@@ -46,6 +103,7 @@ class GalleryEventHandler(PatternMatchingEventHandler):
         if event_key in self.processed_events:
             last_processed_time = self.processed_events[event_key]
             if current_time - last_processed_time < self.debounce_interval:
+                get_stats().incr("gallery_watchdog_events_total", type=event.event_type, result="debounced")
                 return
 
         # Mark this event as processed
@@ -54,6 +112,9 @@ class GalleryEventHandler(PatternMatchingEventHandler):
 
         if event.event_type in ('created', 'deleted', 'modified', 'moved'):
             gallery_log(f"Watchdog detected {event.event_type}: {event.src_path} (Real path: {real_path}) - debouncing")
+            get_stats().incr("gallery_watchdog_events_total", type=event.event_type, result="queued")
+            with self.pending_lock:
+                self.pending_paths.update(event_paths)
             self.debounce_event()
 
 
@@ -63,77 +124,207 @@ class GalleryEventHandler(PatternMatchingEventHandler):
             self.debounce_timer.cancel()
 
         self.debounce_timer = threading.Timer(self.debounce_interval, self.rescan_and_send_changes)
+        self.debounce_timer.daemon = True
         self.debounce_timer.start()
 
-    def rescan_and_send_changes(self):
-        """Rescans, detects changes, sends updates, now thread-safe."""
-        if self.running_scan:
-            gallery_log("Another scan is running, skipping")
+    def rescan_and_send_changes(self, full=False):
+        """Applies pending events to the index (or rescans everything), then sends the changes."""
+        if not self.scan_lock.acquire(blocking=False):
+            gallery_log("Another scan is running, retrying after it")
+            get_stats().incr("gallery_rescans_skipped_total")
+            if full:
+                with self.pending_lock:
+                    self.needs_full_rescan = True  # The retry runs without arguments
+            self.debounce_event()  # Pending paths stay queued for the next attempt
             return
 
-        self.running_scan = True  # Set the flag.
-
-        def thread_target():
-            """Target function for the scanning thread."""
-
-            try:
-                folder_name = os.path.basename(self.base_path)
-                # Pass configured extensions to the scanner
-                new_folders_data, _ = _scan_for_images(self.base_path, folder_name, True, self.extensions, self.deduplicate_symlinks)
-                old_folders_data = self.last_known_folders
-                changes = detect_folder_changes(old_folders_data, new_folders_data)
-
-                # Put results and last_known_folders into the queue.
-                self.result_queue.put((changes, new_folders_data))
-
-
-            except Exception as e:
-                # Put any exception into the queue for the main thread to handle.
-                self.result_queue.put(e)
-
-
-        def on_scan_complete():
-            """Callback to run in the main thread after scanning."""
-            try:
-
-                result = self.result_queue.get()  # Use get - BLOCKING
-
-                if isinstance(result, Exception):
-                    gallery_log(f"FileSystemMonitor: Error during scan: {result}")
-                    return
-
-                changes, new_folders_data = result
-
-                if changes:
-                    gallery_log("FileSystemMonitor: Changes detected after debounce, sending updates")
-                    from .server import sanitize_json_data
-                    # Correctly schedule the send_sync call on the main thread.
-                    PromptServer.instance.send_sync("Gallery.file_change", sanitize_json_data(changes)) # NO ASYNCIO NEEDED
+        try:
+            with self.pending_lock:
+                pending_paths = self.pending_paths
+                self.pending_paths = {}
+                full = full or self.needs_full_rescan or not self.index_ready
+                self.needs_full_rescan = False
+
+            stats = get_stats()
+            kind = "full" if full else "incremental"
+            stats.incr("gallery_rescans_total", kind=kind)
+            with stats.timed("gallery_rescan_seconds", kind=kind):
+                if full:
+                    changes = self.full_rescan()
                 else:
-                    gallery_log("FileSystemMonitor: Changes detected by watchdog, but no relevant gallery changes after debounce.")
-
-                self.last_known_folders = new_folders_data  # Update last_known_folders.
-                self.debounce_timer = None
-            except queue.Empty:
-                gallery_log("FileSystemMonitor: Queue is empty, this shouldn't happen normally.")
+                    changes = self.apply_path_updates(pending_paths)
+
+            if changes["folders"]:
+                gallery_log("FileSystemMonitor: Changes detected after debounce, sending updates")
+                self.prefetch_thumbnails(changes)
+                # Changed entries are in the index now, their fragments are reused by the next listings
+                with stats.timed("gallery_serialize_seconds", endpoint="file_change"):
+                    message = self.record_changes(get_fragment_cache().encode_changes(changes["folders"], self.last_known_folders))
+                send_encoded("Gallery.file_change", message)
+            else:
+                gallery_log("FileSystemMonitor: Changes detected by watchdog, but no relevant gallery changes after debounce.")
+            self.debounce_timer = None
+        except Exception as e:
+            gallery_log(f"FileSystemMonitor: Error during scan: {e}")
+        finally:
+            self.scan_lock.release()  # Release in all cases
+            self._prune_processed_events()
+
+    def apply_local_changes(self, paths, full_rescan=False):
+        """Applies {path: may_exist} for files the gallery changed itself right away, as one update.
+        The watchdog events that follow find the index already up to date and send nothing."""
+        with self.pending_lock:
+            self.pending_paths.update(paths)
+            self.needs_full_rescan = self.needs_full_rescan or full_rescan
+        self.rescan_and_send_changes()
+
+    def record_changes(self, folders):
+        """Builds the change message of encoded changed folders, stamped with the next seq, the epoch and the
+        root, and appends it to the change log. Returns the message as encoded JSON.
+        Messages of every monitored root reach every client, the root lets them skip the ones of other roots."""
+        with self.change_lock:
+            self.seq += 1
+            message = join_object([json_key("folders") + folders, *encode_fields({"seq": self.seq, "epoch": self.epoch, "root": self.root_id})])
+            self.change_log.append((self.seq, message))
+        return message
+
+    def sync_state(self):
+        """Returns (epoch, seq) of the last sent change, a listing taken now includes everything up to it."""
+        with self.change_lock:
+            return self.epoch, self.seq
+
+    def changes_since(self, since):
+        """Returns the encoded change messages after seq since, or None if the log no longer reaches back that far."""
+        with self.change_lock:
+            if since > self.seq:
+                return None
+            oldest = self.change_log[0][0] if self.change_log else self.seq + 1
+            if since < oldest - 1:
+                return None
+            return [message for seq, message in self.change_log if seq > since]
+
+    def full_rescan(self):
+        """Rescans the whole tree and diffs it against the index. Used initially and as a safety net.
+
+        Only fingerprints are compared, metadata is resolved afterwards for new and modified files only."""
+        folder_name = os.path.basename(self.base_path)
+        # Pass configured extensions to the scanner
+        new_folders_data, new_fingerprints, metadata_tasks = scan_fingerprints(self.base_path, folder_name, self.extensions, self.deduplicate_symlinks)
+        folder_diffs = detect_folder_changes(self.last_known_folders, new_fingerprints)
+        _fill_metadata(new_folders_data, [task for task in metadata_tasks if task[1] in folder_diffs.get(task[0], ())], True)
+        sync_root_caches(self.base_path, new_folders_data, metadata_tasks)
+
+        changes = {"folders": {}}
+        for folder_key, folder_diff in folder_diffs.items():
+            changes["folders"][folder_key] = {
+                filename: {"action": "remove"} if action == "remove" else {"action": action, **new_folders_data[folder_key][filename]}
+                for filename, action in folder_diff.items()
+            }
+        self.last_known_folders = new_fingerprints
+        self.index_ready = True
+        return changes
+
+    def apply_path_updates(self, pending_paths):
+        """Updates the index for the given paths only: O(changed files), not O(tree)."""
+        changes = {"folders": {}}
+        folder_name = os.path.basename(self.base_path)
+        updated = []  # (path, (folder_key, entry, cache_key, fingerprint)) for new or modified files
+        removed_real_paths = []
+        removed_urls = []
+        for path in pending_paths:
+            # Check the file itself rather than the event type: events can arrive after the gallery
+            # already changed the path again (e.g. a file deleted, then another moved to its place)
+            result = scan_single_file(path, self.watch_path, folder_name, self.extensions)
+            if result is not None:
+                folder_key, entry, _, fingerprint = result
+                if self.last_known_folders.get(folder_key, {}).get(entry["name"]) == fingerprint:
+                    continue  # Already indexed as it is, e.g. a change the gallery applied itself
+                updated.append((path, result))
+                continue
+            # Deleted, moved away, or no longer a gallery file: drop it from the index
+            location = self._locate(path)
+            if location is None:
+                continue
+            folder_key, filename = location
+            folder = self.last_known_folders.get(folder_key)
+            if folder is not None and folder.pop(filename, None) is not None:
+                changes["folders"].setdefault(folder_key, {})[filename] = {"action": "remove"}
+                removed_real_paths.append(os.path.realpath(path))
+                removed_urls.append(entry_url(folder_key, filename, folder_name, self.watch_path))
+                if not folder:
+                    del self.last_known_folders[folder_key]
+
+        # Metadata only for files whose fingerprint changed
+        metadata_by_path = resolve_metadata([(path, cache_key) for path, (_, _, cache_key, _) in updated if cache_key is not None])
+        indexed = []
+        for path, (folder_key, entry, cache_key, fingerprint) in updated:
+            if cache_key is not None:
+                entry["metadata"] = metadata_by_path.get(path, {})
+            folder = self.last_known_folders.setdefault(folder_key, {})
+            action = "create" if entry["name"] not in folder else "update"
+            folder[entry["name"]] = fingerprint
+            indexed.append((folder_key, entry))
+            changes["folders"].setdefault(folder_key, {})[entry["name"]] = {"action": action, **entry}
+
+        if removed_real_paths:
+            cache = get_metadata_cache()
+            if cache is not None:
+                cache.discard(removed_real_paths)
+        if indexed or removed_urls:
+            index = get_search_index()
+            if index is not None:
+                index.update(self.base_path, indexed, removed_urls)
+        return changes
+
+    def _locate(self, path):
+        """Maps a path under the watched folder to its (folder_key, filename) index key."""
+        relative_path = os.path.relpath(os.path.dirname(path), self.watch_path)
+        if relative_path.split(os.sep)[0] == "..":
+            return None
+        folder_name = os.path.basename(self.base_path)
+        folder_key = folder_name if relative_path == "." else os.path.join(folder_name, relative_path).replace("\\", "/")
+        return folder_key, os.path.basename(path)
+
+    def _prune_processed_events(self):
+        """Forgets debounce bookkeeping older than the debounce interval so it does not grow forever."""
+        cutoff = time.time() - self.debounce_interval
+        self.processed_events = {key: ts for key, ts in list(self.processed_events.items()) if ts >= cutoff}
+
+    def start_reconcile_timer(self):
+        """Schedules the periodic full reconcile that catches events watchdog missed."""
+        if not self.reconcile_interval:
+            return
+        self.reconcile_timer = threading.Timer(self.reconcile_interval, self._reconcile)
+        self.reconcile_timer.daemon = True
+        self.reconcile_timer.start()
 
-            finally:
-                self.running_scan = False #Clear flag in all cases
+    def stop_reconcile_timer(self):
+        if self.reconcile_timer:
+            self.reconcile_timer.cancel()
+            self.reconcile_timer = None
 
-        # Start the scan in a separate thread.
-        scan_thread = threading.Thread(target=thread_target)
-        scan_thread.start()
+    def _reconcile(self):
+        gallery_log("FileSystemMonitor: Periodic reconcile")
+        self.rescan_and_send_changes(full=True)
+        if self.reconcile_timer is not None:
+            self.start_reconcile_timer()
 
-        #Schedule the callback to be called when the scan is complete.
-        scan_thread.join() # Wait for the scan thread to actually complete!
-        on_scan_complete() # THEN call the completion function, now guaranteed to have data.
+    def prefetch_thumbnails(self, changes):
+        """Queues thumbnails for created or updated images so they are ready before the client asks."""
+        thumbnails = get_thumbnail_service()
+        parent_dir = os.path.dirname(self.base_path)
+        for folder_key, folder_changes in changes.get("folders", {}).items():
+            for filename, change in folder_changes.items():
+                if change.get("action") in ("create", "update") and change.get("type") == "image":
+                    # Folder keys start with the monitored folder's name, relative to its parent
+                    thumbnails.prefetch(os.path.join(parent_dir, folder_key, filename))
 
 
 
 class FileSystemMonitor:
     """Monitors the output directory, including symlinks, recursively."""
 
-    def __init__(self, base_path, interval=1.0, use_polling_observer=False, extensions=None, deduplicate_symlinks=True):
+    def __init__(self, base_path, interval=1.0, use_polling_observer=False, extensions=None, deduplicate_symlinks=True, reconcile_interval=300.0):
         self.base_path = base_path
         self.interval = interval
         self.use_polling_observer = use_polling_observer
@@ -150,11 +341,12 @@ class FileSystemMonitor:
         else:
             patterns = ["*"]
 
-        self.event_handler = GalleryEventHandler(base_path=base_path, patterns=patterns, debounce_interval=0.5, extensions=self.extensions, deduplicate_symlinks=self.deduplicate_symlinks)
+        self.event_handler = GalleryEventHandler(base_path=base_path, patterns=patterns, debounce_interval=0.5, extensions=self.extensions, deduplicate_symlinks=self.deduplicate_symlinks, reconcile_interval=reconcile_interval)
 
         # Do NOT perform a blocking scan in __init__ to avoid startup freeze.
         # Initial scan will be performed in the observer thread.
         self.thread = None
+        self.stopped = threading.Event()
 
     def start_monitoring(self):
         """Starts the Watchdog observer."""
@@ -168,26 +360,28 @@ class FileSystemMonitor:
     def _start_observer_thread(self):
         # Perform an initial background scan before scheduling the observer
         try:
-            folder_name = os.path.basename(self.base_path)
             gallery_log("FileSystemMonitor: Starting initial background scan...")
-            initial_data, _ = _scan_for_images(self.base_path, folder_name, True, self.extensions, self.deduplicate_symlinks)
-            self.event_handler.last_known_folders = initial_data
+            # Held like any other scan, so local changes arriving meanwhile wait for it instead of racing it
+            with self.event_handler.scan_lock:
+                self.event_handler.full_rescan()  # Against the empty index: everything is new, nothing is sent
             gallery_log("FileSystemMonitor: Initial background scan complete.")
         except Exception as e:
             gallery_log(f"FileSystemMonitor: Error during initial scan: {e}")
+        if self.stopped.is_set():
+            return  # Stopped during the initial scan, the observer was never started
 
         self.observer.schedule(self.event_handler, self.base_path, recursive=True)
         self.observer.follow_directory_symlinks = True  # Ensure symlinks are followed
         self.observer.start()
-        try:
-            while True:
-                time.sleep(0.1)
-        except KeyboardInterrupt:
-            self.stop_monitoring()
+        self.event_handler.start_reconcile_timer()
+        # The observer runs on its own thread, this one only has to live as long as the monitor
+        self.stopped.wait()
 
     def stop_monitoring(self):
         """Stops the Watchdog observer."""
         if self.thread and self.thread.is_alive():
+            self.stopped.set()
+            self.event_handler.stop_reconcile_timer()
             self.observer.stop()
             if self.observer.is_alive():
                 self.observer.join()
@@ -199,32 +393,25 @@ class FileSystemMonitor:
 
 
 # --- Helper function to detect folder changes ---
-def detect_folder_changes(old_folders, new_folders):
-    """Detects changes between two folder data dictionaries."""
-    changes = {"folders": {}}
-
-    all_folders = set(old_folders.keys()) | set(new_folders.keys())
-    for folder_name in all_folders:
-        old_folder = old_folders.get(folder_name, {})
-        new_folder = new_folders.get(folder_name, {})
+def detect_folder_changes(old_fingerprints, new_fingerprints):
+    """Detects changes between two {folder_key: {filename: fingerprint}} maps in O(files).
+
+    Returns {folder_key: {filename: "create" | "update" | "remove"}} for the folders with changes."""
+    changes = {}
+    for folder_key in old_fingerprints.keys() | new_fingerprints.keys():
+        old_files = old_fingerprints.get(folder_key, {})
+        new_files = new_fingerprints.get(folder_key, {})
+        if old_files == new_files:  # Fast path for unchanged folders, compares packed 24-byte fingerprints only
+            continue
         folder_changes = {}
-
-        old_files = set(old_folder.keys())
-        new_files = set(new_folder.keys())
-        all_files = old_files | new_files
-
-        for filename in all_files:
-            old_file_data = old_folder.get(filename)
-            new_file_data = new_folder.get(filename)
-
-            if filename not in old_folder: # New file
-                folder_changes[filename] = {"action": "create", **new_file_data}
-            elif filename not in new_folder: # Removed file
-                folder_changes[filename] = {"action": "remove"}
-            elif old_file_data != new_file_data: # Updated file (simplistic comparison)
-                folder_changes[filename] = {"action": "update", **new_file_data}
-
+        for filename, fingerprint in new_files.items():
+            old_fingerprint = old_files.get(filename)
+            if old_fingerprint is None:
+                folder_changes[filename] = "create"
+            elif old_fingerprint != fingerprint:
+                folder_changes[filename] = "update"
+        for filename in old_files.keys() - new_files.keys():
+            folder_changes[filename] = "remove"
         if folder_changes:
-            changes["folders"][folder_name] = folder_changes
-
-    return changes
\ No newline at end of file
+            changes[folder_key] = folder_changes
+    return changes
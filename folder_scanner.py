@@ -1,8 +1,23 @@
 # folder_scanner.py
+import hashlib
 import os
+import stat as stat_module
+import struct
 from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from .metadata_extractor import buildMetadata  # Import metadata extractor
+from concurrent.futures.process import BrokenProcessPool
+from . import gallery_config
+from .metadata_extractor import buildMetadataFast, listed_stat, read_resolution  # Import metadata extractor
+from .metadata_cache import get_metadata_cache
+from .media_metadata import MEDIA_EXTENSIONS
+from .raw_json import encode_metadata, decode_metadata
+from .worker_pool import create_worker_pool, load_worker_module
+from .search_index import get_search_index
+from .gallery_stats import get_stats
+from .image_hash import get_image_hasher
 
 # Default extensions include images, media, audio, and 3D
 DEFAULT_EXTENSIONS = [
@@ -23,128 +38,545 @@ for _ext in ['.wav', '.mp3', '.m4a', '.flac']:
 for _ext in ['.obj', '.glb', '.gltf', '.fbx', '.stl', '.usd', '.usdz']:
     _EXT_TYPE_MAP[_ext] = '3d'
 
+def get_file_type(filename):
+    """Returns the gallery type ('image', 'media', 'audio', '3d' or 'unknown') for a file name."""
+    return _EXT_TYPE_MAP.get(os.path.splitext(filename.lower())[1], "unknown")
+
+# Threads listing directories ahead of the walk, enough to hide network filesystem latency
+_WALK_WORKERS = 16
+# Reused directory listings: dir_path -> (mtime_ns, real_dir, file_names, subdirectories), file_names
+# as (name, is_symlink), the files themselves are stat'ed on every listing
+_listings = OrderedDict()
+_listed_files = 0
+_listing_lock = threading.Lock()
+_LISTING_CACHE_MAX_FILES = 1000000
+# Listings are only reused for directories whose mtime was this much older than the listing
+_LISTING_MTIME_SLACK_NS = 2 * 10**9
+
 # Max threads for parallel metadata extraction
 _METADATA_WORKERS = min(8, (os.cpu_count() or 4))
+# Process backend: images per task sent to a worker, and the fewest pending images worth the IPC
+_PROCESS_CHUNK_SIZE = 64
+_PROCESS_MIN_TASKS = 32
+
+# File fingerprints: inode (128-bit file IDs on some Windows filesystems are truncated), mtime_ns, size
+_FINGERPRINT = struct.Struct("<QqQ")
+_INODE_MASK = (1 << 64) - 1
 
-def _extract_metadata_safe(full_path):
+_metadata_pool = None
+_metadata_pool_workers = 0
+_metadata_pool_lock = threading.Lock()
+
+def _metadata_format(full_path):
+    """Format label of the extraction stats: the lowercase extension."""
+    return os.path.splitext(full_path)[1].lower().lstrip(".") or "none"
+
+def _extract_metadata_safe(full_path, stat=None):
     """Extract metadata for a single image file, returning (full_path, metadata) or (full_path, {}) on error."""
-    try:
-        _, _, metadata = buildMetadata(full_path)
-        return (full_path, metadata)
-    except Exception as e:
-        print(f"Gallery Node: Error building metadata for {full_path}: {e}")
-        return (full_path, {})
+    with get_stats().timed("gallery_metadata_extract_seconds", format=_metadata_format(full_path), backend="threads"):
+        try:
+            metadata = buildMetadataFast(full_path, stat)
+            return (full_path, metadata)
+        except Exception as e:
+            print(f"Gallery Node: Error building metadata for {full_path}: {e}")
+            return (full_path, {})
+
+def file_fingerprint(stat):
+    """Cheap change detection key of a file: inode, mtime_ns and size packed into 24 bytes. Equal
+    fingerprints mean the indexed entry and its metadata are still valid, no need to re-read anything.
+    One small bytes object per file keeps large indexes compact, three ints in a tuple are ~3x larger."""
+    return _FINGERPRINT.pack(stat.st_ino & _INODE_MASK, stat.st_mtime_ns, stat.st_size)
+
+def static_mount_id(full_base_path):
+    """Stable id of a scanned root, the first segment of its /static_gallery URLs. Derived from the real
+    path, so it is the same for every listing and monitor of the root and survives restarts."""
+    return hashlib.sha1(os.path.realpath(full_base_path).encode("utf-8", "surrogateescape")).hexdigest()[:12]
+
+def static_url_prefix(full_base_path):
+    """The /static_gallery/<mount>/ prefix of the URLs of files under full_base_path."""
+    return f"/static_gallery/{static_mount_id(full_base_path)}/"
 
-def _scan_for_images(full_base_path, base_path, include_subfolders, allowed_extensions=None, deduplicate_symlinks=True):
-    """Scans directories for files matching allowed extensions."""
+def entry_url(folder_key, filename, base_path, full_base_path):
+    """The /static_gallery URL the scanner gives a file, derived from its folder key."""
+    subfolder = folder_key[len(base_path) + 1:] if folder_key != base_path else ""
+    return (static_url_prefix(full_base_path) + (f"{subfolder}/{filename}" if subfolder else filename)).replace("\\", "/")
+
+def normalize_extensions(allowed_extensions=None):
+    """Normalize extensions to a lowercase, dot-prefixed tuple for str.endswith checks."""
     if allowed_extensions is None:
         allowed_extensions = DEFAULT_EXTENSIONS
-
-    # Normalize extensions to a tuple for str.endswith checks
-    allowed_extensions_tuple = tuple(
-        ext.lower() if ext.startswith('.') else f".{ext.lower()}" 
+    return tuple(
+        ext.lower() if ext.startswith('.') else f".{ext.lower()}"
         for ext in allowed_extensions
     )
 
-    folders_data = {}
-    current_files = set()
-    changed = False
+def scan_single_file(full_path, full_base_path, base_path, allowed_extensions=None):
+    """Builds the entry _scan_for_images would produce for one file, without touching the rest of the tree.
+
+    Returns (folder_key, entry, cache_key, fingerprint) with entry["metadata"] still empty (cache_key is None
+    for files without metadata, otherwise the key for resolve_metadata), or None if the file is gone or not listed."""
+    entry_name = os.path.basename(full_path)
+    lower_entry = entry_name.lower()
+    if not lower_entry.endswith(normalize_extensions(allowed_extensions)):
+        return None
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        return None
+    if not stat_module.S_ISREG(stat.st_mode):
+        return None
+
+    relative_path = os.path.relpath(os.path.dirname(full_path), full_base_path)
+    if relative_path == ".":
+        relative_path = ""
+    parts = relative_path.split(os.sep) if relative_path else []
+    # Outside the scanned tree, or inside a hidden folder the scanner skips
+    if parts and (parts[0] == ".." or any(part.startswith(".") for part in parts)):
+        return None
+
+    folder_key = os.path.join(base_path, relative_path).replace("\\", "/") if relative_path else base_path
+    subfolder_prefix = static_url_prefix(full_base_path) + (f"{relative_path}/" if relative_path else "")
+    file_type = _EXT_TYPE_MAP.get(os.path.splitext(lower_entry)[1], "unknown")
+    entry = {
+        "name": entry_name,
+        "url": (subfolder_prefix + entry_name).replace("\\", "/"),
+        "timestamp": stat.st_mtime,
+        "date": datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d %H:%M:%S"),
+        "metadata": {},
+        "type": file_type
+    }
+    has_metadata = file_type == "image" or lower_entry.endswith(MEDIA_EXTENSIONS)
+    cache_key = (os.path.realpath(full_path), stat.st_mtime_ns, stat.st_size) if has_metadata else None
+    return folder_key, entry, cache_key, file_fingerprint(stat)
+
+def _read_resolution_safe(full_path):
+    """Read "WIDTHxHEIGHT" from the image header, or None on error."""
+    try:
+        return read_resolution(full_path)
+    except Exception as e:
+        print(f"Gallery Node: Error reading resolution for {full_path}: {e}")
+        return None
+
+def _list_directory(dir_path):
+    """Lists one directory for _walk_folders: returns (real_dir, file_entries, subdirectories) with
+    file_entries as (full_path, name, stat, real_path) and subdirectories as (path, name).
+
+    The names of a directory whose mtime did not change since it was last listed are reused, which
+    saves the readdir on slow (network) filesystems. Files are stat'ed on every listing, writing into
+    an existing file in place does not change the directory mtime but must still change its fingerprint."""
+    # Resolve real path to detect symlink cycles
+    real_dir = os.path.realpath(dir_path)
+    dir_mtime_ns = os.stat(dir_path).st_mtime_ns
+    with _listing_lock:
+        cached = _listings.get(dir_path)
+        if cached is not None and cached[0] == dir_mtime_ns and cached[1] == real_dir:
+            _listings.move_to_end(dir_path)
+    if cached is not None and cached[0] == dir_mtime_ns and cached[1] == real_dir:
+        file_entries = []
+        for name, is_symlink in cached[2]:
+            full_path = os.path.join(dir_path, name)
+            try:
+                stat = os.stat(full_path)
+                real_path = os.path.realpath(full_path) if is_symlink else os.path.join(real_dir, name)
+            except OSError:
+                continue
+            file_entries.append((full_path, name, stat, real_path))
+        return real_dir, file_entries, cached[3]
+
+    listed_at_ns = time.time_ns()
+    file_names = []
+    file_entries = []
+    subdirectories = []
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=True):
+                subdirectories.append((entry.path, entry.name))
+            elif entry.is_file(follow_symlinks=True):
+                # Only symlinked files need their own realpath, others live in real_dir
+                is_symlink = entry.is_symlink()
+                real_path = os.path.realpath(entry.path) if is_symlink else os.path.join(real_dir, entry.name)
+                file_names.append((entry.name, is_symlink))
+                file_entries.append((entry.path, entry.name, entry.stat(follow_symlinks=True), real_path))
+
+    # A change within the mtime granularity of the listing would not change the mtime, only
+    # listings of directories that were already quiet when listed are reused
+    if dir_mtime_ns < listed_at_ns - _LISTING_MTIME_SLACK_NS:
+        global _listed_files
+        with _listing_lock:
+            previous = _listings.pop(dir_path, None)
+            if previous is not None:
+                _listed_files -= len(previous[2])
+            _listings[dir_path] = (dir_mtime_ns, real_dir, file_names, subdirectories)
+            _listed_files += len(file_names)
+            while _listed_files > _LISTING_CACHE_MAX_FILES and len(_listings) > 1:
+                _, evicted = _listings.popitem(last=False)
+                _listed_files -= len(evicted[2])
+    return real_dir, file_entries, subdirectories
+
+class _DeferredListing:
+    """Listing of a serial walk: the directory is listed on the walking thread when the walk gets to it."""
+
+    def __init__(self, dir_path):
+        self.dir_path = dir_path
+
+    def result(self):
+        return _list_directory(self.dir_path)
+
+
+def _walk_folders(full_base_path, base_path, include_subfolders, allowed_extensions=None, deduplicate_symlinks=True, extract_metadata=True, walk_workers=_WALK_WORKERS):
+    """Walks the tree and yields (folder_key, folder_content, metadata_tasks, fingerprints) per folder with content.
+
+    A folder is yielded before its subfolders. Entries still have empty metadata, metadata_tasks
+    lists (folder_key, filename, full_path, cache_key) for the images that need it and fingerprints
+    maps every filename to its file_fingerprint.
+
+    Directories are listed ahead on a thread pool as soon as their parent is listed, while folders
+    are consumed in the same depth-first order as a serial walk, so symlink deduplication keeps
+    its first-seen-wins result. With walk_workers=1 nothing is listed ahead, each directory is listed
+    on the calling thread once the walk gets to it."""
+    allowed_extensions_tuple = normalize_extensions(allowed_extensions)
     # Global visited set: used when deduplicate_symlinks is True to show content only once
     visited_dirs = set() if deduplicate_symlinks else None
-    # Collect image paths that need metadata extraction
-    metadata_tasks = []  # list of (folder_key, filename, full_path)
-
-    def scan_directory(dir_path, relative_path="", ancestor_real_paths=None):
-        """Recursively scans a directory for files matching allowed extensions."""
-        nonlocal changed
-        # Resolve real path to detect symlink cycles
-        real_dir = os.path.realpath(dir_path)
-
-        if deduplicate_symlinks:
-            # Global deduplication: skip if this real path was already scanned anywhere
-            if real_dir in visited_dirs:
-                return
-            visited_dirs.add(real_dir)
-        else:
-            # Stack-based cycle detection: only skip if this real path is an ancestor
-            # in the current recursion chain (prevents infinite loops but allows
-            # the same directory to appear in multiple branches of the tree)
-            if ancestor_real_paths is None:
-                ancestor_real_paths = set()
-            if real_dir in ancestor_real_paths:
-                return  # Cycle detected — skip to avoid infinite recursion
-            ancestor_real_paths = ancestor_real_paths | {real_dir}  # New set for this branch
-
-        folder_content = {}  # Dictionary to hold files for the current folder
-        try:
-            with os.scandir(dir_path) as it:
-                file_entries = []
-                for entry in it:
-                    if entry.is_dir(follow_symlinks=True):
-                        if include_subfolders and not entry.name.startswith("."):
-                            next_relative_path = os.path.join(relative_path, entry.name)
-                            scan_directory(entry.path, next_relative_path, ancestor_real_paths if not deduplicate_symlinks else None)
-                    elif entry.is_file(follow_symlinks=True):
-                        file_entries.append((entry.path, entry.name, entry.stat(follow_symlinks=True)))
-                        current_files.add(entry.path)
-
-            # Pre-compute subfolder string once per directory
-            rel_path = os.path.relpath(dir_path, full_base_path)
-            subfolder = rel_path if rel_path != "." else ""
-            subfolder_prefix = f"/static_gallery/{subfolder}/" if subfolder else "/static_gallery/"
-
-            for full_path, entry_name, stat in file_entries:
-                lower_entry = entry_name.lower()
-                if lower_entry.endswith(allowed_extensions_tuple):
-                    try:
-                        timestamp = stat.st_mtime
-                        date_str = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
-                        url_path = (subfolder_prefix + entry_name).replace("\\", "/")
-
-                        ext = os.path.splitext(lower_entry)[1]
-                        file_type = _EXT_TYPE_MAP.get(ext, "unknown")
-
-                        folder_content[entry_name] = { 
-                            "name": entry_name,
-                            "url": url_path,
-                            "timestamp": timestamp,
-                            "date": date_str,
-                            "metadata": {},  # Placeholder — filled in parallel below
-                            "type": file_type
-                        }
-
-                        # Queue metadata extraction for images (the slow part)
-                        if file_type == "image":
-                            folder_key = os.path.join(base_path, relative_path).replace("\\", "/") if relative_path else base_path
-                            metadata_tasks.append((folder_key, entry_name, full_path))
-
-                    except Exception as e:
-                        print(f"Gallery Node: Error processing file {full_path}: {e}")
-
-            folder_key = os.path.join(base_path, relative_path).replace("\\", "/") if relative_path else base_path
+    url_prefix = static_url_prefix(full_base_path)
+    executor = ThreadPoolExecutor(max_workers=walk_workers) if walk_workers > 1 else None
+    list_ahead = (lambda path: executor.submit(_list_directory, path)) if executor is not None else _DeferredListing
+    try:
+        # Depth-first stack of (dir_path, relative_path, ancestor_real_paths, listing future)
+        stack = [(full_base_path, "", None, list_ahead(full_base_path))]
+        while stack:
+            dir_path, relative_path, ancestor_real_paths, listing = stack.pop()
+            try:
+                real_dir, file_entries, subdirectories = listing.result()
+            except Exception as e:
+                print(f"Gallery Node: Error scanning directory {dir_path}: {e}")
+                continue
+
+            if deduplicate_symlinks:
+                # Global deduplication: skip if this real path was already scanned anywhere
+                if real_dir in visited_dirs:
+                    continue
+                visited_dirs.add(real_dir)
+            else:
+                # Stack-based cycle detection: only skip if this real path is an ancestor
+                # in the current recursion chain (prevents infinite loops but allows
+                # the same directory to appear in multiple branches of the tree)
+                if ancestor_real_paths is None:
+                    ancestor_real_paths = set()
+                if real_dir in ancestor_real_paths:
+                    continue  # Cycle detected — skip to avoid infinite recursion
+                ancestor_real_paths = ancestor_real_paths | {real_dir}  # New set for this branch
+
+            folder_key, folder_content, metadata_tasks, fingerprints = _build_folder(
+                dir_path, relative_path, full_base_path, base_path, url_prefix, file_entries, allowed_extensions_tuple, extract_metadata
+            )
+            if include_subfolders:
+                children = [
+                    (path, os.path.join(relative_path, name), ancestor_real_paths if not deduplicate_symlinks else None, list_ahead(path))
+                    for path, name in subdirectories if not name.startswith(".")
+                ]
+                stack.extend(reversed(children))  # First subfolder is popped first
+
             if folder_content:  # Only add folder if it has content
-                folders_data[folder_key] = folder_content
+                yield folder_key, folder_content, metadata_tasks, fingerprints
+    finally:
+        # Listings queued for an abandoned walk are not needed anymore
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
 
-        except Exception as e:
-            print(f"Gallery Node: Error scanning directory {dir_path}: {e}")
 
-    # Phase 1: Fast directory walk (no file I/O beyond stat)
-    scan_directory(full_base_path, "")
+def _build_folder(dir_path, relative_path, full_base_path, base_path, url_prefix, file_entries, allowed_extensions_tuple, extract_metadata):
+    """Builds the entries of one listed folder, returns (folder_key, folder_content, metadata_tasks, fingerprints)."""
+    folder_content = {}  # Dictionary to hold files for the current folder
+    metadata_tasks = []  # Images of this folder that need metadata
+    fingerprints = {}
+    folder_key = os.path.join(base_path, relative_path).replace("\\", "/") if relative_path else base_path
+
+    # Pre-compute subfolder string once per directory
+    rel_path = os.path.relpath(dir_path, full_base_path)
+    subfolder = rel_path if rel_path != "." else ""
+    subfolder_prefix = url_prefix + (f"{subfolder}/" if subfolder else "")
+
+    for full_path, entry_name, stat, real_path in file_entries:
+        lower_entry = entry_name.lower()
+        if lower_entry.endswith(allowed_extensions_tuple):
+            try:
+                timestamp = stat.st_mtime
+                url_path = (subfolder_prefix + entry_name).replace("\\", "/")
+
+                ext = os.path.splitext(lower_entry)[1]
+                file_type = _EXT_TYPE_MAP.get(ext, "unknown")
+
+                if extract_metadata:
+                    folder_content[entry_name] = { 
+                        "name": entry_name,
+                        "url": url_path,
+                        "timestamp": timestamp,
+                        "date": datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S"),
+                        "metadata": {},  # Placeholder — filled in parallel later
+                        "type": file_type
+                    }
+                else:
+                    folder_content[entry_name] = {
+                        "name": entry_name,
+                        "url": url_path,
+                        "timestamp": timestamp,
+                        "date": datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S"),
+                        "type": file_type
+                    }
+                fingerprints[entry_name] = file_fingerprint(stat)
+
+                # Queue metadata extraction for images and media containers (the slow part)
+                if file_type == "image" or ext in MEDIA_EXTENSIONS:
+                    metadata_tasks.append((folder_key, entry_name, full_path, (real_path, stat.st_mtime_ns, stat.st_size)))
 
-    # Phase 2: Parallel metadata extraction for image files
-    if metadata_tasks:
+            except Exception as e:
+                print(f"Gallery Node: Error processing file {full_path}: {e}")
+
+    return folder_key, folder_content, metadata_tasks, fingerprints
+
+
+def _fill_metadata(folders_data, metadata_tasks, extract_metadata):
+    """Fills metadata (or, for light listings, the resolution) of the queued images in place."""
+    if not metadata_tasks:
+        return
+    if not extract_metadata:
+        # Light listing: no metadata, only the resolution, from the metadata cache or else the file header
+        cache = get_metadata_cache()
+        cached = cache.get_resolutions([cache_key for _, _, _, cache_key in metadata_tasks]) if cache is not None else {}
+        misses = [task for task in metadata_tasks if task[3][0] not in cached]
         with ThreadPoolExecutor(max_workers=_METADATA_WORKERS) as executor:
-            future_to_key = {
-                executor.submit(_extract_metadata_safe, full_path): (folder_key, filename)
-                for folder_key, filename, full_path in metadata_tasks
-            }
-            for future in as_completed(future_to_key):
-                folder_key, filename = future_to_key[future]
-                try:
-                    _, metadata = future.result()
-                    if folder_key in folders_data and filename in folders_data[folder_key]:
-                        folders_data[folder_key][filename]["metadata"] = metadata
-                except Exception as e:
-                    print(f"Gallery Node: Error in metadata thread for {filename}: {e}")
-
-    return folders_data, changed
\ No newline at end of file
+            read = dict(zip([full_path for _, _, full_path, _ in misses], executor.map(_read_resolution_safe, [full_path for _, _, full_path, _ in misses])))
+        for folder_key, filename, full_path, cache_key in metadata_tasks:
+            entry = folders_data.get(folder_key, {}).get(filename)
+            if entry is not None:
+                entry["resolution"] = cached[cache_key[0]] if cache_key[0] in cached else read.get(full_path)
+        return
+
+    # Cached or parallel metadata extraction for image and media files
+    metadata_by_path = resolve_metadata([(full_path, cache_key) for _, _, full_path, cache_key in metadata_tasks])
+    for folder_key, filename, full_path, _ in metadata_tasks:
+        if folder_key in folders_data and filename in folders_data[folder_key]:
+            folders_data[folder_key][filename]["metadata"] = metadata_by_path.get(full_path, {})
+
+
+def _scan_for_images(full_base_path, base_path, include_subfolders, allowed_extensions=None, deduplicate_symlinks=True, extract_metadata=True):
+    """Scans directories for files matching allowed extensions.
+
+    With extract_metadata=False entries carry only name/url/timestamp/type plus the
+    image resolution, metadata is then fetched on demand through resolve_metadata.
+    Returns (folders_data, fingerprints) with fingerprints as {folder_key: {filename: fingerprint}}."""
+    folders_data = {}
+    fingerprints = {}
+    # Collect image paths that need metadata extraction
+    metadata_tasks = []  # list of (folder_key, filename, full_path, cache_key)
+    stats = get_stats()
+
+    # Phase 1: Fast directory walk (no file I/O beyond stat)
+    with stats.timed("gallery_scan_phase_seconds", phase="walk"):
+        for folder_key, folder_content, folder_tasks, folder_fingerprints in _walk_folders(full_base_path, base_path, include_subfolders, allowed_extensions, deduplicate_symlinks, extract_metadata):
+            folders_data[folder_key] = folder_content
+            fingerprints[folder_key] = folder_fingerprints
+            metadata_tasks.extend(folder_tasks)
+
+    # Phase 2: Metadata for all images at once, so the pool stays busy across folders
+    with stats.timed("gallery_scan_phase_seconds", phase="metadata" if extract_metadata else "resolution"):
+        _fill_metadata(folders_data, metadata_tasks, extract_metadata)
+
+    if extract_metadata and include_subfolders:
+        sync_root_caches(full_base_path, folders_data, metadata_tasks)
+
+    return folders_data, fingerprints
+
+
+def sync_root_caches(full_base_path, folders_data, metadata_tasks):
+    """Brings the metadata cache and the search index in line with a complete scan of full_base_path."""
+    with get_stats().timed("gallery_scan_phase_seconds", phase="index"):
+        cache = get_metadata_cache()
+        if cache is not None:
+            try:
+                cache.purge_missing(os.path.realpath(full_base_path), {cache_key[0] for _, _, _, cache_key in metadata_tasks})
+            except Exception as e:
+                print(f"Gallery Node: Error updating metadata cache: {e}")
+        index = get_search_index()
+        if index is not None:
+            try:
+                index.sync_root(os.path.realpath(full_base_path), folders_data)
+            except Exception as e:
+                print(f"Gallery Node: Error updating search index: {e}")
+
+
+def scan_fingerprints(full_base_path, base_path, allowed_extensions=None, deduplicate_symlinks=True, extract_metadata=True):
+    """Walks the whole tree without reading any file: returns (folders_data, fingerprints, metadata_tasks)
+    with empty metadata in the entries (light entries with extract_metadata=False), fingerprints as
+    {folder_key: {filename: fingerprint}}. Callers diff the fingerprints, or pick a page, and fill
+    metadata (_fill_metadata) for those files only."""
+    folders_data = {}
+    fingerprints = {}
+    metadata_tasks = []
+    with get_stats().timed("gallery_scan_phase_seconds", phase="walk"):
+        for folder_key, folder_content, folder_tasks, folder_fingerprints in _walk_folders(full_base_path, base_path, True, allowed_extensions, deduplicate_symlinks, extract_metadata):
+            folders_data[folder_key] = folder_content
+            fingerprints[folder_key] = folder_fingerprints
+            metadata_tasks.extend(folder_tasks)
+    return folders_data, fingerprints, metadata_tasks
+
+
+def iter_scan_for_images(full_base_path, base_path, include_subfolders, allowed_extensions=None, deduplicate_symlinks=True, extract_metadata=True, batch_size=256):
+    """Like _scan_for_images but yields (folder_key, files, fingerprints) batches as soon as they are complete,
+    fingerprints covering at least the files of the batch.
+
+    Metadata is resolved for roughly batch_size images at a time, a large folder is split over
+    several batches with the same folder_key."""
+    pending_folders = {}
+    pending_fingerprints = {}
+    pending_tasks = []
+    pending_files = 0
+
+    def flush():
+        _fill_metadata(pending_folders, pending_tasks, extract_metadata)
+        for folder_key, folder_content in pending_folders.items():
+            items = list(folder_content.items())
+            for i in range(0, len(items), batch_size):
+                yield folder_key, dict(items[i:i + batch_size]), pending_fingerprints[folder_key]
+
+    for folder_key, folder_content, folder_tasks, folder_fingerprints in _walk_folders(full_base_path, base_path, include_subfolders, allowed_extensions, deduplicate_symlinks, extract_metadata):
+        pending_folders[folder_key] = folder_content
+        pending_fingerprints[folder_key] = folder_fingerprints
+        pending_tasks.extend(folder_tasks)
+        pending_files += len(folder_content)
+        if pending_files >= batch_size:
+            yield from flush()
+            pending_folders, pending_fingerprints, pending_tasks, pending_files = {}, {}, [], 0
+    yield from flush()
+
+
+def resolve_metadata(tasks, workers=None, enqueue_hashes=True):
+    """Returns {full_path: metadata} for [(full_path, (real_path, mtime_ns, size))], using the cache where possible.
+    workers extracts the rest on that many threads instead of the configured backend. enqueue_hashes queues
+    the images read now for background perceptual hashing."""
+    results = {}
+    if not tasks:
+        return results
+
+    # Serve unchanged files from the persistent metadata cache
+    cache = get_metadata_cache()
+    if cache is not None:
+        cached = cache.get_many([cache_key for _, cache_key in tasks])
+        pending = []
+        for full_path, cache_key in tasks:
+            metadata = cached.get(cache_key[0])
+            if metadata is None:
+                pending.append((full_path, cache_key))
+            else:
+                results[full_path] = metadata
+    else:
+        pending = tasks
+
+    new_images = [(full_path, cache_key) for full_path, cache_key in pending if get_file_type(full_path) == "image"]
+    # Parallel metadata extraction for the remaining files
+    extracted = []  # list of (real_path, mtime_ns, size, data) to store in the cache
+    if workers is None and gallery_config.metadata_backend == "processes" and len(pending) >= _PROCESS_MIN_TASKS:
+        pending = _extract_in_processes(pending, results, extracted)
+    if pending:
+        _extract_in_threads(pending, results, extracted, workers)
+
+    if cache is not None:
+        try:
+            cache.put_many_encoded(extracted)
+            cache.flush()
+        except Exception as e:
+            print(f"Gallery Node: Error updating metadata cache: {e}")
+
+    # Perceptual hashes of the images read now follow in the background, they need a full decode
+    hasher = get_image_hasher() if enqueue_hashes else None
+    if hasher is not None:
+        hasher.enqueue(new_images)
+
+    return results
+
+
+def _extract_in_threads(tasks, results, extracted, workers=None):
+    """Extracts metadata for [(full_path, cache_key)] in a thread pool, filling results and extracted."""
+    workers = workers or gallery_config.metadata_workers or _METADATA_WORKERS
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        future_to_key = {
+            # The cache key holds the listed mtime and size, the extraction does not stat the file again
+            executor.submit(_extract_metadata_safe, full_path, listed_stat(cache_key[1], cache_key[2])): (full_path, cache_key)
+            for full_path, cache_key in tasks
+        }
+        for future in as_completed(future_to_key):
+            full_path, cache_key = future_to_key[future]
+            try:
+                _, metadata = future.result()
+                results[full_path] = metadata
+                if metadata:  # Do not cache failures, retry them on the next scan
+                    extracted.append((*cache_key, encode_metadata(metadata)))
+            except Exception as e:
+                print(f"Gallery Node: Error in metadata thread for {full_path}: {e}")
+
+
+def _get_metadata_pool():
+    """Returns the shared metadata process pool, recreated when the configured worker count changes."""
+    global _metadata_pool, _metadata_pool_workers
+    workers = gallery_config.metadata_workers or os.cpu_count() or 4
+    with _metadata_pool_lock:
+        if _metadata_pool is not None and _metadata_pool_workers != workers:
+            _metadata_pool.shutdown(wait=False)
+            _metadata_pool = None
+        if _metadata_pool is None:
+            _metadata_pool = create_worker_pool(workers)
+            _metadata_pool_workers = workers
+        return _metadata_pool, workers
+
+
+def _reset_metadata_pool(pool):
+    """Drops a broken pool so the next scan starts a fresh one."""
+    global _metadata_pool
+    with _metadata_pool_lock:
+        if _metadata_pool is pool:
+            _metadata_pool = None
+    pool.shutdown(wait=False)
+
+
+def _extract_in_processes(tasks, results, extracted):
+    """Extracts metadata for [(full_path, cache_key)] in chunks on the process pool, filling results and
+    extracted. Returns the tasks that could not be run there, for the thread backend."""
+    pool, workers = _get_metadata_pool()
+    # Small enough chunks to keep every worker busy until the end, large enough to amortize the IPC
+    chunk_size = max(1, min(_PROCESS_CHUNK_SIZE, -(-len(tasks) // (workers * 4))))
+    cache_keys = dict(tasks)
+    extract_batch = load_worker_module().extract_metadata_batch
+    futures = {}
+    try:
+        for i in range(0, len(tasks), chunk_size):
+            chunk = tasks[i:i + chunk_size]
+            paths = [full_path for full_path, _ in chunk]
+            listed = [cache_key[1:] for _, cache_key in chunk]
+            futures[pool.submit(extract_batch, paths, gallery_config.raw_json_metadata, listed)] = paths
+    except (BrokenProcessPool, RuntimeError) as e:
+        print(f"Gallery Node: Metadata process pool unavailable, using threads: {e}")
+        _reset_metadata_pool(pool)
+
+    done = set()
+    stats = get_stats()
+    for future in as_completed(futures):
+        try:
+            batch = future.result()
+        except BrokenProcessPool as e:
+            print(f"Gallery Node: Metadata process pool failed, using threads: {e}")
+            _reset_metadata_pool(pool)
+            break
+        except Exception as e:
+            print(f"Gallery Node: Error in metadata worker: {e}")
+            batch = [(full_path, None, None) for full_path in futures[future]]
+        for full_path, data, seconds in batch:
+            done.add(full_path)
+            if seconds is not None:
+                stats.observe("gallery_metadata_extract_seconds", seconds, format=_metadata_format(full_path), backend="processes")
+            if data is None:
+                results[full_path] = {}
+                continue
+            results[full_path] = decode_metadata(data)
+            if data != "{}":  # Do not cache failures, retry them on the next scan
+                extracted.append((*cache_keys[full_path], data))
+    return [(full_path, cache_key) for full_path, cache_key in tasks if full_path not in done]
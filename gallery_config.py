@@ -2,6 +2,12 @@
 
 disable_logs = False
 use_polling_observer = False
+# Keep PNG workflow/prompt chunks as raw JSON text and splice them into responses unparsed
+raw_json_metadata = False
+# Metadata extraction backend for scans: "threads" or "processes" (scales with cores on cold indexes)
+metadata_backend = "threads"
+# Metadata extraction workers, 0 picks a default for the backend
+metadata_workers = 0
 
 def gallery_log(*args, **kwargs):
     if not disable_logs:
@@ -0,0 +1,164 @@
+# gallery_stats.py
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the histogram buckets (Prometheus "le"): durations in seconds, sizes in bytes
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = (1024, 16384, 131072, 1048576, 8388608, 67108864, 268435456)
+
+# name -> (type, help, buckets), every recorded metric must be declared here
+METRICS = {
+    "gallery_scan_phase_seconds": ("histogram", "Duration of full scans by phase: walk, metadata (resolution for light listings), index.", DURATION_BUCKETS),
+    "gallery_metadata_extract_seconds": ("histogram", "Metadata extraction time per file by format and backend.", DURATION_BUCKETS),
+    "gallery_serialize_seconds": ("histogram", "Time spent sanitizing and encoding JSON by endpoint.", DURATION_BUCKETS),
+    "gallery_response_bytes": ("histogram", "Encoded response size by endpoint, before compression.", BYTES_BUCKETS),
+    "gallery_listing_requests_total": ("counter", "Listing requests by how they were answered: not_modified, cached, scanned, streamed.", None),
+    "gallery_watchdog_events_total": ("counter", "Watchdog events by type and result: queued, debounced (duplicate within the interval), ignored (temporary files).", None),
+    "gallery_rescans_total": ("counter", "Monitor index updates run, by kind: incremental, full.", None),
+    "gallery_rescans_skipped_total": ("counter", "Monitor index updates postponed because another scan was running.", None),
+    "gallery_rescan_seconds": ("histogram", "Duration of monitor index updates by kind.", DURATION_BUCKETS),
+    "gallery_image_hash_seconds": ("histogram", "Perceptual hashing time per batch of images by trigger: background, on_demand.", DURATION_BUCKETS),
+}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_number(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class GalleryStats:
+    """Thread-safe counters and histograms keyed by metric name and labels, cheap enough for per-file use."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [count per bucket..., count above the last bucket, sum]
+        self.started = time.time()
+
+    def incr(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        index = bisect.bisect_left(buckets, value)  # First bucket with le >= value
+        key = (name, _label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += value
+
+    @contextmanager
+    def timed(self, name, **labels):
+        """Observes the duration of the with block in seconds, also when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def total(self, name, **labels):
+        """Sum of a counter over all series carrying the given labels."""
+        wanted = set(labels.items())
+        with self.lock:
+            return sum(value for (counter, series), value in self.counters.items() if counter == name and wanted.issubset(series))
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.started = time.time()
+
+    def _copy(self):
+        with self.lock:
+            return dict(self.counters), {key: list(value) for key, value in self.histograms.items()}, self.started
+
+    def snapshot(self):
+        """Returns the metrics as JSON-friendly dicts, histogram buckets cumulative as in Prometheus."""
+        counters, histograms, started = self._copy()
+        metrics = {}
+        for (name, labels), value in sorted(counters.items()):
+            metric = metrics.setdefault(name, {"type": METRICS[name][0], "help": METRICS[name][1], "series": []})
+            metric["series"].append({"labels": dict(labels), "value": value})
+        for (name, labels), histogram in sorted(histograms.items()):
+            metric = metrics.setdefault(name, {"type": METRICS[name][0], "help": METRICS[name][1], "series": []})
+            count = sum(histogram[:-1])
+            cumulative = 0
+            buckets = {}
+            for le, bucket_count in zip(METRICS[name][2], histogram):
+                cumulative += bucket_count
+                buckets[str(le)] = cumulative
+            metric["series"].append({
+                "labels": dict(labels),
+                "count": count,
+                "sum": histogram[-1],
+                "mean": histogram[-1] / count if count else None,
+                "buckets": buckets,
+            })
+        return {"since": started, "uptime_seconds": time.time() - started, "metrics": metrics}
+
+    def to_prometheus(self, gauges=None):
+        """Returns the metrics in the Prometheus text exposition format.
+
+        gauges: {name: (help, value or {label tuple: value})} of point-in-time values collected by the caller."""
+        counters, histograms, _ = self._copy()
+        lines = []
+        by_name = {}
+        for (name, labels), value in counters.items():
+            by_name.setdefault(name, []).append((labels, value))
+        for (name, labels), histogram in histograms.items():
+            by_name.setdefault(name, []).append((labels, histogram))
+        for name in sorted(by_name):
+            metric_type, help_text, buckets = METRICS[name]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in sorted(by_name[name], key=lambda item: item[0]):
+                if metric_type == "counter":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+                    continue
+                cumulative = 0
+                for le, bucket_count in zip(buckets, value):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', _format_number(le))])} {cumulative}")
+                count = sum(value[:-1])
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(value[-1])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        for name, (help_text, value) in sorted((gauges or {}).items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            series = value if isinstance(value, dict) else {(): value}
+            for labels, series_value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(labels)} {_format_number(series_value)}")
+        return "\n".join(lines) + "\n"
+
+
+_stats = GalleryStats()
+
+
+def get_stats():
+    """Returns the process-wide GalleryStats."""
+    return _stats
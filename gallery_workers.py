@@ -0,0 +1,68 @@
+# gallery_workers.py
+# Functions executed inside worker processes. This module must not use package-relative
+# imports: worker_pool.py loads it under a fixed top-level name so the pool processes
+# never import the custom node package (and ComfyUI's PromptServer with it).
+import importlib
+import os
+import sys
+import time
+import types
+
+# Name of the stand-in package the metadata modules are imported under in worker processes.
+# It gets the custom node directory as __path__ but never runs its __init__.py, so their
+# relative imports resolve without registering nodes or routes.
+_PACKAGE_NAME = "comfyui_gallery_workers_package"
+
+
+def generate_thumbnail(src_path, dest_path, size, image_format, quality):
+    """Writes a thumbnail of src_path fitting in size x size to dest_path, returns dest_path."""
+    from PIL import Image, ImageOps
+
+    with Image.open(src_path) as img:
+        # Let JPEG decode at a reduced scale directly, much cheaper than a full decode
+        img.draft("RGB", (size, size))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size), Image.LANCZOS)
+        if image_format == "JPEG":
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+        elif img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        # Write to a private temp file and rename so readers never see partial thumbnails
+        tmp_path = f"{dest_path}.{os.getpid()}.tmp"
+        img.save(tmp_path, format=image_format, quality=quality)
+        os.replace(tmp_path, dest_path)
+    return dest_path
+
+
+def _import_package_module(name):
+    """Imports a module of the custom node directory under the stand-in package."""
+    if _PACKAGE_NAME not in sys.modules:
+        package = types.ModuleType(_PACKAGE_NAME)
+        package.__path__ = [os.path.dirname(os.path.abspath(__file__))]
+        sys.modules[_PACKAGE_NAME] = package
+    return importlib.import_module(f"{_PACKAGE_NAME}.{name}")
+
+
+def extract_metadata_batch(paths, raw_json_metadata=False, listed=None):
+    """Extracts metadata for a batch of images, returns [(path, data, seconds)] with data encoded by
+    raw_json.encode_metadata (None on error) and the extraction time for the stats. Text is much
+    cheaper to send back than nested dicts. listed holds the (mtime_ns, size) of each path from the
+    directory listing, the files are not stat'ed again when given."""
+    gallery_config = _import_package_module("gallery_config")
+    metadata_extractor = _import_package_module("metadata_extractor")
+    raw_json = _import_package_module("raw_json")
+    gallery_config.raw_json_metadata = raw_json_metadata
+    results = []
+    for i, path in enumerate(paths):
+        start = time.perf_counter()
+        try:
+            stat = metadata_extractor.listed_stat(*listed[i]) if listed is not None else None
+            data = raw_json.encode_metadata(metadata_extractor.buildMetadataFast(path, stat))
+        except Exception as e:
+            print(f"Gallery Node: Error building metadata for {path}: {e}")
+            data = None
+        results.append((path, data, time.perf_counter() - start))
+    return results
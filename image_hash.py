@@ -0,0 +1,239 @@
+# image_hash.py
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
+
+from PIL import Image
+
+try:
+    import numpy as np  # Optional, ComfyUI installs always have it
+except ImportError:
+    np = None
+
+from .gallery_config import gallery_log
+from .gallery_stats import get_stats
+from .metadata_cache import get_metadata_cache
+
+# dHash: one bit per pixel of a HASH_WIDTH x HASH_HEIGHT grayscale downscale, set if brighter than its right neighbour
+HASH_WIDTH = 9
+HASH_HEIGHT = 8
+HASH_BITS = (HASH_WIDTH - 1) * HASH_HEIGHT  # 64
+DEFAULT_THRESHOLD = 6
+# near_duplicate_pairs looks hashes up by _CHUNKS keys of _CHUNK_BITS bits, with up to threshold // _CHUNKS
+# bits of a key flipped: at most one bit keeps it to 17 lookups per key
+_CHUNK_BITS = 16
+_CHUNKS = HASH_BITS // _CHUNK_BITS
+MAX_THRESHOLD = 2 * _CHUNKS - 1  # 7
+
+# Images decoded per batch, the downscales of a batch are hashed in one NumPy pass
+_HASH_BATCH = 64
+_HASH_WORKERS = min(4, (os.cpu_count() or 2))
+# Images waiting for background hashing, the ones queued past this are hashed on demand instead
+_MAX_PENDING = 10000
+# Set bits per byte value, for NumPy versions without bitwise_count
+_POPCOUNT_TABLE = None if np is None else np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def _load_downscale(full_path):
+    """Decodes an image straight to its HASH_WIDTH x HASH_HEIGHT grayscale downscale, None if it cannot be read."""
+    try:
+        with Image.open(full_path) as image:
+            image.draft("L", (HASH_WIDTH * 8, HASH_HEIGHT * 8))  # JPEGs decode at up to 1/8 scale
+            small = image.convert("L").resize((HASH_WIDTH, HASH_HEIGHT), Image.Resampling.BOX, reducing_gap=2.0)
+            return np.asarray(small, dtype=np.uint8)
+    except Exception as e:
+        gallery_log(f"ImageHasher: Could not hash {full_path}: {e}")
+        return None
+
+
+def dhash_batch(pixels):
+    """Returns the dHashes of a (n, HASH_HEIGHT, HASH_WIDTH) uint8 stack of downscales as n uint64 values."""
+    bits = pixels[:, :, 1:] < pixels[:, :, :-1]
+    return np.packbits(bits.reshape(len(pixels), HASH_BITS), axis=1).view(">u8").ravel().astype(np.uint64)
+
+
+def _popcount(values):
+    """Set bits of each uint64 in values."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _probe_masks(radius):
+    """Masks of every way to flip at most radius bits of a _CHUNK_BITS wide key, 0 first."""
+    masks = [0]
+    for flipped in range(1, radius + 1):
+        masks.extend(sum(1 << bit for bit in bits) for bits in combinations(range(_CHUNK_BITS), flipped))
+    return np.array(masks, dtype=np.uint64)
+
+
+def near_duplicate_pairs(hashes, threshold):
+    """Returns (i, j, distances) arrays of the index pairs of a uint64 hash array within threshold bits.
+
+    Multi-index hashing instead of comparing all pairs: the 64 bits are split into _CHUNKS keys of 16 bits
+    and two hashes within threshold bits differ in at most threshold // _CHUNKS bits of at least one key
+    (pigeonhole). Per key the hashes are sorted, every hash then looks up its key with up to that many bits
+    flipped and only the hashes found are compared. Keys stay 16 bits wide whatever the threshold, so the
+    buckets stay small; MAX_THRESHOLD keeps the flips to at most one bit."""
+    n = len(hashes)
+    masks = _probe_masks(threshold // _CHUNKS)
+    found_i, found_j, found_distances = [], [], []
+    for chunk in range(_CHUNKS):
+        keys = (hashes >> np.uint64(chunk * _CHUNK_BITS)) & np.uint64((1 << _CHUNK_BITS) - 1)
+        order = np.argsort(keys, kind="stable")
+        # Keys are small enough for a table of where each one's bucket starts in order and its size
+        bucket_sizes = np.bincount(keys.astype(np.int64), minlength=1 << _CHUNK_BITS)
+        bucket_starts = np.cumsum(bucket_sizes) - bucket_sizes
+        for mask in masks:
+            probes = (keys ^ mask).astype(np.int64)
+            starts = bucket_starts[probes]
+            counts = bucket_sizes[probes]
+            total = int(counts.sum())
+            if not total:
+                continue
+            # One (i, j) candidate per hash j in the bucket hash i probed
+            i = np.repeat(np.arange(n), counts)
+            positions = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+            j = order[positions]
+            keep = i < j  # Both hashes of a pair find each other
+            i, j = i[keep], j[keep]
+            distances = _popcount(hashes[i] ^ hashes[j])
+            close = distances <= threshold
+            found_i.append(i[close])
+            found_j.append(j[close])
+            found_distances.append(distances[close].astype(np.int64))
+    if not found_i:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    # Pairs agreeing on several keys were found once per key
+    i, j = np.concatenate(found_i), np.concatenate(found_j)
+    _, first = np.unique(i * n + j, return_index=True)
+    return i[first], j[first], np.concatenate(found_distances)[first]
+
+
+def group_near_duplicates(hashes_by_key, threshold=DEFAULT_THRESHOLD, min_size=2):
+    """Groups {key: hash} into clusters of keys connected by hashes within threshold bits of each other.
+    Returns [[key, ...], ...] for the clusters of at least min_size keys, largest first."""
+    keys_by_hash = {}
+    for key, value in hashes_by_key.items():
+        if value is not None:
+            keys_by_hash.setdefault(value, []).append(key)
+    distinct = list(keys_by_hash)
+    parents = list(range(len(distinct)))
+
+    def find(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    if len(distinct) > 1 and threshold > 0:
+        i, j, _ = near_duplicate_pairs(np.array(distinct, dtype=np.uint64), threshold)
+        for a, b in zip(i.tolist(), j.tolist()):
+            root_a, root_b = find(a), find(b)
+            if root_a != root_b:
+                parents[root_b] = root_a
+
+    clusters = {}
+    for index, value in enumerate(distinct):
+        clusters.setdefault(find(index), []).extend(keys_by_hash[value])
+    return sorted((keys for keys in clusters.values() if len(keys) >= min_size), key=len, reverse=True)
+
+
+class ImageHasher:
+    """Computes dHashes of images in batches and keeps them in the metadata cache database.
+
+    Images whose metadata was just extracted are queued and hashed on one background thread, so scans
+    do not wait for full image decodes. compute() hashes whatever is still missing on demand.
+    The thread starts with the hasher and inherits the priority of the thread creating it."""
+
+    def __init__(self, workers=_HASH_WORKERS):
+        self.pending = queue.Queue(maxsize=_MAX_PENDING)
+        self.background = True  # Benchmarks turn it off to time scans alone
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gallery_hash")
+        self.thread = threading.Thread(target=self._run, name="gallery_hash_queue", daemon=True)
+        self.thread.start()
+
+    def enqueue(self, tasks):
+        """Queues [(full_path, (real_path, mtime_ns, size))] of images for background hashing."""
+        if not tasks or not self.background or get_metadata_cache() is None:
+            return
+        for index, task in enumerate(tasks):
+            try:
+                self.pending.put_nowait(task)
+            except queue.Full:
+                gallery_log(f"ImageHasher: Queue full, {len(tasks) - index} images are left to hash on demand")
+                break
+
+    def _run(self):
+        while True:
+            batch = [self.pending.get()]
+            while len(batch) < _HASH_BATCH:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.compute(batch, trigger="background", parallel=False)
+            except Exception as e:
+                gallery_log(f"ImageHasher: Error hashing queued images: {e}")
+
+    def compute(self, tasks, trigger="on_demand", parallel=True):
+        """Returns {full_path: hash or None} for [(full_path, (real_path, mtime_ns, size))], computing and
+        storing the hashes that are not cached yet. None marks images that could not be decoded."""
+        results = {}
+        if not tasks:
+            return results
+        cache = get_metadata_cache()
+        pending = tasks
+        if cache is not None:
+            cached = cache.get_hashes([cache_key for _, cache_key in tasks])
+            pending = []
+            for full_path, cache_key in tasks:
+                if cache_key[0] in cached:
+                    results[full_path] = cached[cache_key[0]]
+                else:
+                    pending.append((full_path, cache_key))
+
+        stats = get_stats()
+        for start in range(0, len(pending), _HASH_BATCH):
+            batch = pending[start:start + _HASH_BATCH]
+            started = time.perf_counter()
+            paths = [full_path for full_path, _ in batch]
+            downscales = list(self.executor.map(_load_downscale, paths)) if parallel else [_load_downscale(path) for path in paths]
+            decoded = [index for index, pixels in enumerate(downscales) if pixels is not None]
+            hashes = dhash_batch(np.stack([downscales[index] for index in decoded])).tolist() if decoded else []
+            values = [None] * len(batch)
+            for index, value in zip(decoded, hashes):
+                values[index] = value
+            for full_path, value in zip(paths, values):
+                results[full_path] = value
+            stats.observe("gallery_image_hash_seconds", time.perf_counter() - started, trigger=trigger)
+            if cache is not None:
+                try:
+                    cache.put_hashes([(*cache_key, value) for (_, cache_key), value in zip(batch, values)])
+                except Exception as e:
+                    gallery_log(f"ImageHasher: Error storing hashes: {e}")
+        return results
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+def get_image_hasher():
+    """Returns the shared ImageHasher, or None without NumPy. Its queue thread starts on the first call,
+    which must not come from a thread with lowered priority such as the warm-up."""
+    global _hasher
+    if _hasher is None and np is not None:
+        with _hasher_lock:
+            if _hasher is None:
+                _hasher = ImageHasher()
+    return _hasher
@@ -0,0 +1,150 @@
+# json_fragments.py
+import json
+import threading
+from json.encoder import encode_basestring_ascii
+
+from .media_metadata import MEDIA_EXTENSIONS
+from .raw_json import dumps_json, sanitize_json_data
+
+# Encoded entries kept in memory, full entries embed the prompt and workflow: tens of KB per image
+MAX_FRAGMENT_BYTES = 256 * 1024 * 1024
+
+
+def encode_entry(entry):
+    """The JSON text of one listing entry as bytes, RawJSON metadata spliced in verbatim."""
+    return dumps_json(sanitize_json_data(entry)).encode("utf-8")
+
+
+def json_key(key):
+    """The encoded '"key": ' prefix of an object member."""
+    return encode_basestring_ascii(key).encode("ascii") + b": "
+
+
+def join_object(members):
+    """Joins encoded '"key": value' members into the JSON text of an object."""
+    return b"{" + b", ".join(members) + b"}"
+
+
+def encode_fields(fields):
+    """The members of a small dict as encoded '"key": value' text, for appending to an assembled object."""
+    return [json_key(key) + json.dumps(value).encode("utf-8") for key, value in fields.items()]
+
+
+def _complete(entry, mode):
+    """False for entries missing data only because reading it failed, those are retried on the next scan."""
+    if mode == "full":
+        return bool(entry.get("metadata")) or not (entry.get("type") == "image" or entry["name"].lower().endswith(MEDIA_EXTENSIONS))
+    return entry.get("resolution", "") is not None
+
+
+class FragmentCache:
+    """Encoded JSON of listing entries, so an unchanged file is not sanitized and encoded again for every
+    listing and change message: responses are assembled by joining the cached fragments.
+
+    Fragments are keyed by URL and listing mode and valid while the file fingerprint (inode, mtime_ns,
+    size) is unchanged, which covers everything an entry is built from. The oldest fragments are dropped
+    once max_bytes is exceeded."""
+
+    def __init__(self, max_bytes=MAX_FRAGMENT_BYTES):
+        self.max_bytes = max_bytes
+        self.fragments = {}  # (url, mode) -> (fingerprint, encoded entry), oldest first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def fragments_for(self, files, fingerprints, mode="full"):
+        """Returns {filename: encoded entry} for {filename: entry}. fingerprints maps filenames to their
+        file_fingerprint, entries without one are encoded without being cached."""
+        fragments = {}
+        with self.lock:
+            for filename, entry in files.items():
+                fingerprint = fingerprints.get(filename)
+                cached = self.fragments.get((entry["url"], mode)) if fingerprint is not None else None
+                if cached is not None and cached[0] == fingerprint:
+                    fragments[filename] = cached[1]
+            self.hits += len(fragments)
+            self.misses += len(files) - len(fragments)
+        if len(fragments) == len(files):
+            return fragments
+
+        encoded = []
+        for filename, entry in files.items():
+            if filename not in fragments:
+                fragment = fragments[filename] = encode_entry(entry)
+                fingerprint = fingerprints.get(filename)
+                if fingerprint is not None and _complete(entry, mode):
+                    encoded.append(((entry["url"], mode), fingerprint, fragment))
+        if encoded:
+            self._store(encoded)
+        return fragments
+
+    def encode_files(self, files, fingerprints, mode="full"):
+        """Returns the JSON text of {filename: entry} as bytes."""
+        fragments = self.fragments_for(files, fingerprints, mode)
+        return join_object(json_key(filename) + fragments[filename] for filename in files)
+
+    def encode_folders(self, folders, fingerprints, mode="full"):
+        """Returns the JSON text of {folder_key: {filename: entry}} as bytes, fingerprints as
+        {folder_key: {filename: fingerprint}}."""
+        return join_object(
+            json_key(folder_key) + self.encode_files(files, fingerprints.get(folder_key, {}), mode)
+            for folder_key, files in folders.items()
+        )
+
+    def encode_changes(self, folders, fingerprints):
+        """Returns the JSON text of the {folder_key: {filename: {"action", **entry}}} of a change message as
+        bytes, fingerprints as for encode_folders. Created and updated entries share their fragment with
+        full listings."""
+        folder_parts = []
+        for folder_key, changes in folders.items():
+            entries = {
+                filename: {key: value for key, value in change.items() if key != "action"}
+                for filename, change in changes.items() if change["action"] != "remove"
+            }
+            fragments = self.fragments_for(entries, fingerprints.get(folder_key, {}))
+            members = []
+            for filename, change in changes.items():
+                action = json_key("action") + encode_basestring_ascii(change["action"]).encode("ascii")
+                if filename in fragments:
+                    members.append(json_key(filename) + b"{" + action + b", " + fragments[filename][1:])
+                else:
+                    members.append(json_key(filename) + b"{" + action + b"}")
+            folder_parts.append(json_key(folder_key) + join_object(members))
+        return join_object(folder_parts)
+
+    def _store(self, encoded):
+        with self.lock:
+            for key, fingerprint, fragment in encoded:
+                previous = self.fragments.pop(key, None)
+                if previous is not None:
+                    self.total_bytes -= len(previous[1])
+                self.fragments[key] = (fingerprint, fragment)
+                self.total_bytes += len(fragment)
+            while self.total_bytes > self.max_bytes and self.fragments:
+                oldest = next(iter(self.fragments))
+                self.total_bytes -= len(self.fragments.pop(oldest)[1])
+                self.evictions += 1
+
+    def stats(self):
+        """Returns cache counters."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.fragments),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else None,
+                "evictions": self.evictions,
+            }
+
+
+_cache = FragmentCache()
+
+
+def get_fragment_cache():
+    """Returns the process-wide FragmentCache."""
+    return _cache
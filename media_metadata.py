@@ -0,0 +1,411 @@
+# media_metadata.py
+# Pure-Python readers for the container headers of MP4/MOV, Matroska/WebM and FLAC files.
+# They only read the boxes/elements/blocks holding duration, resolution and tags and seek over
+# media data (mdat, Clusters, pictures), so cost does not grow with the file size.
+import json
+import struct
+
+# Extensions whose container headers read_media_info understands
+MEDIA_EXTENSIONS = (".mp4", ".m4v", ".mov", ".m4a", ".webm", ".mkv", ".flac")
+# Largest single box/element/block read into memory, embedded workflows are far below this
+MAX_ELEMENT_BYTES = 64 * 1024 * 1024
+# Boxes/elements looked at per level before giving up on a malformed file
+_MAX_ELEMENTS = 10000
+
+# iTunes style item names (moov/udta/meta/ilst and QuickTime udta text) used by ffmpeg
+_MP4_ITEM_NAMES = {
+    b"\xa9cmt": "comment",
+    b"\xa9too": "encoder",
+    b"\xa9nam": "title",
+    b"\xa9ART": "artist",
+    b"\xa9day": "date",
+    b"\xa9des": "description",
+    b"desc": "description",
+}
+
+# Matroska element ids
+_EBML = 0x1A45DFA3
+_SEGMENT = 0x18538067
+_SEEK_HEAD = 0x114D9B74
+_SEEK = 0x4DBB
+_SEEK_ID = 0x53AB
+_SEEK_POSITION = 0x53AC
+_INFO = 0x1549A966
+_TIMECODE_SCALE = 0x2AD7B1
+_DURATION = 0x4489
+_TRACKS = 0x1654AE6B
+_TRACK_ENTRY = 0xAE
+_VIDEO = 0xE0
+_PIXEL_WIDTH = 0xB0
+_PIXEL_HEIGHT = 0xBA
+_TAGS = 0x1254C367
+_TAG = 0x7373
+_TARGETS = 0x63C0
+_TARGET_UIDS = {0x63C5, 0x63C9, 0x63C4, 0x63C6}  # Track/Edition/Chapter/Attachment UIDs
+_SIMPLE_TAG = 0x67C8
+_TAG_NAME = 0x45A3
+_TAG_STRING = 0x4487
+_CLUSTER = 0x1F43B675
+
+
+def read_media_info(f):
+    """Returns {"width", "height", "duration", "tags"} read from the container header of an open
+    MP4/MOV, Matroska/WebM or FLAC file. width/height/duration are None when the file has none,
+    duration is in seconds. Raises ValueError for other or malformed files."""
+    f.seek(0, 2)
+    file_size = f.tell()
+    f.seek(0)
+    head = f.read(12)
+    info = {"width": None, "height": None, "duration": None, "tags": {}}
+    try:
+        if head[4:8] == b"ftyp":
+            _read_mp4(f, file_size, info)
+        elif head[:4] == b"\x1a\x45\xdf\xa3":
+            _read_matroska(f, file_size, info)
+        elif head[:4] == b"fLaC" or head[:3] == b"ID3":
+            _read_flac(f, file_size, info)
+        else:
+            raise ValueError("Unsupported media container")
+    except struct.error as e:
+        raise ValueError(f"Truncated media header: {e}")
+    return info
+
+
+def media_tags_to_info(tags):
+    """Maps container tags to PNG-style text chunks: prompt/workflow tags as written by ComfyUI's
+    SaveVideo/SaveAudio, or the JSON comment written by VideoHelperSuite, are split out."""
+    result = {}
+    for name, value in tags.items():
+        key = name.lower()
+        if key in ("prompt", "workflow"):
+            result[key] = value
+            continue
+        if key == "comment" and value.lstrip().startswith("{"):
+            try:
+                comment = json.loads(value)
+            except ValueError:
+                comment = None
+            if isinstance(comment, dict) and ("prompt" in comment or "workflow" in comment):
+                for comment_key, comment_value in comment.items():
+                    result.setdefault(comment_key, comment_value if isinstance(comment_value, str) else json.dumps(comment_value))
+                continue
+        result[name] = value
+    return result
+
+
+def _read_bytes(f, start, size):
+    if size > MAX_ELEMENT_BYTES:
+        raise ValueError(f"Metadata element too large: {size} bytes")
+    f.seek(start)
+    data = f.read(size)
+    if len(data) < size:
+        raise ValueError("Truncated media header")
+    return data
+
+
+# --- MP4 / MOV ---
+
+def _iter_boxes(f, start, end):
+    """Yields (type, payload_start, payload_end) for the boxes between start and end."""
+    pos = start
+    for _ in range(_MAX_ELEMENTS):
+        if pos + 8 > end:
+            return
+        f.seek(pos)
+        size, box_type = struct.unpack(">I4s", f.read(8))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos  # Box extends to the end of its parent
+        if size < header_size:
+            raise ValueError("Invalid MP4 box size")
+        yield box_type, pos + header_size, min(pos + size, end)
+        pos += size
+
+
+def _read_mp4(f, file_size, info):
+    for box_type, start, end in _iter_boxes(f, 0, file_size):
+        if box_type == b"moov":  # Before or after mdat, which is skipped by seeking
+            _read_moov(f, start, end, info)
+            return
+    raise ValueError("MP4 file without moov box")
+
+
+def _read_moov(f, start, end, info):
+    for box_type, child_start, child_end in _iter_boxes(f, start, end):
+        if box_type == b"mvhd":
+            data = _read_bytes(f, child_start, min(child_end - child_start, 32))
+            if data[0] == 1:
+                timescale, duration = struct.unpack(">IQ", data[20:32])
+                unknown = 0xFFFFFFFFFFFFFFFF
+            else:
+                timescale, duration = struct.unpack(">II", data[12:20])
+                unknown = 0xFFFFFFFF
+            if timescale and duration != unknown:
+                info["duration"] = duration / timescale
+        elif box_type == b"trak" and info["width"] is None:
+            for trak_type, trak_start, trak_end in _iter_boxes(f, child_start, child_end):
+                if trak_type == b"tkhd":
+                    # Width and height end the box: bytes 76..84 in version 0, 88..96 in version 1
+                    data = _read_bytes(f, trak_start, min(trak_end - trak_start, 96))
+                    offset = 4 + (32 if data[:1] == b"\x01" else 20) + 52
+                    if len(data) < offset + 8:
+                        continue
+                    width, height = struct.unpack(">II", data[offset:offset + 8])
+                    if width and height:  # 16.16 fixed point, zero for audio tracks
+                        info["width"], info["height"] = width >> 16, height >> 16
+        elif box_type == b"udta":
+            _read_udta(f, child_start, child_end, info)
+        elif box_type == b"meta":
+            _read_mp4_meta(f, child_start, child_end, info)
+
+
+def _read_udta(f, start, end, info):
+    for box_type, child_start, child_end in _iter_boxes(f, start, end):
+        if box_type == b"meta":
+            _read_mp4_meta(f, child_start, child_end, info)
+        elif box_type[:1] == b"\xa9":
+            # QuickTime user data text: 16-bit length, 16-bit language, text
+            data = _read_bytes(f, child_start, child_end - child_start)
+            if len(data) >= 4:
+                text_size = struct.unpack(">H", data[:2])[0]
+                info["tags"][_mp4_item_name(box_type)] = data[4:4 + text_size].decode("utf-8", "replace")
+
+
+def _read_mp4_meta(f, start, end, info):
+    # ISO meta is a full box (version/flags first), QuickTime's mdta meta starts with its hdlr box
+    f.seek(start)
+    if f.read(8)[4:8] != b"hdlr":
+        start += 4
+    keys = []
+    for box_type, child_start, child_end in _iter_boxes(f, start, end):
+        if box_type == b"keys":
+            # Key names for ilst items written with movflags=use_metadata_tags
+            data = _read_bytes(f, child_start, child_end - child_start)
+            if len(data) < 8:
+                continue
+            pos = 8
+            for _ in range(min(struct.unpack(">I", data[4:8])[0], _MAX_ELEMENTS)):
+                if pos + 8 > len(data):
+                    break
+                key_size = struct.unpack(">I", data[pos:pos + 4])[0]
+                # Each key is size, namespace and name, a smaller or overlong size ends the list
+                if key_size < 8 or pos + key_size > len(data):
+                    break
+                keys.append(data[pos + 8:pos + key_size].decode("utf-8", "replace"))
+                pos += key_size
+        elif box_type == b"ilst":
+            for item_type, item_start, item_end in _iter_boxes(f, child_start, child_end):
+                name, value = _read_ilst_item(f, item_type, item_start, item_end, keys)
+                if name is not None and value is not None:
+                    info["tags"][name] = value
+
+
+def _read_ilst_item(f, item_type, start, end, keys):
+    """Returns (name, text value) of an ilst item, (None, None) for non-text values."""
+    index = struct.unpack(">I", item_type)[0]
+    if keys and 1 <= index <= len(keys):
+        name = keys[index - 1]
+    else:
+        name = _mp4_item_name(item_type)
+    value = None
+    for box_type, child_start, child_end in _iter_boxes(f, start, end):
+        if box_type == b"name" and item_type == b"----":  # Freeform item, named by its name box
+            name = _read_bytes(f, child_start, child_end - child_start)[4:].decode("utf-8", "replace")
+        elif box_type == b"data":
+            data = _read_bytes(f, child_start, child_end - child_start)
+            if struct.unpack(">I", data[:4])[0] & 0xFFFFFF == 1:  # UTF-8 text
+                value = data[8:].decode("utf-8", "replace")
+    return (name, value) if value is not None else (None, None)
+
+
+def _mp4_item_name(box_type):
+    return _MP4_ITEM_NAMES.get(box_type) or box_type.decode("latin-1").lstrip("\xa9")
+
+
+# --- Matroska / WebM ---
+
+def _read_vint(f, keep_marker=False):
+    """Reads an EBML variable length integer, returns (value, length). Element sizes with all value
+    bits set (unknown size) are returned as None."""
+    first = f.read(1)
+    if not first or first[0] == 0:
+        raise ValueError("Invalid EBML variable length integer")
+    length = 9 - first[0].bit_length()
+    rest = f.read(length - 1)
+    if len(rest) < length - 1:
+        raise ValueError("Truncated media header")
+    value = first[0] if keep_marker else first[0] & ((1 << (8 - length)) - 1)
+    for byte in rest:
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        return None, length
+    return value, length
+
+
+def _iter_elements(f, start, end):
+    """Yields (id, data_start, data_end) for the EBML elements between start and end. An element of
+    unknown size ends the iteration after it was yielded, with data_end set to end."""
+    pos = start
+    for _ in range(_MAX_ELEMENTS):
+        if pos >= end:
+            return
+        f.seek(pos)
+        element_id, id_size = _read_vint(f, keep_marker=True)
+        size, size_size = _read_vint(f)
+        data_start = pos + id_size + size_size
+        if size is None:
+            yield element_id, data_start, end
+            return
+        yield element_id, data_start, min(data_start + size, end)
+        pos = data_start + size
+
+
+def _read_uint(f, start, end):
+    if end - start > 8:
+        raise ValueError("Invalid EBML unsigned integer size")
+    return int.from_bytes(_read_bytes(f, start, end - start), "big")
+
+
+def _read_matroska(f, file_size, info):
+    for element_id, start, end in _iter_elements(f, 0, file_size):
+        if element_id == _SEGMENT:
+            _read_segment(f, start, end, info)
+            return
+    raise ValueError("Matroska file without segment")
+
+
+def _read_segment(f, start, end, info):
+    timecode_scale = 1000000
+    duration = None
+    seen = set()
+    seek_positions = {}  # Element id -> absolute position, from the SeekHead
+
+    def read_child(element_id, child_start, child_end):
+        nonlocal timecode_scale, duration
+        seen.add(element_id)
+        if element_id == _SEEK_HEAD:
+            for seek_id, seek_start, seek_end in _iter_elements(f, child_start, child_end):
+                if seek_id != _SEEK:
+                    continue
+                target, position = None, None
+                for field_id, field_start, field_end in _iter_elements(f, seek_start, seek_end):
+                    if field_id == _SEEK_ID:
+                        target = _read_uint(f, field_start, field_end)
+                    elif field_id == _SEEK_POSITION:
+                        position = _read_uint(f, field_start, field_end)
+                if target is not None and position is not None:
+                    seek_positions.setdefault(target, start + position)
+        elif element_id == _INFO:
+            for field_id, field_start, field_end in _iter_elements(f, child_start, child_end):
+                if field_id == _TIMECODE_SCALE:
+                    timecode_scale = _read_uint(f, field_start, field_end)
+                elif field_id == _DURATION and field_end - field_start in (4, 8):
+                    data = _read_bytes(f, field_start, field_end - field_start)
+                    duration = struct.unpack(">f" if len(data) == 4 else ">d", data)[0]
+        elif element_id == _TRACKS:
+            _read_tracks(f, child_start, child_end, info)
+        elif element_id == _TAGS:
+            _read_tags(f, child_start, child_end, info)
+
+    for element_id, child_start, child_end in _iter_elements(f, start, end):
+        if element_id == _CLUSTER:
+            break  # Media data follows, elements after it are only reached through the SeekHead
+        read_child(element_id, child_start, child_end)
+
+    for element_id in (_INFO, _TRACKS, _TAGS):
+        position = seek_positions.get(element_id)
+        if element_id in seen or position is None or not start <= position < end:
+            continue
+        for found_id, child_start, child_end in _iter_elements(f, position, end):
+            if found_id == element_id:
+                read_child(found_id, child_start, child_end)
+            break
+
+    if duration is not None:
+        info["duration"] = duration * timecode_scale / 1e9
+
+
+def _read_tracks(f, start, end, info):
+    for entry_id, entry_start, entry_end in _iter_elements(f, start, end):
+        if entry_id != _TRACK_ENTRY or info["width"] is not None:
+            continue
+        for field_id, field_start, field_end in _iter_elements(f, entry_start, entry_end):
+            if field_id != _VIDEO:
+                continue
+            for video_id, video_start, video_end in _iter_elements(f, field_start, field_end):
+                if video_id == _PIXEL_WIDTH:
+                    info["width"] = _read_uint(f, video_start, video_end)
+                elif video_id == _PIXEL_HEIGHT:
+                    info["height"] = _read_uint(f, video_start, video_end)
+
+
+def _read_tags(f, start, end, info):
+    for tag_id, tag_start, tag_end in _iter_elements(f, start, end):
+        if tag_id != _TAG:
+            continue
+        simple_tags = []
+        global_tag = True
+        for field_id, field_start, field_end in _iter_elements(f, tag_start, tag_end):
+            if field_id == _TARGETS:
+                # Per-track tags (e.g. DURATION, ENCODER of each stream) are not file metadata
+                global_tag = not any(target_id in _TARGET_UIDS for target_id, _, _ in _iter_elements(f, field_start, field_end))
+            elif field_id == _SIMPLE_TAG:
+                simple_tags.append((field_start, field_end))
+        if not global_tag:
+            continue
+        for simple_start, simple_end in simple_tags:
+            name, value = None, None
+            for field_id, field_start, field_end in _iter_elements(f, simple_start, simple_end):
+                if field_id == _TAG_NAME:
+                    name = _read_bytes(f, field_start, field_end - field_start).decode("utf-8", "replace")
+                elif field_id == _TAG_STRING:
+                    value = _read_bytes(f, field_start, field_end - field_start).decode("utf-8", "replace")
+            if name and value is not None:
+                info["tags"][name.lower()] = value  # Matroska tag names are upper case by convention
+
+
+# --- FLAC ---
+
+def _read_flac(f, file_size, info):
+    f.seek(0)
+    head = f.read(10)
+    pos = 0
+    if head[:3] == b"ID3":
+        # ID3v2 tag in front of the stream, its size is stored as a syncsafe integer
+        size = 0
+        for byte in head[6:10]:
+            size = (size << 7) | (byte & 0x7F)
+        pos = 10 + size + (10 if head[5] & 0x10 else 0)
+    f.seek(pos)
+    if f.read(4) != b"fLaC":
+        raise ValueError("Not a FLAC file")
+    pos += 4
+    for _ in range(_MAX_ELEMENTS):
+        f.seek(pos)
+        header = f.read(4)
+        if len(header) < 4:
+            raise ValueError("Truncated media header")
+        last, block_type = header[0] & 0x80, header[0] & 0x7F
+        size = int.from_bytes(header[1:4], "big")
+        if block_type == 0:  # STREAMINFO
+            data = _read_bytes(f, pos + 4, size)
+            bits = int.from_bytes(data[10:18], "big")
+            sample_rate, total_samples = bits >> 44, bits & ((1 << 36) - 1)
+            if sample_rate and total_samples:
+                info["duration"] = total_samples / sample_rate
+        elif block_type == 4:  # VORBIS_COMMENT, little endian unlike the rest of FLAC
+            data = _read_bytes(f, pos + 4, size)
+            offset = 4 + struct.unpack("<I", data[:4])[0]  # Skip the vendor string
+            count = struct.unpack("<I", data[offset:offset + 4])[0]
+            offset += 4
+            for _ in range(count):
+                length = struct.unpack("<I", data[offset:offset + 4])[0]
+                name, _, value = data[offset + 4:offset + 4 + length].decode("utf-8", "replace").partition("=")
+                info["tags"][name.lower()] = value  # Field names are case insensitive
+                offset += 4 + length
+        pos += 4 + size
+        if last or pos >= file_size:
+            return
@@ -0,0 +1,263 @@
+# metadata_cache.py
+import os
+import sqlite3
+import threading
+import time
+from .gallery_config import gallery_log
+from .raw_json import encode_metadata, decode_metadata
+
+# Cache database lives next to user_settings.json
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "metadata_cache.db")
+
+# Upper bound for the stored metadata payloads (not counting SQLite overhead)
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+# Evict down to this fraction of max_bytes so eviction does not run on every insert
+_EVICT_TARGET_RATIO = 0.9
+
+_INT64_SIGN = 1 << 63  # SQLite integers are signed, 64-bit hashes are stored shifted into that range
+
+
+class MetadataCache:
+    """Persistent metadata cache keyed by (real path, st_mtime_ns, st_size)."""
+
+    def __init__(self, db_path=CACHE_FILE, max_bytes=DEFAULT_MAX_BYTES):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.purged = 0
+        self._touched = set()  # paths hit since last flush, last_used updated lazily
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            " path TEXT PRIMARY KEY,"
+            " mtime_ns INTEGER NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " data TEXT NOT NULL,"
+            " bytes INTEGER NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS metadata_last_used ON metadata(last_used)")
+        # Perceptual hashes of images (image_hash.py), NULL for images that could not be decoded
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS image_hashes ("
+            " path TEXT PRIMARY KEY,"
+            " mtime_ns INTEGER NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " hash INTEGER)"
+        )
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM metadata").fetchone()[0]
+
+    def get_many(self, keys):
+        """Returns {real_path: metadata} for every (real_path, mtime_ns, size) key that is cached and still valid."""
+        found = {}
+        if not keys:
+            return found
+        wanted = {path: (mtime_ns, size) for path, mtime_ns, size in keys}
+        paths = list(wanted)
+        with self.lock:
+            # Stay well below SQLITE_MAX_VARIABLE_NUMBER
+            for i in range(0, len(paths), 500):
+                chunk = paths[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    f"SELECT path, mtime_ns, size, data FROM metadata WHERE path IN ({placeholders})", chunk
+                ).fetchall()
+                for path, mtime_ns, size, data in rows:
+                    if wanted[path] != (mtime_ns, size):
+                        continue  # Stale entry, file changed since it was cached
+                    try:
+                        found[path] = decode_metadata(data)
+                    except ValueError:
+                        continue
+                    self._touched.add(path)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get_resolutions(self, keys):
+        """Returns {real_path: "WIDTHxHEIGHT"} for every (real_path, mtime_ns, size) key that is cached, still
+        valid and has a resolution. Only that field is read from the stored JSON, for light listings."""
+        found = {}
+        if not keys:
+            return found
+        wanted = {path: (mtime_ns, size) for path, mtime_ns, size in keys}
+        paths = list(wanted)
+        with self.lock:
+            for i in range(0, len(paths), 500):
+                chunk = paths[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    "SELECT path, mtime_ns, size, json_extract(data, '$.fileinfo.resolution')"
+                    f" FROM metadata WHERE path IN ({placeholders})", chunk
+                ).fetchall()
+                for path, mtime_ns, size, resolution in rows:
+                    if wanted[path] == (mtime_ns, size) and isinstance(resolution, str):
+                        found[path] = resolution
+        return found
+
+    def get(self, real_path, mtime_ns, size):
+        """Returns cached metadata for a single file or None."""
+        return self.get_many([(real_path, mtime_ns, size)]).get(real_path)
+
+    def put_many(self, items):
+        """Stores [(real_path, mtime_ns, size, metadata)], replacing older entries for the same path."""
+        if not items:
+            return
+        self.put_many_encoded([
+            (path, mtime_ns, size, encode_metadata(metadata)) for path, mtime_ns, size, metadata in items
+        ])
+
+    def put_many_encoded(self, items):
+        """Stores [(real_path, mtime_ns, size, data)] with data already produced by encode_metadata."""
+        if not items:
+            return
+        now = time.time()
+        rows = [(path, mtime_ns, size, data, len(data), now) for path, mtime_ns, size, data in items]
+        with self.lock:
+            paths = [row[0] for row in rows]
+            replaced = 0
+            for i in range(0, len(paths), 500):
+                chunk = paths[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                replaced += self.conn.execute(
+                    f"SELECT COALESCE(SUM(bytes), 0) FROM metadata WHERE path IN ({placeholders})", chunk
+                ).fetchone()[0]
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO metadata (path, mtime_ns, size, data, bytes, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.total_bytes += sum(row[4] for row in rows) - replaced
+            self._evict_locked()
+            self.conn.commit()
+
+    def put(self, real_path, mtime_ns, size, metadata):
+        self.put_many([(real_path, mtime_ns, size, metadata)])
+
+    def get_hashes(self, keys):
+        """Returns {real_path: hash or None} for every (real_path, mtime_ns, size) key with a stored, still valid hash."""
+        found = {}
+        wanted = {path: (mtime_ns, size) for path, mtime_ns, size in keys}
+        paths = list(wanted)
+        with self.lock:
+            for i in range(0, len(paths), 500):
+                chunk = paths[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for path, mtime_ns, size, value in self.conn.execute(
+                    f"SELECT path, mtime_ns, size, hash FROM image_hashes WHERE path IN ({placeholders})", chunk
+                ):
+                    if wanted[path] == (mtime_ns, size):
+                        found[path] = None if value is None else value + _INT64_SIGN
+        return found
+
+    def put_hashes(self, items):
+        """Stores [(real_path, mtime_ns, size, hash or None)], replacing older hashes for the same path."""
+        if not items:
+            return
+        rows = [(path, mtime_ns, size, None if value is None else value - _INT64_SIGN) for path, mtime_ns, size, value in items]
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO image_hashes (path, mtime_ns, size, hash) VALUES (?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def discard(self, real_paths):
+        """Removes entries for files known to be deleted."""
+        real_paths = list(real_paths)
+        if not real_paths:
+            return
+        with self.lock:
+            for i in range(0, len(real_paths), 500):
+                chunk = real_paths[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                freed = self.conn.execute(
+                    f"SELECT COALESCE(SUM(bytes), 0) FROM metadata WHERE path IN ({placeholders})", chunk
+                ).fetchone()[0]
+                removed = self.conn.execute(f"DELETE FROM metadata WHERE path IN ({placeholders})", chunk).rowcount
+                self.conn.execute(f"DELETE FROM image_hashes WHERE path IN ({placeholders})", chunk)
+                self.total_bytes -= freed
+                self.purged += removed
+            self.conn.commit()
+
+    def purge_missing(self, real_root, seen_paths):
+        """After a full scan of real_root, drops entries under it that the scan did not see."""
+        prefix = real_root.rstrip(os.sep) + os.sep
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT path FROM metadata WHERE substr(path, 1, ?) = ?"
+                " UNION SELECT path FROM image_hashes WHERE substr(path, 1, ?) = ?", (len(prefix), prefix, len(prefix), prefix)
+            ).fetchall()
+        stale = [path for (path,) in rows if path not in seen_paths]
+        if stale:
+            gallery_log(f"MetadataCache: purging {len(stale)} entries for deleted files under {real_root}")
+            self.discard(stale)
+
+    def flush(self):
+        """Persists last_used for entries hit since the previous flush (used for LRU eviction)."""
+        with self.lock:
+            if not self._touched:
+                return
+            now = time.time()
+            self.conn.executemany("UPDATE metadata SET last_used = ? WHERE path = ?", [(now, path) for path in self._touched])
+            self._touched.clear()
+            self.conn.commit()
+
+    def _evict_locked(self):
+        """Drops least recently used entries until the cache fits max_bytes. Caller holds the lock."""
+        if self.total_bytes <= self.max_bytes:
+            return
+        target = int(self.max_bytes * _EVICT_TARGET_RATIO)
+        cursor = self.conn.execute("SELECT path, bytes FROM metadata ORDER BY last_used ASC")
+        victims = []
+        freed = 0
+        for path, size in cursor:
+            if self.total_bytes - freed <= target:
+                break
+            victims.append((path,))
+            freed += size
+        cursor.close()
+        self.conn.executemany("DELETE FROM metadata WHERE path = ?", victims)
+        self.total_bytes -= freed
+        self.evictions += len(victims)
+        gallery_log(f"MetadataCache: evicted {len(victims)} entries ({freed} bytes)")
+
+    def stats(self):
+        """Returns hit/miss counters and current size."""
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else None,
+                "evictions": self.evictions,
+                "purged": self.purged,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+_cache_failed = False
+
+
+def get_metadata_cache():
+    """Returns the shared MetadataCache, or None if the database could not be opened."""
+    global _cache, _cache_failed
+    if _cache is not None or _cache_failed:
+        return _cache
+    with _cache_lock:
+        if _cache is None and not _cache_failed:
+            try:
+                _cache = MetadataCache()
+            except Exception as e:
+                # Read-only installs etc. — scanning still works, just without the cache
+                _cache_failed = True
+                gallery_log(f"MetadataCache: disabled, could not open {CACHE_FILE}: {e}")
+    return _cache
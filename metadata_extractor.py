@@ -1,17 +1,26 @@
 import os
 import json
+import struct
+import zlib
 from datetime import datetime
 from pathlib import Path
+from types import SimpleNamespace
 from PIL import Image, ImageOps
 from PIL.ExifTags import TAGS, GPSTAGS, IFD
-from PIL.PngImagePlugin import PngImageFile
+from PIL.PngImagePlugin import PngImageFile, MAX_TEXT_CHUNK, MAX_TEXT_MEMORY, _MODES as PNG_MODES
 from PIL.JpegImagePlugin import JpegImageFile
 import folder_paths
+from . import gallery_config
+from .raw_json import validate_raw_json
+from .media_metadata import MEDIA_EXTENSIONS, read_media_info, media_tags_to_info
 
 CONFIG_INDENT = 4  # Assuming a default indent value if CONFIG is not available
 
 def get_size(file_path):
-    file_size_bytes = os.path.getsize(file_path)
+    return format_size(os.path.getsize(file_path))
+
+
+def format_size(file_size_bytes):
     if file_size_bytes < 1024:
         return f"{file_size_bytes} bytes"
     elif file_size_bytes < 1024 * 1024:
@@ -20,6 +29,26 @@ def get_size(file_path):
         return f"{file_size_bytes / (1024 * 1024):.2f} MB"
 
 
+def read_resolution(image_path):
+    """Returns "WIDTHxHEIGHT" reading only the image header, without decoding pixels or metadata chunks.
+    For video/audio containers it is None when the file has no video track."""
+    if image_path.lower().endswith(MEDIA_EXTENSIONS):
+        with open(image_path, "rb") as f:
+            media = read_media_info(f)
+        return f"{media['width']}x{media['height']}" if media["width"] and media["height"] else None
+    with open(image_path, "rb") as f:
+        head = f.read(32)
+    if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+        width, height = struct.unpack(">II", head[16:24])
+        return f"{width}x{height}"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        width, height = struct.unpack("<HH", head[6:10])
+        return f"{width}x{height}"
+    # JPEG, WebP and the rest: Image.open only parses the header until pixels are accessed
+    with Image.open(image_path) as img:
+        return f"{img.width}x{img.height}"
+
+
 def buildMetadata(image_path):
     if not Path(image_path).is_file():
         raise FileNotFoundError(f"File not found: {image_path}")
@@ -37,80 +66,375 @@ def buildMetadata(image_path):
 
     # only for png files
     if isinstance(img, PngImageFile):
-        metadataFromImg = img.info
-
-        # for all metadataFromImg convert to string (but not for workflow and prompt!)
-        for k, v in metadataFromImg.items():
-            # from ComfyUI
-            if k == "workflow":
-                if isinstance(v, str): # Check if v is a string before attempting json.loads
-                    try:
-                        metadata["workflow"] = json.loads(v)
-                    except json.JSONDecodeError as e:
-                        print(f"Warning: Error parsing metadataFromImg 'workflow' as JSON, keeping as string: {e}")
-                        metadata["workflow"] = v # Keep as string if parsing fails
-                else:
-                    metadata["workflow"] = v # If not a string, keep as is (might already be parsed)
-
-            # from ComfyUI
-            elif k == "prompt":
-                if isinstance(v, str): # Check if v is a string before attempting json.loads
-                    try:
-                        metadata["prompt"] = json.loads(v)
-                        prompt = metadata["prompt"] # extract prompt to use on metadata
-                    except json.JSONDecodeError as e:
-                        print(f"Warning: Error parsing metadataFromImg 'prompt' as JSON, keeping as string: {e}")
-                        metadata["prompt"] = v # Keep as string if parsing fails
-                else:
-                    metadata["prompt"] = v # If not a string, keep as is (might already be parsed)
+        prompt = _add_png_info_metadata(metadata, img.info)
+
+    if isinstance(img, JpegImageFile):
+        _add_exif_metadata(metadata, img.getexif())
+
+    return img, prompt, metadata
 
+
+def _add_png_info_metadata(metadata, metadataFromImg):
+    """Adds PNG text chunks to metadata, parsing JSON values. Returns the parsed ComfyUI prompt or {}.
+    With gallery_config.raw_json_metadata, workflow and prompt are kept as validated RawJSON text instead."""
+    prompt = {}
+    keep_raw = gallery_config.raw_json_metadata
+
+    # for all metadataFromImg convert to string (but not for workflow and prompt!)
+    for k, v in metadataFromImg.items():
+        # from ComfyUI
+        if k == "workflow":
+            if keep_raw and isinstance(v, str) and _set_raw_json(metadata, "workflow", v):
+                pass
+            elif isinstance(v, str): # Check if v is a string before attempting json.loads
+                try:
+                    metadata["workflow"] = json.loads(v)
+                except json.JSONDecodeError as e:
+                    print(f"Warning: Error parsing metadataFromImg 'workflow' as JSON, keeping as string: {e}")
+                    metadata["workflow"] = v # Keep as string if parsing fails
             else:
-                if isinstance(v, str): # Check if v is a string before attempting json.loads
-                    try:
-                        metadata[str(k)] = json.loads(v)
-                    except json.JSONDecodeError as e:
-                        # print(f"Debug: Error parsing {k} as JSON, trying as string: {e}")
-                        metadata[str(k)] = v # Keep as string if parsing fails
-                else:
-                    metadata[str(k)] = v # If not a string, keep as is
+                metadata["workflow"] = v # If not a string, keep as is (might already be parsed)
 
-    if isinstance(img, JpegImageFile):
-        exif = img.getexif()
+        # from ComfyUI
+        elif k == "prompt":
+            if keep_raw and isinstance(v, str) and _set_raw_json(metadata, "prompt", v):
+                prompt = metadata["prompt"] # RawJSON, parse_raw_json() it to read fields
+            elif isinstance(v, str): # Check if v is a string before attempting json.loads
+                try:
+                    metadata["prompt"] = json.loads(v)
+                    prompt = metadata["prompt"] # extract prompt to use on metadata
+                except json.JSONDecodeError as e:
+                    print(f"Warning: Error parsing metadataFromImg 'prompt' as JSON, keeping as string: {e}")
+                    metadata["prompt"] = v # Keep as string if parsing fails
+            else:
+                metadata["prompt"] = v # If not a string, keep as is (might already be parsed)
 
-        for k, v in exif.items():
-            tag = TAGS.get(k, k)
-            if v is not None:
+        else:
+            if isinstance(v, str): # Check if v is a string before attempting json.loads
                 try:
-                    metadata[str(tag)] = str(v)
-                except Exception as e:
-                    print(f"Warning: Error converting EXIF tag {tag} to string: {e}")
-                    metadata[str(tag)] = "Error decoding value" # Handle encoding errors
+                    metadata[str(k)] = json.loads(v)
+                except json.JSONDecodeError as e:
+                    # print(f"Debug: Error parsing {k} as JSON, trying as string: {e}")
+                    metadata[str(k)] = v # Keep as string if parsing fails
+            else:
+                metadata[str(k)] = v # If not a string, keep as is
+
+    return prompt
+
+
+def _set_raw_json(metadata, key, text):
+    """Stores text as RawJSON if it is valid, returns False so the caller parses it the usual way otherwise."""
+    try:
+        metadata[key] = validate_raw_json(text)
+        return True
+    except ValueError:
+        return False
+
 
-        for ifd_id in IFD:
+def _add_exif_metadata(metadata, exif):
+    """Adds the base EXIF tags and every IFD of a PIL Exif object to metadata, as strings."""
+    for k, v in exif.items():
+        tag = TAGS.get(k, k)
+        if v is not None:
             try:
-                if ifd_id == IFD.GPSInfo:
-                    resolve = GPSTAGS
-                else:
-                    resolve = TAGS
+                metadata[str(tag)] = str(v)
+            except Exception as e:
+                print(f"Warning: Error converting EXIF tag {tag} to string: {e}")
+                metadata[str(tag)] = "Error decoding value" # Handle encoding errors
 
-                ifd = exif.get_ifd(ifd_id)
-                ifd_name = str(ifd_id.name)
-                metadata[ifd_name] = {}
+    for ifd_id in IFD:
+        try:
+            if ifd_id == IFD.GPSInfo:
+                resolve = GPSTAGS
+            else:
+                resolve = TAGS
 
-                for k, v in ifd.items():
-                    tag = resolve.get(k, k)
-                    try:
-                        metadata[ifd_name][str(tag)] = str(v)
-                    except Exception as e:
-                        print(f"Warning: Error converting EXIF IFD tag {tag} to string: {e}")
-                        metadata[ifd_name][str(tag)] = "Error decoding value" # Handle encoding errors
+            ifd = exif.get_ifd(ifd_id)
+            ifd_name = str(ifd_id.name)
+            metadata[ifd_name] = {}
 
+            for k, v in ifd.items():
+                tag = resolve.get(k, k)
+                try:
+                    metadata[ifd_name][str(tag)] = str(v)
+                except Exception as e:
+                    print(f"Warning: Error converting EXIF IFD tag {tag} to string: {e}")
+                    metadata[ifd_name][str(tag)] = "Error decoding value" # Handle encoding errors
 
-            except KeyError:
-                pass
+        except KeyError:
+            pass
 
 
-    return img, prompt, metadata
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Chunks before IDAT that PIL turns into info entries; files containing them go through PIL
+_PNG_PIL_INFO_CHUNKS = {b"acTL", b"cHRM", b"eXIf", b"fcTL", b"gAMA", b"iCCP", b"pHYs", b"sRGB", b"tRNS"}
+# SOFn markers carrying the frame size (C4, C8 and CC are DHT, JPG and DAC)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class _NeedsPIL(Exception):
+    """Raised by the header readers when a file uses something only PIL handles exactly."""
+
+
+def _read_png_header(f):
+    """Returns (width, height, info) reading the chunks before IDAT, with info matching PngImageFile.info."""
+    if f.read(8) != _PNG_SIGNATURE:
+        raise _NeedsPIL()
+    width = height = None
+    info = {}
+    text_memory = 0
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise _NeedsPIL()
+        length, chunk_type = struct.unpack(">I4s", header)
+        if chunk_type in (b"IDAT", b"IEND"):
+            break
+        if chunk_type in _PNG_PIL_INFO_CHUNKS:
+            raise _NeedsPIL()
+        if chunk_type not in (b"IHDR", b"tEXt", b"zTXt", b"iTXt"):
+            f.seek(length + 4, os.SEEK_CUR)  # Data and CRC of chunks that do not reach metadata
+            continue
+        if text_memory + length > MAX_TEXT_MEMORY:
+            raise _NeedsPIL()  # Not read into memory here, PIL applies its own limits
+        data = f.read(length)
+        crc = f.read(4)
+        if len(data) < length or len(crc) < 4 or zlib.crc32(chunk_type + data) != struct.unpack(">I", crc)[0]:
+            raise _NeedsPIL()
+
+        if chunk_type == b"IHDR":
+            if length < 13 or data[11] or (data[8], data[9]) not in PNG_MODES:
+                raise _NeedsPIL()
+            width, height = struct.unpack(">II", data[:8])
+            if data[12]:
+                info["interlace"] = 1
+            continue
+
+        key, sep, value = data.partition(b"\0")
+        if chunk_type == b"zTXt":
+            if not sep or value[:1] not in (b"", b"\0"):
+                raise _NeedsPIL()
+            value = _png_decompress(value[1:]) if value else b""
+        elif chunk_type == b"iTXt":
+            if len(value) < 2 or value[1] != 0:
+                raise _NeedsPIL()
+            compressed = value[0]
+            language, _, rest = value[2:].partition(b"\0")
+            translated, _, value = rest.partition(b"\0")
+            if compressed:
+                value = _png_decompress(value)
+            language.decode("utf-8")
+            translated.decode("utf-8")
+        if not key:
+            continue
+        key = key.decode("latin-1")
+        if chunk_type == b"iTXt":
+            if key == "XML:com.adobe.xmp":
+                raise _NeedsPIL()  # PIL also exposes it as info["xmp"]
+            text = value.decode("utf-8")
+        else:
+            text = value.decode("latin-1", "replace")
+        text_memory += len(text)
+        if text_memory > MAX_TEXT_MEMORY:
+            raise _NeedsPIL()
+        info[key] = value if key == "exif" and chunk_type == b"tEXt" else text
+
+    if width is None:
+        raise _NeedsPIL()
+    return width, height, info
+
+
+def _png_decompress(data):
+    decompressor = zlib.decompressobj()
+    value = decompressor.decompress(data, MAX_TEXT_CHUNK)
+    if decompressor.unconsumed_tail:
+        raise _NeedsPIL()  # Over PIL's decompression limit
+    return value
+
+
+def _read_jpeg_header(f):
+    """Returns (width, height, exif_bytes or None) walking the JPEG segments up to the first scan."""
+    if f.read(2) != b"\xff\xd8":
+        raise _NeedsPIL()
+    size = None
+    exif = None
+    while True:
+        byte = f.read(1)
+        while byte == b"\xff":
+            marker = f.read(1)
+            if marker != b"\xff":
+                break
+            byte = marker
+        else:
+            raise _NeedsPIL()  # Garbage between segments, let PIL deal with it
+        if not marker:
+            raise _NeedsPIL()
+        marker = marker[0]
+        if marker == 0xD8 or 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            continue  # Standalone markers without a length
+        if marker == 0xD9 or (marker == 0xDA and size is None):
+            raise _NeedsPIL()  # Reached end of image or scan data without a frame header
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            raise _NeedsPIL()
+        length = struct.unpack(">H", length_bytes)[0] - 2
+        if length < 0:
+            raise _NeedsPIL()
+        if marker == 0xDA:
+            if len(f.read(length)) < length:
+                raise _NeedsPIL()  # PIL reads the scan header too
+            return size[0], size[1], exif
+        if marker in _JPEG_SOF_MARKERS:
+            data = f.read(length)
+            if len(data) < 5:
+                raise _NeedsPIL()
+            if size is None:
+                height, width = struct.unpack(">HH", data[1:5])
+                size = (width, height)
+            continue
+        if marker == 0xE1:
+            data = f.read(length)
+            if data[:6] == b"Exif\0\0":
+                if exif is None:
+                    exif = data
+            else:
+                raise _NeedsPIL()  # XMP, which PIL reads for the orientation tag
+            continue
+        f.seek(length, os.SEEK_CUR)
+
+
+def _read_webp_size(f, file_size):
+    """Returns (width, height) of the canvas from the first WebP chunk."""
+    head = f.read(30)
+    if len(head) < 30 or head[:4] != b"RIFF" or head[8:12] != b"WEBP":
+        raise _NeedsPIL()
+    if int.from_bytes(head[4:8], "little") + 8 > file_size:
+        raise _NeedsPIL()  # Truncated, PIL decodes the whole file and fails on it
+    chunk_type = head[12:16]
+    if chunk_type == b"VP8X":
+        width = 1 + int.from_bytes(head[24:27], "little")
+        height = 1 + int.from_bytes(head[27:30], "little")
+    elif chunk_type == b"VP8L" and head[20] == 0x2F:
+        bits = int.from_bytes(head[21:25], "little")
+        width = 1 + (bits & 0x3FFF)
+        height = 1 + ((bits >> 14) & 0x3FFF)
+    elif chunk_type == b"VP8 " and head[23:26] == b"\x9d\x01\x2a":
+        width, height = struct.unpack("<HH", head[26:30])
+        width &= 0x3FFF
+        height &= 0x3FFF
+    else:
+        raise _NeedsPIL()
+    return width, height
+
+
+def _read_gif_size(f):
+    """Returns (width, height) of the screen, walking the blocks up to the first frame the way PIL opens it."""
+    head = f.read(13)
+    if len(head) < 13:
+        raise _NeedsPIL()
+    width, height, flags = struct.unpack("<HHB", head[6:11])
+    if flags & 0x80:
+        f.seek(3 << ((flags & 7) + 1), os.SEEK_CUR)  # Global color table
+    while True:
+        block = f.read(1)
+        if block in (b"", b";"):
+            raise _NeedsPIL()  # No frame, PIL fails on it
+        if block == b"!":
+            f.read(1)  # Extension label, then sub-blocks up to an empty one
+            size = f.read(1)
+            while size and size[0]:
+                f.seek(size[0], os.SEEK_CUR)
+                size = f.read(1)
+        elif block == b",":
+            descriptor = f.read(9)
+            if len(descriptor) < 9:
+                raise _NeedsPIL()
+            x0, y0, frame_width, frame_height, frame_flags = struct.unpack("<HHHHB", descriptor)
+            if x0 + frame_width > width or y0 + frame_height > height:
+                raise _NeedsPIL()  # PIL grows the size to the frame
+            if frame_flags & 0x80:
+                f.seek(3 << ((frame_flags & 7) + 1), os.SEEK_CUR)  # Local color table
+            if not f.read(1):
+                raise _NeedsPIL()  # LZW code size
+            return width, height
+
+
+def listed_stat(mtime_ns, size):
+    """The st_mtime and st_size buildMetadataFast reads, for a file whose mtime_ns and size were listed
+    already. st_mtime is computed the way os.stat computes it."""
+    seconds, nanoseconds = divmod(mtime_ns, 10**9)
+    return SimpleNamespace(st_mtime=seconds + nanoseconds * 1e-9, st_size=size)
+
+
+def buildMetadataFast(image_path, stat=None):
+    """Same metadata as buildMetadata, read from the PNG/JPEG/WebP/GIF headers without opening the image
+    with PIL. Anything the header readers do not handle exactly falls back to buildMetadata.
+    Video/audio containers get their metadata from buildMediaMetadata.
+    stat is the file's stat when the caller listed it already (see listed_stat), saving an fstat."""
+    if image_path.lower().endswith(MEDIA_EXTENSIONS):
+        return buildMediaMetadata(image_path, stat)
+    try:
+        with open(image_path, "rb") as f:
+            if stat is None:
+                stat = os.fstat(f.fileno())
+            head = f.read(12)
+            f.seek(0)
+            exif = None
+            info = None
+            if head[:8] == _PNG_SIGNATURE:
+                width, height, info = _read_png_header(f)
+            elif head[:2] == b"\xff\xd8":
+                width, height, exif = _read_jpeg_header(f)
+            elif head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+                width, height = _read_webp_size(f, stat.st_size)
+            elif head[:6] in (b"GIF87a", b"GIF89a"):
+                width, height = _read_gif_size(f)
+            else:
+                raise _NeedsPIL()
+    except (_NeedsPIL, ValueError, UnicodeError, zlib.error, struct.error):
+        _, _, metadata = buildMetadata(image_path)
+        return metadata
+
+    metadata = {}
+    metadata["fileinfo"] = {
+        "filename": Path(image_path).as_posix(),
+        "resolution": f"{width}x{height}",
+        "date": str(datetime.fromtimestamp(stat.st_mtime)),
+        "size": str(format_size(stat.st_size)),
+    }
+    if info is not None:
+        _add_png_info_metadata(metadata, info)
+    elif head[:2] == b"\xff\xd8":
+        exif_data = Image.Exif()
+        if exif is not None:
+            exif_data.load(exif)
+        _add_exif_metadata(metadata, exif_data)
+    return metadata
+
+
+def buildMediaMetadata(media_path, stat=None):
+    """Metadata of an MP4/MOV/WebM/MKV/FLAC file read from its container header: resolution, duration
+    and the embedded workflow/prompt tags, which are handled like PNG text chunks."""
+    with open(media_path, "rb") as f:
+        if stat is None:
+            stat = os.fstat(f.fileno())
+        try:
+            media = read_media_info(f)
+        except ValueError as e:
+            print(f"Warning: Could not read media header of {media_path}: {e}")
+            media = {"width": None, "height": None, "duration": None, "tags": {}}
+
+    metadata = {}
+    metadata["fileinfo"] = {"filename": Path(media_path).as_posix()}
+    if media["width"] and media["height"]:
+        metadata["fileinfo"]["resolution"] = f"{media['width']}x{media['height']}"
+    metadata["fileinfo"]["date"] = str(datetime.fromtimestamp(stat.st_mtime))
+    metadata["fileinfo"]["size"] = str(format_size(stat.st_size))
+    if media["duration"] is not None:
+        metadata["fileinfo"]["duration"] = f"{media['duration']:.2f}s"
+    if media["tags"]:
+        _add_png_info_metadata(metadata, media_tags_to_info(media["tags"]))
+    return metadata
 
 
 def buildPreviewText(metadata):
@@ -0,0 +1,201 @@
+# monitor_registry.py
+import os
+import threading
+import time
+
+from server import PromptServer
+from .folder_monitor import FileSystemMonitor
+from .folder_scanner import normalize_extensions, static_mount_id
+from .gallery_config import gallery_log
+
+# A monitor no client holds keeps running this long, switching back to its folder finds the index warm
+IDLE_TIMEOUT = 600.0
+# At most this many idle monitors keep running, the longest idle one is stopped first
+MAX_IDLE_MONITORS = 2
+# Client id of requests that do not send one (older frontends, scripts), never pruned
+DEFAULT_CLIENT = "default"
+
+
+def _running(monitor):
+    return monitor.thread is not None and monitor.thread.is_alive()
+
+
+def _is_within(path, root):
+    try:
+        return os.path.commonpath([os.path.normpath(path), root]) == root
+    except ValueError:  # Different drives on Windows
+        return False
+
+
+class MonitorRegistry:
+    """Monitors and static mounts of all gallery roots, shared by every client.
+
+    Monitors are keyed by the real path of their root and reference-counted by client (the ComfyUI
+    websocket client id): clients on the same folder share one watcher and index, a client holds
+    one root at a time and a monitor keeps running for IDLE_TIMEOUT after its last client moved on.
+
+    Mounts map the first segment of /static_gallery URLs to the root they are served from and the
+    extensions served there. Monitored roots are mounted while their monitor runs, configured roots
+    (pinned) for good."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.monitors = {}  # real root -> FileSystemMonitor
+        self.settings = {}  # real root -> (extensions, deduplicate_symlinks, use_polling_observer) of its monitor
+        self.paths = {}  # real root -> path it was requested as
+        self.clients = {}  # client id -> real root it holds
+        self.idle_since = {}  # real root -> time.time() its last client let go
+        self.mounts = {}  # mount id -> (root path, normalized extensions served)
+        self.pinned_mounts = set()  # Mount ids kept when no monitor runs for them
+        self.last_root = None  # Real path of the most recently acquired root
+
+    def register_mount(self, full_path, extensions=None, pinned=False):
+        """Serves the files of full_path with the given extensions under its mount id, returns the id.
+        Unless pinned the mount is dropped when the monitor of full_path stops."""
+        mount = static_mount_id(full_path)
+        with self.lock:
+            self.mounts[mount] = (full_path, normalize_extensions(extensions))
+            if pinned:
+                self.pinned_mounts.add(mount)
+        return mount
+
+    def mount_root(self, mount):
+        """Returns the root served under a mount id, or None if nothing is mounted there."""
+        mounted = self.mounts.get(mount)
+        return mounted[0] if mounted is not None else None
+
+    def mount_entry(self, mount):
+        """Returns (root, extensions) served under a mount id, or None if nothing is mounted there."""
+        return self.mounts.get(mount)
+
+    def acquire(self, client_id, full_path, extensions=None, deduplicate_symlinks=True, use_polling_observer=False):
+        """Makes client_id hold full_path instead of the root it held before and returns the monitor of
+        full_path. A running monitor is reused as long as it was started with the same settings."""
+        real_path = os.path.realpath(full_path)
+        settings = (tuple(extensions) if extensions is not None else None, deduplicate_symlinks, use_polling_observer)
+        self.register_mount(full_path, extensions)
+        to_stop = []
+        with self.lock:
+            self._prune_clients()
+            monitor = self.monitors.get(real_path)
+            if monitor is not None and (self.settings[real_path] != settings or not _running(monitor)):
+                gallery_log(f"MonitorRegistry: Settings changed, restarting the monitor of {full_path}")
+                to_stop.append(self.monitors.pop(real_path))
+                monitor = None
+            if monitor is None:
+                monitor = FileSystemMonitor(full_path, interval=1.0, use_polling_observer=use_polling_observer, extensions=extensions, deduplicate_symlinks=deduplicate_symlinks)
+                self.monitors[real_path] = monitor
+                self.settings[real_path] = settings
+                self.paths[real_path] = full_path
+                monitor.start_monitoring()
+            else:
+                gallery_log(f"MonitorRegistry: Reusing the running monitor of {full_path}")
+            self.clients[client_id] = real_path
+            self.last_root = real_path
+            to_stop.extend(self._update_idle())
+        for stopped in to_stop:
+            stopped.stop_monitoring()
+        return monitor
+
+    def release(self, client_id):
+        """Lets go of the root client_id holds, its monitor stays warm for IDLE_TIMEOUT if it was the last client."""
+        with self.lock:
+            self.clients.pop(client_id, None)
+            self._prune_clients()
+            to_stop = self._update_idle()
+        for stopped in to_stop:
+            stopped.stop_monitoring()
+
+    def sweep(self):
+        """Stops the monitors idle for longer than IDLE_TIMEOUT."""
+        with self.lock:
+            self._prune_clients()
+            to_stop = self._update_idle()
+        for stopped in to_stop:
+            stopped.stop_monitoring()
+
+    def get(self, full_path):
+        """Returns the running monitor of full_path, or None."""
+        monitor = self.monitors.get(os.path.realpath(full_path))
+        return monitor if monitor is not None and _running(monitor) else None
+
+    def root_for_client(self, client_id):
+        """Returns the root client_id holds, else the most recently acquired one, else None."""
+        with self.lock:
+            real_path = self.clients.get(client_id) or self.last_root
+            return self.paths.get(real_path) if real_path is not None else None
+
+    def monitors_for_paths(self, paths):
+        """Splits {path: exists_now} by running monitor: returns [(monitor, {path: exists_now})] for the
+        monitors whose root contains some of the paths. Overlapping roots both get the shared paths."""
+        with self.lock:
+            monitors = [monitor for monitor in self.monitors.values() if _running(monitor)]
+        result = []
+        for monitor in monitors:
+            handler = monitor.event_handler
+            watch_path = os.path.normpath(handler.watch_path)
+            subset = {
+                path: exists for path, exists in paths.items()
+                if _is_within(path, watch_path) or _is_within(os.path.realpath(path), handler.base_path)
+            }
+            if subset:
+                result.append((monitor, subset))
+        return result
+
+    def entries(self):
+        """Returns [(path, mount, monitor, clients, idle_seconds or None)] of the running monitors."""
+        now = time.time()
+        with self.lock:
+            refcounts = {}
+            for real_path in self.clients.values():
+                refcounts[real_path] = refcounts.get(real_path, 0) + 1
+            return [
+                (self.paths[real_path], static_mount_id(real_path), monitor, refcounts.get(real_path, 0),
+                 now - self.idle_since[real_path] if real_path in self.idle_since else None)
+                for real_path, monitor in self.monitors.items() if _running(monitor)
+            ]
+
+    def _prune_clients(self):
+        """Forgets clients whose websocket is gone, they never send monitor/stop."""
+        sockets = getattr(PromptServer.instance, "sockets", None)
+        if sockets is None:
+            return
+        for client_id in [client_id for client_id in self.clients if client_id != DEFAULT_CLIENT and client_id not in sockets]:
+            del self.clients[client_id]
+
+    def _update_idle(self):
+        """Tracks which monitors lost their last client and returns the ones to stop, with the lock held."""
+        now = time.time()
+        held = set(self.clients.values())
+        for real_path in self.monitors:
+            if real_path in held:
+                self.idle_since.pop(real_path, None)
+            elif real_path not in self.idle_since:
+                self.idle_since[real_path] = now
+                timer = threading.Timer(IDLE_TIMEOUT + 1.0, self.sweep)
+                timer.daemon = True
+                timer.start()
+        idle = sorted(self.idle_since, key=self.idle_since.get)  # Longest idle first
+        expired = [real_path for real_path in idle if now - self.idle_since[real_path] >= IDLE_TIMEOUT]
+        expired += [real_path for real_path in idle if real_path not in expired][:max(0, len(idle) - len(expired) - MAX_IDLE_MONITORS)]
+        to_stop = []
+        for real_path in expired:
+            gallery_log(f"MonitorRegistry: Stopping the idle monitor of {self.paths[real_path]}")
+            to_stop.append(self.monitors.pop(real_path))
+            del self.idle_since[real_path]
+            del self.settings[real_path]
+            del self.paths[real_path]
+            mount = static_mount_id(real_path)
+            if mount not in self.pinned_mounts:
+                self.mounts.pop(mount, None)
+            if self.last_root == real_path:
+                self.last_root = None
+        return to_stop
+
+
+_registry = MonitorRegistry()
+
+
+def get_monitor_registry():
+    """Returns the process-wide MonitorRegistry."""
+    return _registry
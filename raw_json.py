@@ -0,0 +1,111 @@
+# raw_json.py
+import json
+import math
+import re
+import uuid
+
+# Key marking a RawJSON value in cached metadata, see to_storable/from_storable
+_STORED_KEY = "__raw_json__"
+
+
+class RawJSON(str):
+    """JSON text known to be valid (and free of NaN/Infinity), written verbatim by dumps_json() instead of
+    being parsed and re-encoded. Use parse_raw_json() where the fields are actually needed."""
+
+    __slots__ = ()
+
+
+def _reject_constant(name):
+    raise ValueError(f"{name} is not valid JSON")
+
+
+def validate_raw_json(text):
+    """Returns text as RawJSON if it is valid strict JSON, raises ValueError otherwise."""
+    # NaN/Infinity would be sanitized to null on the parsed path, so those keep using it
+    json.loads(text, parse_constant=_reject_constant)
+    return RawJSON(text)
+
+
+def parse_raw_json(value):
+    """Returns the parsed value of a RawJSON, any other value unchanged."""
+    if isinstance(value, RawJSON):
+        return json.loads(value)
+    return value
+
+
+def resolve_raw_json(data):
+    """Recursively replaces RawJSON values by their parsed value, for encoders that do not go through dumps_json()."""
+    if isinstance(data, RawJSON):
+        return json.loads(data)
+    if isinstance(data, dict):
+        return {k: resolve_raw_json(v) for k, v in data.items()}
+    if isinstance(data, list):
+        return [resolve_raw_json(item) for item in data]
+    return data
+
+
+def sanitize_json_data(data):
+    """Recursively sanitizes data to be JSON serializable."""
+    if isinstance(data, dict):
+        return {k: sanitize_json_data(v) for k, v in data.items()}
+    elif isinstance(data, list):
+        return [sanitize_json_data(item) for item in data]
+    elif isinstance(data, float):
+        if math.isnan(data) or math.isinf(data):
+            return None
+        return data
+    elif isinstance(data, (int, str, bool, type(None))):
+        return data
+    else:
+        return str(data)
+
+
+def dumps_json(data):
+    """json.dumps that splices RawJSON values into the output as JSON instead of encoding them as strings."""
+    raw_values = []
+    token = uuid.uuid4().hex
+
+    def replace(value):
+        if isinstance(value, RawJSON):
+            raw_values.append(value)
+            # json.dumps escapes NUL and the token is random per call, so file content cannot forge a placeholder
+            return f"\0{token}:{len(raw_values) - 1}\0"
+        if isinstance(value, dict):
+            return {k: replace(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [replace(item) for item in value]
+        return value
+
+    text = json.dumps(replace(data))
+    if not raw_values:
+        return text
+    return re.sub(rf'"\\u0000{token}:(\d+)\\u0000"', lambda match: raw_values[int(match.group(1))], text)
+
+
+def to_storable(data):
+    """Wraps RawJSON values so they survive a plain json.dumps/json.loads round trip (see from_storable)."""
+    if isinstance(data, RawJSON):
+        return {_STORED_KEY: str(data)}
+    if isinstance(data, dict):
+        return {k: to_storable(v) for k, v in data.items()}
+    if isinstance(data, list):
+        return [to_storable(item) for item in data]
+    return data
+
+
+def from_storable(obj):
+    """object_hook for json.loads restoring the RawJSON values wrapped by to_storable."""
+    if len(obj) == 1 and _STORED_KEY in obj:
+        return RawJSON(obj[_STORED_KEY])
+    return obj
+
+
+def encode_metadata(metadata):
+    """Serializes metadata to the compact JSON text stored in the cache and sent back by worker processes."""
+    # RawJSON values are stored wrapped so decoding returns them unparsed
+    return json.dumps(to_storable(sanitize_json_data(metadata)))
+
+
+def decode_metadata(data):
+    """Inverse of encode_metadata."""
+    return json.loads(data, object_hook=from_storable)
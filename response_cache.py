@@ -0,0 +1,138 @@
+# response_cache.py
+import asyncio
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from aiohttp import web
+
+try:
+    import brotli  # Optional, gzip is always available
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed
+MIN_COMPRESS_BYTES = 1024
+_GZIP_LEVEL = 6
+_BROTLI_QUALITY = 5
+
+
+def accepted_encoding(accept_encoding, allow_br=True):
+    """Returns the best content coding we can produce for an Accept-Encoding header: "br", "gzip" or None."""
+    accepted = set()
+    for part in (accept_encoding or "").lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q=") and params[2:] in ("0", "0.0", "0.00", "0.000"):
+            continue
+        accepted.add(coding.strip())
+    if allow_br and brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def make_etag(*parts):
+    """Returns a weak ETag for the given version parts. Weak, because gzip/br/identity bodies share it."""
+    return 'W/"' + hashlib.sha1(repr(parts).encode("utf-8", "surrogateescape")).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of an If-None-Match header against etag."""
+    if not if_none_match or etag is None:
+        return False
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or (candidate[2:] if candidate.startswith("W/") else candidate) == opaque:
+            return True
+    return False
+
+
+class CachedBody:
+    """A response body with its ETag, compressed lazily once per content coding."""
+
+    def __init__(self, etag, body, content_type):
+        self.etag = etag
+        self.body = body
+        self.content_type = content_type
+        self.encoded = {}
+        self.lock = threading.Lock()
+
+    def encode(self, coding):
+        """Returns the body in the given content coding (None for identity), compressing it on first use."""
+        if coding is None or len(self.body) < MIN_COMPRESS_BYTES:
+            return None, self.body
+        with self.lock:
+            encoded = self.encoded.get(coding)
+            if encoded is None:
+                if coding == "br":
+                    encoded = brotli.compress(self.body, quality=_BROTLI_QUALITY)
+                else:
+                    encoded = gzip.compress(self.body, compresslevel=_GZIP_LEVEL)
+                self.encoded[coding] = encoded
+        return coding, encoded
+
+
+class ResponseCache:
+    """Keeps the latest body per request variant (LRU), so unchanged responses are served without
+    scanning, encoding or compressing again."""
+
+    def __init__(self, max_entries=8, max_body_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_body_bytes = max_body_bytes
+        self.entries = OrderedDict()  # variant -> CachedBody
+        self.lock = threading.Lock()
+        self.generation = 0  # Part of every ETag, bumped by invalidate()
+
+    def etag_for(self, variant, version):
+        return make_etag(variant, version, self.generation)
+
+    def get(self, variant, etag):
+        with self.lock:
+            cached = self.entries.get(variant)
+            if cached is None or cached.etag != etag:
+                return None
+            self.entries.move_to_end(variant)
+            return cached
+
+    def put(self, variant, etag, body, content_type):
+        """Stores body as the current version of variant and returns it as a CachedBody."""
+        cached = CachedBody(etag, body, content_type)
+        if len(body) > self.max_body_bytes:
+            return cached
+        with self.lock:
+            self.entries[variant] = cached
+            self.entries.move_to_end(variant)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return cached
+
+    def invalidate(self):
+        """Drops all bodies and changes every ETag, for changes the versions passed to etag_for do not reflect yet."""
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+
+class EncodedResponse(web.Response):
+    """Response whose body is already content-encoded: compression middlewares must not encode it again."""
+
+    def enable_compression(self, *args, **kwargs):
+        pass
+
+
+def cache_headers(etag):
+    """Headers making clients revalidate with If-None-Match on every request."""
+    return {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+
+
+async def send_cached_body(request, cached):
+    """Sends a CachedBody in the best coding the client accepts, compressing in an executor on first use."""
+    coding = accepted_encoding(request.headers.get("Accept-Encoding"))
+    coding, body = await asyncio.get_running_loop().run_in_executor(None, cached.encode, coding)
+    headers = cache_headers(cached.etag)
+    if coding is not None:
+        headers["Content-Encoding"] = coding
+    return EncodedResponse(body=body, content_type=cached.content_type, headers=headers)
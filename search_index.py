@@ -0,0 +1,418 @@
+# search_index.py
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from .gallery_config import gallery_log
+from .raw_json import parse_raw_json
+
+# Index database lives next to user_settings.json
+INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "search_index.db")
+
+# Sort orders accepted by search(): name -> (ORDER BY, keyset comparison, key columns).
+# Row ids are derived from the file timestamp (see _time_id), so FTS5 can return time ordered
+# matches straight from its doclists and stop after one page instead of sorting every match.
+SEARCH_SORTS = {
+    "newest": ("files_fts.rowid DESC", "<", "files_fts.rowid"),
+    "oldest": ("files_fts.rowid ASC", ">", "files_fts.rowid"),
+    "relevance": ("rank ASC, files_fts.rowid ASC", ">", "rank, files_fts.rowid"),  # bm25() is lower for better matches
+}
+# Low bits of a row id that tell apart files modified in the same millisecond
+_TIME_ID_BITS = 16
+# Query prefixes restricting a term to one field, e.g. lora:cyberpunk
+SEARCH_FIELDS = {
+    "name": "name",
+    "file": "name",
+    "prompt": "positive",
+    "positive": "positive",
+    "negative": "negative",
+    "model": "model",
+    "lora": "lora",
+    "sampler": "sampler",
+}
+
+# Facets counted per (root, folder, day): facet -> values of _prompt_values, the rest come from the entry
+FACETS = {"checkpoint": "model", "lora": "lora", "sampler": "sampler_name", "resolution": None, "type": None}
+# Bump when indexed rows change shape, older indexes are then rebuilt by the next full scan
+_SCHEMA_VERSION = 1
+
+# Prompt graph inputs holding model, LoRA and sampler names
+_MODEL_INPUTS = {"ckpt_name", "unet_name", "model_name", "base_ckpt_name"}
+_SAMPLER_INPUTS = {"sampler_name", "scheduler"}
+# Inputs holding prompt text on text encoders and the primitive/string nodes feeding them
+_TEXT_INPUTS = {"text", "text_g", "text_l", "prompt", "string", "value", "wildcard_text", "populated_text"}
+_QUERY_TERM = re.compile(r'(?:(\w+):)?(?:"([^"]*)"|(\S+))')
+
+
+def _follow_text(prompt, link, texts, seen):
+    """Collects prompt text upstream of a conditioning input link ([node_id, output_index])."""
+    if not isinstance(link, list) or not link:
+        return
+    node_id = str(link[0])
+    if node_id in seen:
+        return
+    seen.add(node_id)
+    node = prompt.get(node_id)
+    if not isinstance(node, dict):
+        return
+    for key, value in (node.get("inputs") or {}).items():
+        if isinstance(value, str):
+            if key in _TEXT_INPUTS and value.strip():
+                texts.append(value)
+        elif isinstance(value, list):
+            _follow_text(prompt, value, texts, seen)
+
+
+def _prompt_values(metadata):
+    """Returns {positive, negative, model, lora, sampler, sampler_name} value lists from the ComfyUI prompt graph."""
+    fields = {"positive": [], "negative": [], "model": [], "lora": [], "sampler": [], "sampler_name": []}
+    try:
+        prompt = parse_raw_json(metadata.get("prompt")) if isinstance(metadata, dict) else None
+    except ValueError:
+        prompt = None
+    if not isinstance(prompt, dict):
+        return fields
+
+    encoder_texts = []
+    for node in prompt.values():
+        if not isinstance(node, dict):
+            continue
+        inputs = node.get("inputs")
+        if not isinstance(inputs, dict):
+            continue
+        for key, value in inputs.items():
+            if not isinstance(value, str):
+                continue
+            if key in _MODEL_INPUTS:
+                fields["model"].append(value)
+            elif key.startswith("lora_name") or key == "lora":
+                fields["lora"].append(value)
+            elif key in _SAMPLER_INPUTS:
+                fields["sampler"].append(value)
+                if key == "sampler_name":
+                    fields["sampler_name"].append(value)
+        # Samplers reference their prompts through positive/negative conditioning links
+        for side in ("positive", "negative"):
+            if isinstance(inputs.get(side), list):
+                _follow_text(prompt, inputs[side], fields[side], set())
+        if node.get("class_type") == "CLIPTextEncode" and isinstance(inputs.get("text"), str):
+            encoder_texts.append(inputs["text"])
+
+    if not fields["positive"] and not fields["negative"]:
+        fields["positive"] = encoder_texts  # No sampler found, index every text encoder as positive
+    return fields
+
+
+def _search_fields(values):
+    return {key: "\n".join(dict.fromkeys(values[key])) for key in ("positive", "negative", "model", "lora", "sampler")}
+
+
+def extract_search_fields(metadata):
+    """Returns {positive, negative, model, lora, sampler} text extracted from the ComfyUI prompt graph."""
+    return _search_fields(_prompt_values(metadata))
+
+
+def extract_facets(entry, values):
+    """Returns the distinct (facet, value) pairs an entry is counted under, ("files", "") for every entry.
+    values are the _prompt_values of its metadata."""
+    pairs = {("files", ""), ("type", entry.get("type") or "unknown")}
+    for facet, key in FACETS.items():
+        for value in values[key] if key else ():
+            value = value.strip()
+            if value and value.lower() != "none":  # Unused slots of LoRA stacks
+                pairs.add((facet, value))
+    metadata = entry.get("metadata")
+    fileinfo = parse_raw_json(metadata.get("fileinfo")) if isinstance(metadata, dict) else None
+    resolution = fileinfo.get("resolution") if isinstance(fileinfo, dict) else None
+    if isinstance(resolution, str) and resolution:
+        pairs.add(("resolution", resolution))
+    return pairs
+
+
+def _day(timestamp):
+    """Local calendar day of a timestamp, the date bucket of the facet counts."""
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d") if timestamp is not None else ""
+
+
+def _time_id(timestamp):
+    """Smallest row id for files with this timestamp (millisecond resolution)."""
+    return int((timestamp or 0) * 1000) << _TIME_ID_BITS
+
+
+def build_match_query(text):
+    """Turns user input into an FTS5 query: every term must match, term* matches a prefix (slower on
+    large indexes), "quoted phrases" match as a whole and field:term restricts a term to one of SEARCH_FIELDS."""
+    parts = []
+    for field, phrase, word in _QUERY_TERM.findall(text):
+        prefix = not phrase and word.endswith("*")
+        term = (phrase or word).replace('"', " ").rstrip("*").strip()
+        if not term:
+            continue
+        column = SEARCH_FIELDS.get(field.lower()) if field else None
+        if field and column is None:
+            term = f"{field} {term}"  # Not a known field, e.g. a time like 12:30
+        match = f'"{term}"*' if prefix else f'"{term}"'
+        parts.append(f"{column} : {match}" if column else match)
+    if not parts:
+        raise ValueError("Empty search query")
+    return " AND ".join(parts)
+
+
+class SearchIndex:
+    """SQLite FTS5 index over filenames and the prompt fields of gallery images, per gallery root.
+
+    Alongside, facet_counts keeps file counts per (root, folder, day, facet, value), updated with every
+    indexed or removed file: facet queries read those aggregates, never the files."""
+
+    def __init__(self, db_path=INDEX_FILE):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " id INTEGER PRIMARY KEY,"
+            " root TEXT NOT NULL,"
+            " url TEXT NOT NULL,"
+            " folder TEXT NOT NULL,"
+            " name TEXT NOT NULL,"
+            " type TEXT,"
+            " timestamp REAL,"
+            " UNIQUE (root, url))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS files_folder ON files (root, folder)")
+        self.conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(name, positive, negative, model, lora, sampler)"
+        )
+        # Facets each file was counted under, to take them back when it is removed
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS file_facets (id INTEGER NOT NULL, day TEXT NOT NULL, facet TEXT NOT NULL, value TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS file_facets_id ON file_facets (id)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS facet_counts ("
+            " root TEXT NOT NULL,"
+            " folder TEXT NOT NULL,"
+            " day TEXT NOT NULL,"
+            " facet TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " count INTEGER NOT NULL,"
+            " PRIMARY KEY (root, folder, day, facet, value)) WITHOUT ROWID"
+        )
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+            # Files indexed before facets existed are not counted, drop them so the next full scan re-indexes them
+            self.conn.execute("DELETE FROM files")
+            self.conn.execute("DELETE FROM files_fts")
+            self.conn.execute("DELETE FROM file_facets")
+            self.conn.execute("DELETE FROM facet_counts")
+            self.conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        self.conn.commit()
+
+    def sync_root(self, root, folders_data):
+        """Brings the index for root in line with a full scan: re-indexes new or modified files and
+        drops files the scan did not see. Unchanged files are skipped."""
+        with self.lock:
+            existing = {
+                url: (file_id, timestamp)
+                for file_id, url, timestamp in self.conn.execute("SELECT id, url, timestamp FROM files WHERE root = ?", (root,))
+            }
+        changed = []
+        for folder_key, folder_content in folders_data.items():
+            for entry in folder_content.values():
+                known = existing.pop(entry["url"], None)
+                if known is None or known[1] != entry.get("timestamp"):
+                    changed.append((folder_key, entry))
+        self.update(root, changed, list(existing))
+        if changed or existing:
+            gallery_log(f"SearchIndex: indexed {len(changed)} files, removed {len(existing)} under {root}")
+
+    def sync_folder(self, root, folder_key, folder_content):
+        """sync_root for one folder: re-indexes its new or modified files and drops the ones it no longer
+        holds. Walks syncing folder by folder call prune_folders once they saw every folder."""
+        with self.lock:
+            existing = {
+                url: (file_id, timestamp)
+                for file_id, url, timestamp in self.conn.execute("SELECT id, url, timestamp FROM files WHERE root = ? AND folder = ?", (root, folder_key))
+            }
+        changed = []
+        for entry in folder_content.values():
+            known = existing.pop(entry["url"], None)
+            if known is None or known[1] != entry.get("timestamp"):
+                changed.append((folder_key, entry))
+        if changed or existing:
+            self.update(root, changed, list(existing))
+
+    def prune_folders(self, root, folder_keys):
+        """Drops the files of root in folders outside folder_keys, the folders a complete walk synced."""
+        with self.lock:
+            gone = [folder for (folder,) in self.conn.execute("SELECT DISTINCT folder FROM files WHERE root = ?", (root,)) if folder not in folder_keys]
+            removed_urls = [
+                url for folder in gone
+                for (url,) in self.conn.execute("SELECT url FROM files WHERE root = ? AND folder = ?", (root, folder))
+            ]
+        if removed_urls:
+            self.update(root, [], removed_urls)
+            gallery_log(f"SearchIndex: removed {len(removed_urls)} files of {len(gone)} deleted folders under {root}")
+
+    def update(self, root, entries, removed_urls=()):
+        """Indexes [(folder_key, entry)] and removes the given urls, used for incremental updates."""
+        rows = []
+        for folder_key, entry in entries:
+            values = _prompt_values(entry.get("metadata"))
+            fields = _search_fields(values)
+            # Folder names are searchable along with the file name
+            text = (entry["name"] + "\n" + folder_key, fields["positive"], fields["negative"], fields["model"], fields["lora"], fields["sampler"])
+            rows.append((entry, folder_key, text, extract_facets(entry, values)))
+        with self.lock:
+            for url in removed_urls:
+                self._delete_locked(root, url)
+            for entry, folder_key, text, facets in rows:
+                self._delete_locked(root, entry["url"])
+                base_id = _time_id(entry.get("timestamp"))
+                last_id = self.conn.execute(
+                    "SELECT MAX(id) FROM files WHERE id BETWEEN ? AND ?", (base_id, base_id + (1 << _TIME_ID_BITS) - 1)
+                ).fetchone()[0]
+                file_id = base_id if last_id is None else last_id + 1
+                self.conn.execute(
+                    "INSERT INTO files (id, root, url, folder, name, type, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (file_id, root, entry["url"], folder_key, entry["name"], entry.get("type"), entry.get("timestamp")),
+                )
+                self.conn.execute(
+                    "INSERT INTO files_fts (rowid, name, positive, negative, model, lora, sampler) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (file_id, *text),
+                )
+                day = _day(entry.get("timestamp"))
+                self.conn.executemany(
+                    "INSERT INTO file_facets (id, day, facet, value) VALUES (?, ?, ?, ?)",
+                    [(file_id, day, facet, value) for facet, value in facets],
+                )
+                self.conn.executemany(
+                    "INSERT INTO facet_counts (root, folder, day, facet, value, count) VALUES (?, ?, ?, ?, ?, 1)"
+                    " ON CONFLICT (root, folder, day, facet, value) DO UPDATE SET count = count + 1",
+                    [(root, folder_key, day, facet, value) for facet, value in facets],
+                )
+            self.conn.commit()
+
+    def _delete_locked(self, root, url):
+        row = self.conn.execute("SELECT id, folder FROM files WHERE root = ? AND url = ?", (root, url)).fetchone()
+        if row is not None:
+            file_id, folder_key = row
+            keys = [(root, folder_key, day, facet, value) for day, facet, value in self.conn.execute(
+                "SELECT day, facet, value FROM file_facets WHERE id = ?", (file_id,))]
+            self.conn.executemany(
+                "UPDATE facet_counts SET count = count - 1 WHERE root = ? AND folder = ? AND day = ? AND facet = ? AND value = ?", keys
+            )
+            self.conn.executemany(
+                "DELETE FROM facet_counts WHERE root = ? AND folder = ? AND day = ? AND facet = ? AND value = ? AND count <= 0", keys
+            )
+            self.conn.execute("DELETE FROM file_facets WHERE id = ?", (file_id,))
+            self.conn.execute("DELETE FROM files_fts WHERE rowid = ?", (file_id,))
+            self.conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+    def search(self, root, query, sort="newest", limit=100, after=None, folder=None, since=None, until=None):
+        """Returns (hits, next_key) for an FTS query built by build_match_query. Pass next_key back as
+        after to get the following page, it is None on the last page. Time sorts and since/until
+        have millisecond resolution."""
+        order_by, comparison, key_columns = SEARCH_SORTS[sort]
+        sql = (
+            "SELECT f.id, f.url, f.folder, f.name, f.type, f.timestamp, "
+            + ("bm25(files_fts)" if sort == "relevance" else "NULL") + " AS rank"
+            # CROSS JOIN keeps FTS as the outer loop, otherwise SQLite may walk files by root
+            # and evaluate MATCH once per row
+            " FROM files_fts CROSS JOIN files f ON f.id = files_fts.rowid"
+            " WHERE files_fts MATCH ? AND f.root = ?"
+        )
+        params = [build_match_query(query), root]
+        if folder:
+            sql += " AND (f.folder = ? OR substr(f.folder, 1, ?) = ?)"
+            params += [folder, len(folder) + 1, folder + "/"]
+        # Time bounds as row id ranges, FTS5 applies them while reading its doclists
+        if since is not None:
+            sql += " AND files_fts.rowid >= ?"
+            params.append(_time_id(since))
+        if until is not None:
+            sql += " AND files_fts.rowid < ?"
+            params.append(_time_id(until))
+        if after is not None:
+            sql += f" AND ({key_columns}) {comparison} ({', '.join('?' * len(after))})"
+            params += list(after)
+        sql += f" ORDER BY {order_by} LIMIT ?"
+        params.append(limit + 1)
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+
+        hits = [
+            {"folder": folder_key, "name": name, "url": url, "type": file_type, "timestamp": timestamp}
+            for _, url, folder_key, name, file_type, timestamp, _ in rows[:limit]
+        ]
+        next_key = None
+        if len(rows) > limit:
+            file_id, rank = rows[limit - 1][0], rows[limit - 1][6]
+            next_key = (rank, file_id) if sort == "relevance" else (file_id,)
+        return hits, next_key
+
+    def facets(self, root, folder=None, since=None, until=None, limit=100):
+        """Returns {"total", "facets"} for the files of root, optionally only under folder (including its
+        subfolders) and between the days since and until (YYYY-MM-DD, inclusive). facets maps every facet
+        of FACETS to its limit most frequent [{"value", "count"}] and "date" to the count of every day.
+        Reads the aggregates only: the cost grows with folders, days and distinct values, not with files."""
+        where = "root = ?"
+        params = [root]
+        if folder:
+            # Subfolder keys sort between "folder/" and "folder0", "0" follows "/"
+            where += " AND (folder = ? OR (folder >= ? AND folder < ?))"
+            params += [folder, folder + "/", folder + "0"]
+        if since:
+            where += " AND day >= ?"
+            params.append(since)
+        if until:
+            where += " AND day <= ?"
+            params.append(until)
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT facet, value, SUM(count) FROM facet_counts WHERE {where} GROUP BY facet, value", params
+            ).fetchall()
+            days = self.conn.execute(
+                f"SELECT day, SUM(count) FROM facet_counts WHERE {where} AND facet = 'files' GROUP BY day ORDER BY day", params
+            ).fetchall()
+
+        counts = {facet: [] for facet in FACETS}
+        total = 0
+        for facet, value, count in rows:
+            if facet == "files":
+                total = count
+            elif facet in counts:
+                counts[facet].append((value, count))
+        result = {
+            facet: [{"value": value, "count": count} for value, count in sorted(values, key=lambda item: (-item[1], item[0]))[:limit]]
+            for facet, values in counts.items()
+        }
+        result["date"] = [{"value": day, "count": count} for day, count in days]
+        return {"total": total, "facets": result}
+
+    def stats(self):
+        """Returns the number of indexed files per root."""
+        with self.lock:
+            return dict(self.conn.execute("SELECT root, COUNT(*) FROM files GROUP BY root").fetchall())
+
+
+_index = None
+_index_lock = threading.Lock()
+_index_failed = False
+
+
+def get_search_index():
+    """Returns the shared SearchIndex, or None if the database could not be opened (e.g. no FTS5)."""
+    global _index, _index_failed
+    if _index is not None or _index_failed:
+        return _index
+    with _index_lock:
+        if _index is None and not _index_failed:
+            try:
+                _index = SearchIndex()
+            except Exception as e:
+                _index_failed = True
+                gallery_log(f"SearchIndex: disabled, could not open {INDEX_FILE}: {e}")
+    return _index
@@ -5,33 +5,39 @@ import folder_paths
 import time
 from datetime import datetime
 import json
-import math
 import pathlib
 import threading
 import queue
 import asyncio
 import shutil
+import base64
+import hashlib
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
-from .folder_monitor import FileSystemMonitor
-from .folder_scanner import _scan_for_images, DEFAULT_EXTENSIONS
+from .folder_scanner import _fill_metadata, _scan_for_images, iter_scan_for_images, resolve_metadata, scan_fingerprints, get_file_type, static_mount_id, DEFAULT_EXTENSIONS
+from .image_hash import get_image_hasher, group_near_duplicates, hamming_distance, DEFAULT_THRESHOLD, MAX_THRESHOLD
+from .media_metadata import MEDIA_EXTENSIONS
 from .gallery_config import disable_logs, gallery_log
+from .gallery_stats import get_stats
+from .raw_json import dumps_json, sanitize_json_data
+from .json_fragments import get_fragment_cache, encode_fields, join_object, json_key
+from .response_cache import ResponseCache, accepted_encoding, cache_headers, etag_matches, make_etag, send_cached_body
+from .metadata_cache import get_metadata_cache
+from .monitor_registry import get_monitor_registry, DEFAULT_CLIENT
+from .search_index import get_search_index, SEARCH_SORTS
+from .single_flight import SingleFlight
+from .thumbnail_service import get_thumbnail_service, snap_thumbnail_size, THUMBNAIL_FORMATS, DEFAULT_THUMBNAIL_SIZE, DEFAULT_THUMBNAIL_FORMAT
+from .warmup import get_warmup, start_warmup
 
 # Add ComfyUI root to sys.path HERE
 import sys
 comfy_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(comfy_path)
 
-monitor = None
-# Placeholder directory.  This *must* exist, even if it's empty.
-PLACEHOLDER_DIR = os.path.join(comfy_path, "output")  # os.path.abspath("./placeholder_static")
-if not os.path.exists(PLACEHOLDER_DIR):
-    os.makedirs(PLACEHOLDER_DIR)
-
-# Add a *placeholder* static route.  This gets modified later.
-PromptServer.instance.routes.static('/static_gallery', PLACEHOLDER_DIR, follow_symlinks=True, name='static_gallery_placeholder') #give a name to the route
-
-# Initialize scan_lock here
-PromptServer.instance.scan_lock = threading.Lock()
+# Listing scans run off the event loop, concurrent requests for the same root share one scan
+listing_scans = SingleFlight(ttl=2.0)
+# Latest encoded (and compressed) listing per request variant, revalidated through ETags
+listing_cache = ResponseCache()
 
 # Settings file for persistent user settings
 SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "user_settings.json")
@@ -55,20 +61,77 @@ def save_settings_to_file(settings):
     except Exception as e:
         gallery_log(f"Error saving settings: {e}")
 
-def sanitize_json_data(data):
-    """Recursively sanitizes data to be JSON serializable."""
-    if isinstance(data, dict):
-        return {k: sanitize_json_data(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [sanitize_json_data(item) for item in data]
-    elif isinstance(data, float):
-        if math.isnan(data) or math.isinf(data):
-            return None
-        return data
-    elif isinstance(data, (int, str, bool, type(None))):
-        return data
-    else:
-        return str(data)
+# Sort orders accepted by the paginated listing: name -> (entry key, descending, types of the key's values)
+LISTING_SORTS = {
+    "newest": (lambda folder, entry: (entry.get("timestamp") or 0, entry["name"], folder), True, ((int, float), str, str)),
+    "oldest": (lambda folder, entry: (entry.get("timestamp") or 0, entry["name"], folder), False, ((int, float), str, str)),
+    "name_asc": (lambda folder, entry: (entry["name"], folder), False, (str, str)),
+    "name_desc": (lambda folder, entry: (entry["name"], folder), True, (str, str)),
+}
+DEFAULT_PAGE_LIMIT = 500
+MAX_PAGE_LIMIT = 5000
+# Listing modes: "full" embeds metadata, "light" only name/url/timestamp/date/type/resolution
+LISTING_MODES = ("full", "light")
+MAX_METADATA_BATCH = 500
+# Paths per /Gallery/delete_batch or /Gallery/move_batch request
+MAX_FILE_BATCH = 5000
+# format=ndjson: files per streamed line and lines buffered ahead of a slow client
+STREAM_BATCH_SIZE = 256
+STREAM_QUEUE_SIZE = 8
+DEFAULT_SEARCH_LIMIT = 100
+# Values returned per facet by /Gallery/facets
+DEFAULT_FACET_LIMIT = 100
+
+
+def encode_cursor(sort, key):
+    """Encodes the sort key of the last returned entry as an opaque cursor."""
+    raw = json.dumps([sort, list(key)], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, sort):
+    """Decodes a cursor produced by encode_cursor, raising ValueError if it is invalid for this sort."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, key = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort or not isinstance(key, list):
+        raise ValueError("Cursor does not match sort order")
+    # Compared against entry keys as a tuple, values of other types would fail there
+    key_types = LISTING_SORTS[sort][2]
+    if len(key) != len(key_types) or any(isinstance(value, bool) or not isinstance(value, types) for value, types in zip(key, key_types)):
+        raise ValueError("Invalid cursor")
+    return tuple(key)
+
+
+def paginate_folders(folders, limit, cursor=None, folder=None, sort="newest"):
+    """Returns one keyset-paginated page of folders as (page_folders, next_cursor, folder_counts)."""
+    key_func, descending, _ = LISTING_SORTS[sort]
+    if folder is not None:
+        folders = {folder: folders[folder]} if folder in folders else {}
+    folder_counts = {folder_key: len(content) for folder_key, content in folders.items()}
+
+    entries = [
+        (key_func(folder_key, entry), folder_key, filename, entry)
+        for folder_key, content in folders.items()
+        for filename, entry in content.items()
+    ]
+    entries.sort(key=lambda item: item[0], reverse=descending)
+
+    if cursor is not None:
+        after = decode_cursor(cursor, sort)
+        if descending:
+            entries = [item for item in entries if item[0] < after]
+        else:
+            entries = [item for item in entries if item[0] > after]
+
+    page = entries[:limit]
+    page_folders = {}
+    for _, folder_key, filename, entry in page:
+        page_folders.setdefault(folder_key, {})[filename] = entry
+    next_cursor = encode_cursor(sort, page[-1][0]) if len(entries) > limit else None
+    return page_folders, next_cursor, folder_counts
 
 
 @PromptServer.instance.routes.get("/Gallery/settings")
@@ -87,112 +150,609 @@ async def save_settings(request):
 
 @PromptServer.instance.routes.get("/Gallery/images")
 async def get_gallery_images(request):
-    """Endpoint to get gallery images, accepts relative_path."""
-    raw_rel = request.rel_url.query.get("relative_path", "./")
-    # Normalize query value: treat null/None/empty as root
-    if raw_rel is None or str(raw_rel).lower() == 'null' or str(raw_rel).strip() == "":
-        relative_path = "./"
-    else:
-        relative_path = raw_rel
+    """Endpoint to get gallery images, accepts relative_path and optional limit/cursor/folder/sort for paging."""
+    query = request.rel_url.query
+    full_monitor_path = resolve_gallery_path(query.get("relative_path", "./"))
+
+    mode = query.get("mode", "full")
+    if mode not in LISTING_MODES:
+        return web.Response(status=400, text=f"Invalid mode: {mode}, expected one of {', '.join(LISTING_MODES)}")
+
+    # Pagination is opt-in: without limit/cursor the whole tree is returned as before
+    paginated = "limit" in query or "cursor" in query
+    stream = query.get("format") == "ndjson"
+    if stream and paginated:
+        return web.Response(status=400, text="format=ndjson cannot be combined with limit/cursor")
+    if paginated:
+        sort = query.get("sort", "newest")
+        if sort not in LISTING_SORTS:
+            return web.Response(status=400, text=f"Invalid sort: {sort}, expected one of {', '.join(LISTING_SORTS)}")
+        try:
+            limit = int(query.get("limit", DEFAULT_PAGE_LIMIT))
+        except ValueError:
+            return web.Response(status=400, text="limit must be an integer")
+        if limit < 1:
+            return web.Response(status=400, text="limit must be positive")
+        limit = min(limit, MAX_PAGE_LIMIT)
+        cursor = query.get("cursor") or None
+        folder = query.get("folder") or None
+        if cursor is not None:
+            try:
+                decode_cursor(cursor, sort)
+            except ValueError as e:
+                return web.Response(status=400, text=str(e))
+
+    # Load saved settings to determine extensions
+    saved = load_settings()
+    scan_extensions = saved.get('scanExtensions', DEFAULT_EXTENSIONS)
+    deduplicate_symlinks = saved.get('deduplicateSymlinks', True)
+    # URLs in the listing start with the root's mount
+    mount = mount_gallery_root(full_monitor_path, saved)
+
+    variant = (full_monitor_path, tuple(scan_extensions), deduplicate_symlinks, mode, stream,
+               (limit, cursor, folder, sort) if paginated else None)
+    # With a ready monitor the listing version is known before scanning: unchanged listings cost nothing
+    sync_state = get_sync_state(full_monitor_path)
+    if sync_state:
+        etag = listing_cache.etag_for(variant, sync_state)
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            get_stats().incr("gallery_listing_requests_total", result="not_modified")
+            return web.Response(status=304, headers=cache_headers(etag))
+        cached = listing_cache.get(variant, etag)
+        if cached is not None:
+            get_stats().incr("gallery_listing_requests_total", result="cached")
+            return await send_cached_body(request, cached)
+
+    if stream:
+        get_stats().incr("gallery_listing_requests_total", result="streamed")
+        return await stream_gallery_images(request, full_monitor_path, mount, scan_extensions, deduplicate_symlinks, mode, variant, sync_state)
+
+    def scan():
+        """Runs in an executor, concurrent requests for the same root (and page) share one call.
+        Returns (folders, fingerprints, sync_state, page_fields)."""
+        # Taken before scanning: changes after this seq may or may not be in the listing, clients replay them
+        sync_state = get_sync_state(full_monitor_path)
+        # Use the actual folder name as the root key
+        folder_name = os.path.basename(full_monitor_path)
+        if paginated:
+            # The tree is walked without reading files, sorted and sliced, then only the page gets metadata
+            folders, fingerprints, metadata_tasks = scan_fingerprints(full_monitor_path, folder_name, scan_extensions, deduplicate_symlinks, extract_metadata=(mode == "full"))
+            page_folders, next_cursor, folder_counts = paginate_folders(folders, limit, cursor, folder, sort)
+            with get_stats().timed("gallery_scan_phase_seconds", phase="metadata" if mode == "full" else "resolution"):
+                _fill_metadata(page_folders, [task for task in metadata_tasks if task[1] in page_folders.get(task[0], ())], mode == "full")
+            return page_folders, fingerprints, sync_state, {"next_cursor": next_cursor, "folder_counts": folder_counts}
+        folders_with_metadata, fingerprints = _scan_for_images(
+            full_monitor_path, folder_name, True, scan_extensions, deduplicate_symlinks,
+            extract_metadata=(mode == "full")
+        )
+        return folders_with_metadata, fingerprints, sync_state, {}
+
+    def build_body(folders, fingerprints, sync_state, page_fields):
+        """Runs in an executor, joins the cached JSON of unchanged entries and encodes the others. Returns (etag, body)."""
+        started = time.perf_counter()
+        body = join_object([
+            json_key("folders") + get_fragment_cache().encode_folders(folders, fingerprints, mode),
+            *encode_fields({**page_fields, "root": mount, **sync_state}),
+        ])
+        stats = get_stats()
+        stats.observe("gallery_serialize_seconds", time.perf_counter() - started, endpoint="images")
+        stats.observe("gallery_response_bytes", len(body), endpoint="images")
+        # Unmonitored listings are versioned by content, that still saves the transfer
+        etag = listing_cache.etag_for(variant, sync_state) if sync_state else make_etag(hashlib.sha1(body).hexdigest())
+        return etag, body
+
+    get_stats().incr("gallery_listing_requests_total", result="scanned")
+    try:
+        scan_key = (full_monitor_path, tuple(scan_extensions), deduplicate_symlinks, mode, (limit, cursor, folder, sort) if paginated else None)
+        folders, fingerprints, scan_sync_state, page_fields = await listing_scans.run(scan_key, scan)
+        etag, body = await asyncio.get_running_loop().run_in_executor(None, build_body, folders, fingerprints, scan_sync_state, page_fields)
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            return web.Response(status=304, headers=cache_headers(etag))
+        return await send_cached_body(request, listing_cache.put(variant, etag, body, "application/json"))
+    except Exception as e:
+        gallery_log(f"Error in /Gallery/images: {e}")
+        import traceback
+        traceback.print_exc()
+        return web.Response(status=500, text=str(e))
+
+
+async def stream_gallery_images(request, full_monitor_path, mount, scan_extensions, deduplicate_symlinks, mode, variant, sync_state):
+    """Writes the listing as NDJSON while the scan runs: one {"folder", "files"} batch per line
+    (a folder may span several lines), then {"done": true, "root"} (with epoch/seq when monitored) or {"error": ...}.
+    Monitored listings are kept in listing_cache once complete, sync_state must be taken before scanning."""
+    loop = asyncio.get_running_loop()
+    lines = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    cancelled = threading.Event()
 
-    # Fix: Only join if relative_path is not absolute or '.'
+    def put(line):
+        """Blocks the producer while the queue is full, gives up once the client went away."""
+        future = asyncio.run_coroutine_threadsafe(lines.put(line), loop)
+        while True:
+            try:
+                return future.result(timeout=0.5)
+            except FutureTimeoutError:
+                if cancelled.is_set():
+                    future.cancel()
+                    raise ConnectionResetError("Client disconnected")
+
+    def produce():
+        """Runs in an executor, encodes each batch as soon as the scanner yields it. Returns True once done was sent."""
+        stats = get_stats()
+        fragments = get_fragment_cache()
+        encode_seconds = 0.0
+        sent_bytes = 0
+        try:
+            folder_name = os.path.basename(full_monitor_path)
+            for folder_key, files, fingerprints in iter_scan_for_images(
+                full_monitor_path, folder_name, True, scan_extensions, deduplicate_symlinks,
+                extract_metadata=(mode == "full"), batch_size=STREAM_BATCH_SIZE
+            ):
+                if cancelled.is_set():
+                    return
+                started = time.perf_counter()
+                line = join_object([*encode_fields({"folder": folder_key}), json_key("files") + fragments.encode_files(files, fingerprints, mode)]) + b"\n"
+                encode_seconds += time.perf_counter() - started
+                sent_bytes += len(line)
+                put(line)
+            put(json.dumps({"done": True, "root": mount, **sync_state}).encode("utf-8") + b"\n")
+            stats.observe("gallery_serialize_seconds", encode_seconds, endpoint="images.ndjson")
+            stats.observe("gallery_response_bytes", sent_bytes, endpoint="images.ndjson")
+            return True
+        except ConnectionResetError:
+            return
+        except Exception as e:
+            gallery_log(f"Error in /Gallery/images stream: {e}")
+            put(json.dumps({"error": str(e)}).encode("utf-8") + b"\n")
+        finally:
+            if not cancelled.is_set():
+                put(None)
+
+    etag = listing_cache.etag_for(variant, sync_state) if sync_state else None
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson", **(cache_headers(etag) if etag else {})})
+    if accepted_encoding(request.headers.get("Accept-Encoding"), allow_br=False) == "gzip":
+        response.enable_compression(web.ContentCoding.gzip)
+    await response.prepare(request)
+    producer = loop.run_in_executor(None, produce)
+    chunks = []
+    try:
+        while True:
+            line = await lines.get()
+            if line is None:
+                break
+            if etag:
+                chunks.append(line)
+            await response.write(line)
+    finally:
+        cancelled.set()  # Stops the producer if the client disconnected mid-stream
+    if await producer and etag:
+        listing_cache.put(variant, etag, b"".join(chunks), "application/x-ndjson")
+    await response.write_eof()
+    return response
+
+
+def get_sync_state(full_path):
+    """Returns {"epoch", "seq"} of the monitor of full_path if there is one and its index is ready, else {}."""
+    current = get_monitor_registry().get(full_path)
+    if current is None or not current.event_handler.index_ready:
+        return {}
+    epoch, seq = current.event_handler.sync_state()
+    return {"epoch": epoch, "seq": seq}
+
+
+@PromptServer.instance.routes.get("/Gallery/changes")
+async def get_gallery_changes(request):
+    """Endpoint to catch up on Gallery.file_change messages, accepts since (seq) and epoch from the last
+    listing or message, and relative_path (defaults to the root of client_id). Answers {"resync": true}
+    when the changes are no longer available."""
+    query = request.rel_url.query
+    try:
+        since = int(query.get("since", ""))
+    except ValueError:
+        return web.Response(status=400, text="since must be an integer")
+    current = get_monitor_registry().get(request_root(query.get("relative_path"), query.get("client_id")))
+    if current is None or not current.event_handler.index_ready:
+        return web.json_response({"resync": True})
+    handler = current.event_handler
+    epoch, seq = handler.sync_state()
+    changes = handler.changes_since(since) if query.get("epoch") == epoch else None
+    if changes is None:
+        # Monitor restarted or the log was truncated, only a full listing brings the client up to date
+        return web.json_response({"resync": True, "epoch": epoch, "seq": seq})
+    body = join_object([*encode_fields({"epoch": epoch, "seq": seq}), json_key("changes") + b"[" + b", ".join(changes) + b"]"])
+    return web.Response(body=body, content_type="application/json")
+
+
+def resolve_gallery_path(relative_path):
+    """Maps a relative_path parameter (relative to the output directory, absolute, or empty/null for the
+    output directory itself) to the full path of a gallery root."""
+    # Normalize the value: treat null/None/empty as root
+    if relative_path is None or str(relative_path).lower() == 'null' or str(relative_path).strip() == "":
+        relative_path = "./"
     base_output_dir = folder_paths.get_output_directory()
     if os.path.isabs(relative_path):
-        full_monitor_path = os.path.normpath(relative_path)
-    elif relative_path in ("./", ".", ""):  # treat as root
-        full_monitor_path = base_output_dir
-    else:
-        full_monitor_path = os.path.normpath(os.path.join(base_output_dir, relative_path))
-
-    # Use a thread-safe queue to communicate between threads.
-    result_queue = queue.Queue()
-
-    def thread_target():
-        """Target function for the scanning thread."""
-        with PromptServer.instance.scan_lock:
+        return os.path.normpath(relative_path)
+    if relative_path in ("./", ".", ""):
+        return base_output_dir
+    return os.path.normpath(os.path.join(base_output_dir, relative_path))
+
+
+def mount_gallery_root(full_path, saved):
+    """Returns the mount id of a listed root. Configured roots (the output directory and the settings'
+    relativePath) are served from here on if they exist, other roots only while they are monitored."""
+    configured = {os.path.realpath(folder_paths.get_output_directory()), os.path.realpath(resolve_gallery_path(saved.get("relativePath")))}
+    if os.path.realpath(full_path) in configured and os.path.isdir(full_path):
+        return get_monitor_registry().register_mount(full_path, saved.get("scanExtensions", DEFAULT_EXTENSIONS), pinned=True)
+    return static_mount_id(full_path)
+
+
+def request_root(relative_path, client_id=None):
+    """Root a request works on: relative_path if given, else the root client_id monitors, else the most
+    recently monitored root, else the output directory."""
+    if relative_path is not None and str(relative_path).strip() != "":
+        return resolve_gallery_path(relative_path)
+    return get_monitor_registry().root_for_client(client_id or DEFAULT_CLIENT) or folder_paths.get_output_directory()
+
+
+def split_static_url(url):
+    """Splits a /static_gallery/<mount>/<path> URL into (root, path), or returns None if the mount is unknown."""
+    if not isinstance(url, str) or not url.startswith("/static_gallery/"):
+        return None
+    mount, _, relative_path = url[len("/static_gallery/"):].partition("/")
+    root = get_monitor_registry().mount_root(mount)
+    if root is None or not relative_path:
+        return None
+    return root, relative_path
+
+
+@PromptServer.instance.routes.get("/static_gallery/{mount}/{path:.*}")
+async def serve_gallery_file(request):
+    """Serves the gallery files of the mounted roots, the first URL segment is the root's mount id. Only
+    files with the extensions the root is scanned for are served. Symlinks inside a root are followed,
+    like the static route this replaces."""
+    mounted = get_monitor_registry().mount_entry(request.match_info["mount"])
+    if mounted is None:
+        return web.Response(status=404, text="Unknown gallery root")
+    root, extensions = os.path.normpath(mounted[0]), mounted[1]
+    full_path = os.path.normpath(os.path.join(root, request.match_info["path"]))
+    if os.path.commonpath([full_path, root]) != root or not full_path.lower().endswith(extensions) or not os.path.isfile(full_path):
+        return web.Response(status=404, text="File not found")
+    return web.FileResponse(full_path)
+
+
+def resolve_static_url(url):
+    """Maps a /static_gallery URL to a path inside its root, or None if it is invalid or escapes it."""
+    parts = split_static_url(url)
+    if parts is None:
+        return None
+    static_dir, relative_path = parts
+    full_path = os.path.normpath(os.path.join(static_dir, relative_path))
+    real_static_dir = os.path.realpath(static_dir)
+    if os.path.commonpath([os.path.realpath(full_path), real_static_dir]) != real_static_dir:
+        return None
+    return full_path
+
+
+@PromptServer.instance.routes.post("/Gallery/metadata")
+async def get_gallery_metadata(request):
+    """Endpoint to get metadata for a batch of /static_gallery URLs, complements mode=light listings."""
+    try:
+        data = await request.json()
+    except Exception:
+        return web.Response(status=400, text="Invalid JSON body")
+    urls = data.get("urls") if isinstance(data, dict) else None
+    if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+        return web.Response(status=400, text="urls must be a list of strings")
+    if len(urls) > MAX_METADATA_BATCH:
+        return web.Response(status=400, text=f"At most {MAX_METADATA_BATCH} urls per request")
+
+    def collect_metadata():
+        """Runs in an executor: stats the files and resolves metadata from the cache or the files."""
+        results = {url: None for url in urls}  # None: file not found or outside the gallery
+        tasks = []
+        urls_by_path = {}  # Overlapping roots give the same file several URLs
+        for url in urls:
+            full_path = resolve_static_url(url)
+            if full_path is None:
+                continue
             try:
-                # Load saved settings to determine extensions
-                saved = load_settings()
-                scan_extensions = saved.get('scanExtensions', DEFAULT_EXTENSIONS)
-                deduplicate_symlinks = saved.get('deduplicateSymlinks', True)
-                # Use the actual folder name as the root key
-                folder_name = os.path.basename(full_monitor_path)
-                folders_with_metadata, _ = _scan_for_images(
-                    full_monitor_path, folder_name, True, scan_extensions, deduplicate_symlinks
-                )
-                result_queue.put(folders_with_metadata)  # Put the result in the queue
-            except Exception as e:
-                result_queue.put(e)  # Put the exception in the queue
-
-    def on_scan_complete(folders_with_metadata):
-            """Callback executed in the main thread to send the response."""
+                stat = os.stat(full_path)
+            except OSError:
+                continue
+            if get_file_type(full_path) != "image" and not full_path.lower().endswith(MEDIA_EXTENSIONS):
+                results[url] = {}  # Same as the full listing, only images and media containers carry metadata
+                continue
+            if full_path not in urls_by_path:
+                tasks.append((full_path, (os.path.realpath(full_path), stat.st_mtime_ns, stat.st_size)))
+            urls_by_path.setdefault(full_path, []).append(url)
+        for full_path, metadata in resolve_metadata(tasks).items():
+            for url in urls_by_path[full_path]:
+                results[url] = metadata
+        return results
 
-            try:
-                if isinstance(folders_with_metadata, Exception):
-                    gallery_log(f"Error in /Gallery/images: {folders_with_metadata}")
-                    import traceback
-                    traceback.print_exc()
-                    return web.Response(status=500, text=str(folders_with_metadata))
+    try:
+        results = await asyncio.get_running_loop().run_in_executor(None, collect_metadata)
+        stats = get_stats()
+        with stats.timed("gallery_serialize_seconds", endpoint="metadata"):
+            body = dumps_json({"metadata": sanitize_json_data(results)}).encode("utf-8")
+        stats.observe("gallery_response_bytes", len(body), endpoint="metadata")
+        return web.Response(body=body, content_type="application/json")
+    except Exception as e:
+        gallery_log(f"Error in /Gallery/metadata: {e}")
+        return web.Response(status=500, text=str(e))
+
+
+@PromptServer.instance.routes.get("/Gallery/search")
+async def search_gallery(request):
+    """Endpoint to search filenames and prompt fields, accepts q and optional sort/limit/cursor/folder/since/until.
+    Searches relative_path, by default the root of client_id."""
+    query = request.rel_url.query
+    text = query.get("q", "").strip()
+    if not text:
+        return web.Response(status=400, text="q is required")
+    sort = query.get("sort", "newest")
+    if sort not in SEARCH_SORTS:
+        return web.Response(status=400, text=f"Invalid sort: {sort}, expected one of {', '.join(SEARCH_SORTS)}")
+    try:
+        limit = min(int(query.get("limit", DEFAULT_SEARCH_LIMIT)), MAX_PAGE_LIMIT)
+        since = float(query["since"]) if query.get("since") else None
+        until = float(query["until"]) if query.get("until") else None
+    except ValueError:
+        return web.Response(status=400, text="limit, since and until must be numbers")
+    if limit < 1:
+        return web.Response(status=400, text="limit must be positive")
+    after = None
+    if query.get("cursor"):
+        try:
+            after = decode_cursor(query["cursor"], sort)
+        except ValueError as e:
+            return web.Response(status=400, text=str(e))
+    index = get_search_index()
+    if index is None:
+        return web.Response(status=503, text="Search index unavailable")
+
+    def run_search():
+        root = os.path.realpath(request_root(query.get("relative_path"), query.get("client_id")))
+        return index.search(root, text, sort, limit, after, query.get("folder") or None, since, until)
+
+    try:
+        hits, next_key = await asyncio.get_running_loop().run_in_executor(None, run_search)
+    except ValueError as e:
+        return web.Response(status=400, text=str(e))
+    except Exception as e:
+        gallery_log(f"Error in /Gallery/search: {e}")
+        return web.Response(status=500, text=str(e))
+    return web.json_response({
+        "hits": hits,
+        "next_cursor": encode_cursor(sort, next_key) if next_key is not None else None,
+    })
+
+
+@PromptServer.instance.routes.get("/Gallery/facets")
+async def get_gallery_facets(request):
+    """Endpoint for file counts per checkpoint, LoRA, sampler, resolution, type and day, accepts folder (with its
+    subfolders), since/until (YYYY-MM-DD, inclusive) and limit (values per facet). Counts relative_path,
+    by default the root of client_id, as far as the search index has seen it."""
+    query = request.rel_url.query
+    try:
+        limit = min(int(query.get("limit", DEFAULT_FACET_LIMIT)), MAX_PAGE_LIMIT)
+    except ValueError:
+        return web.Response(status=400, text="limit must be an integer")
+    if limit < 1:
+        return web.Response(status=400, text="limit must be positive")
+    since, until = query.get("since") or None, query.get("until") or None
+    try:
+        for day in (since, until):
+            if day is not None:
+                datetime.strptime(day, "%Y-%m-%d")
+    except ValueError:
+        return web.Response(status=400, text="since and until must be dates (YYYY-MM-DD)")
+    index = get_search_index()
+    if index is None:
+        return web.Response(status=503, text="Search index unavailable")
+
+    def count_facets():
+        root = request_root(query.get("relative_path"), query.get("client_id"))
+        return static_mount_id(root), index.facets(os.path.realpath(root), query.get("folder") or None, since, until, limit)
+
+    try:
+        mount, result = await asyncio.get_running_loop().run_in_executor(None, count_facets)
+    except Exception as e:
+        gallery_log(f"Error in /Gallery/facets: {e}")
+        return web.Response(status=500, text=str(e))
+    return web.json_response({"root": mount, **result})
 
-                sanitized_folders = sanitize_json_data(folders_with_metadata)
-                json_string = json.dumps({"folders": sanitized_folders})
-                return web.Response(text=json_string, content_type="application/json")
-            except Exception as e:
-                    gallery_log(f"Error in on_scan_complete: {e}")
-                    return web.Response(status=500, text=str(e))
 
+@PromptServer.instance.routes.get("/Gallery/duplicates")
+async def get_gallery_duplicates(request):
+    """Endpoint to group near-duplicate images by perceptual hash, accepts relative_path (by default the root
+    of client_id), threshold (differing bits out of 64) and min_size. Images not hashed yet are hashed first."""
+    query = request.rel_url.query
+    try:
+        threshold = int(query.get("threshold", DEFAULT_THRESHOLD))
+        min_size = int(query.get("min_size", 2))
+    except ValueError:
+        return web.Response(status=400, text="threshold and min_size must be integers")
+    if not 0 <= threshold <= MAX_THRESHOLD:
+        return web.Response(status=400, text=f"threshold must be between 0 and {MAX_THRESHOLD}")
+    if min_size < 2:
+        return web.Response(status=400, text="min_size must be at least 2")
+    hasher = get_image_hasher()
+    if hasher is None:
+        return web.Response(status=503, text="Duplicate detection requires numpy")
+    root = request_root(query.get("relative_path"), query.get("client_id"))
+    if not os.path.isdir(root):
+        return web.Response(status=400, text=f"Invalid relative_path: {query.get('relative_path')}, path not found")
+    saved = load_settings()
+    mount = mount_gallery_root(root, saved)
+
+    def find_duplicates():
+        """Runs in an executor: walks the root (listings are cached), hashes what is missing and groups."""
+        folders_data, _, metadata_tasks = scan_fingerprints(root, os.path.basename(root), saved.get('scanExtensions', DEFAULT_EXTENSIONS), saved.get('deduplicateSymlinks', True))
+        images = {full_path: (folder_key, filename, cache_key) for folder_key, filename, full_path, cache_key in metadata_tasks if get_file_type(filename) == "image"}
+        hashes = hasher.compute([(full_path, cache_key) for full_path, (_, _, cache_key) in images.items()])
+        clusters = []
+        for cluster in group_near_duplicates(hashes, threshold, min_size):
+            # Oldest first: the original a batch of variations was made from
+            entries = sorted(
+                ((images[full_path][0], folders_data[images[full_path][0]][images[full_path][1]], hashes[full_path]) for full_path in cluster),
+                key=lambda item: item[1]["timestamp"],
+            )
+            reference = entries[0][2]
+            clusters.append({
+                "hash": f"{reference:016x}",
+                "files": [
+                    {"folder": folder_key, "name": entry["name"], "url": entry["url"], "timestamp": entry["timestamp"],
+                     "hash": f"{value:016x}", "distance": hamming_distance(value, reference)}
+                    for folder_key, entry, value in entries
+                ],
+            })
+        return {"root": mount, "threshold": threshold, "images": len(images),
+                "unreadable": sum(1 for value in hashes.values() if value is None), "clusters": clusters}
+
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(None, find_duplicates)
+    except Exception as e:
+        gallery_log(f"Error in /Gallery/duplicates: {e}")
+        return web.Response(status=500, text=str(e))
+    return web.json_response(result)
 
-    # Start the scanning in a separate thread.
-    scan_thread = threading.Thread(target=thread_target)
-    scan_thread.start()
-    # Wait result and process it.
-    result = result_queue.get() # BLOCKING call
-    return on_scan_complete(result)
 
+@PromptServer.instance.routes.get("/Gallery/thumb")
+async def get_gallery_thumbnail(request):
+    """Endpoint to get a resized thumbnail for a /static_gallery image URL, accepts url, size and format."""
+    query = request.rel_url.query
+    try:
+        size = snap_thumbnail_size(int(query.get("size", DEFAULT_THUMBNAIL_SIZE)))
+    except ValueError:
+        return web.Response(status=400, text="size must be an integer")
+    thumbnail_format = query.get("format", DEFAULT_THUMBNAIL_FORMAT)
+    if thumbnail_format not in THUMBNAIL_FORMATS:
+        return web.Response(status=400, text=f"Invalid format: {thumbnail_format}, expected one of {', '.join(THUMBNAIL_FORMATS)}")
+    full_path = resolve_static_url(query.get("url"))
+    if full_path is None:
+        return web.Response(status=400, text="Invalid url")
+    if get_file_type(full_path) != "image":
+        return web.Response(status=400, text="Thumbnails are only available for images")
+
+    loop = asyncio.get_running_loop()
+    try:
+        key, future = await loop.run_in_executor(None, get_thumbnail_service().get_thumbnail, full_path, size, thumbnail_format)
+    except FileNotFoundError:
+        return web.Response(status=404, text=f"File not found: {query.get('url')}")
+
+    # The key is derived from path, mtime, size and output options, so it is a strong validator
+    headers = {"ETag": f'"{key}"', "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("If-None-Match"), headers["ETag"]):
+        return web.Response(status=304, headers=headers)
+    try:
+        thumbnail_path = await asyncio.wrap_future(future)
+        body = await loop.run_in_executor(None, pathlib.Path(thumbnail_path).read_bytes)
+    except Exception as e:
+        gallery_log(f"Error generating thumbnail for {full_path}: {e}")
+        return web.Response(status=500, text=str(e))
+    return web.Response(body=body, content_type=THUMBNAIL_FORMATS[thumbnail_format][1], headers=headers)
+
+
+def collect_stats():
+    """Returns (state, gauges) for /Gallery/stats: current cache and monitor state as nested dicts, and
+    the same numbers as Prometheus gauges. Runs in an executor, the metadata cache counts its rows."""
+    state = {"caches": {}, "monitors": []}
+    gauges = {}
+    stats = get_stats()
+    # Listings answered without scanning, out of all listing requests
+    listing_hits = stats.total("gallery_listing_requests_total", result="cached") + stats.total("gallery_listing_requests_total", result="not_modified")
+    listing_requests = stats.total("gallery_listing_requests_total")
+    state["caches"]["listings"] = {
+        "entries": len(listing_cache.entries),
+        "hits": listing_hits,
+        "misses": listing_requests - listing_hits,
+        "hit_ratio": (listing_hits / listing_requests) if listing_requests else None,
+    }
+    metadata_cache = get_metadata_cache()
+    if metadata_cache is not None:
+        state["caches"]["metadata"] = metadata_cache.stats()
+    state["caches"]["thumbnails"] = get_thumbnail_service().stats()
+    state["caches"]["fragments"] = get_fragment_cache().stats()
+    warmup = get_warmup()
+    if warmup is not None:
+        state["warmup"] = warmup.stats()
+    for cache_name, values in state["caches"].items():
+        for field, value in values.items():
+            if isinstance(value, (int, float)):
+                gauges[f"gallery_{cache_name}_cache_{field}"] = (f"{cache_name.capitalize()} cache {field.replace('_', ' ')}.", value)
+
+    for path, mount, current, clients, idle_seconds in get_monitor_registry().entries():
+        handler = current.event_handler
+        folders = handler.last_known_folders
+        monitor_state = {
+            "path": path,
+            "root": mount,
+            "clients": clients,
+            "idle_seconds": idle_seconds,
+            "index_ready": handler.index_ready,
+            "indexed_files": sum(len(files) for files in folders.values()),
+            "indexed_folders": len(folders),
+            "pending_paths": len(handler.pending_paths),
+            "running_scan": handler.scan_lock.locked(),
+            "seq": handler.seq,
+        }
+        state["monitors"].append(monitor_state)
+        for field, value in monitor_state.items():
+            if field not in ("path", "root") and value is not None:
+                gauge = gauges.setdefault(f"gallery_monitor_{field}", (f"Monitor {field.replace('_', ' ')} by root.", {}))
+                gauge[1][(("root", mount),)] = value
+    return state, gauges
+
+
+@PromptServer.instance.routes.get("/Gallery/stats")
+async def get_gallery_stats(request):
+    """Endpoint for the instrumentation counters and histograms, as JSON or, with format=prometheus, in the
+    Prometheus text format. Histogram buckets are cumulative in both."""
+    fmt = request.rel_url.query.get("format", "json")
+    if fmt not in ("json", "prometheus"):
+        return web.Response(status=400, text=f"Invalid format: {fmt}, expected json or prometheus")
+    state, gauges = await asyncio.get_running_loop().run_in_executor(None, collect_stats)
+    stats = get_stats()
+    if fmt == "prometheus":
+        return web.Response(body=stats.to_prometheus(gauges).encode("utf-8"), headers={
+            "Content-Type": "text/plain; version=0.0.4; charset=utf-8", "Cache-Control": "no-store"})
+    return web.json_response({**stats.snapshot(), **state}, headers={"Cache-Control": "no-store"})
 
 
 @PromptServer.instance.routes.post("/Gallery/monitor/start")
 async def start_gallery_monitor(request):
-    """Endpoint to start gallery monitoring, accepts relative_path."""
-    global monitor
+    """Endpoint to start gallery monitoring, accepts relative_path and client_id. Each client holds one
+    root, monitors of the other roots keep running while clients still hold them and stay warm for a while after."""
     from . import gallery_config
     try:
         data = await request.json()
-        # Normalize relative_path: if missing, null, or literal 'null', treat as root
         relative_path = data.get("relative_path", "./")
-        if relative_path is None or str(relative_path).lower() == 'null' or str(relative_path).strip() == "":
-            relative_path = "./"
+        saved = load_settings()  # Fallback for options the client does not send
         gallery_config.disable_logs = data.get("disable_logs", False)
         gallery_config.use_polling_observer = data.get("use_polling_observer", False)
+        gallery_config.raw_json_metadata = bool(data.get("raw_json_metadata", saved.get("rawJsonMetadata", False)))
+        metadata_backend = data.get("metadata_backend", saved.get("metadataBackend"))
+        if metadata_backend in ("threads", "processes"):
+            gallery_config.metadata_backend = metadata_backend
+        try:
+            gallery_config.metadata_workers = max(0, int(data.get("metadata_workers", saved.get("metadataWorkers", 0))))
+        except (TypeError, ValueError):
+            gallery_config.metadata_workers = 0
         scan_extensions = data.get("scan_extensions", DEFAULT_EXTENSIONS)
         deduplicate_symlinks = data.get("deduplicate_symlinks", True)
         disable_logs = gallery_config.disable_logs
         use_polling_observer = gallery_config.use_polling_observer
         # Resolve path consistently with /Gallery/images endpoint
-        base_output_dir = folder_paths.get_output_directory()
-        if os.path.isabs(relative_path):
-            full_monitor_path = os.path.normpath(relative_path)
-        elif relative_path in ("./", ".", ""):
-            full_monitor_path = base_output_dir
-        else:
-            full_monitor_path = os.path.normpath(os.path.join(base_output_dir, relative_path))
+        full_monitor_path = resolve_gallery_path(relative_path)
         gallery_log("disable_logs", disable_logs)
         gallery_log("use_polling_observer", use_polling_observer)
-        if monitor and monitor.thread and monitor.thread.is_alive():
-            gallery_log("FileSystemMonitor: Monitor already running, stopping previous monitor.")
-            monitor.stop_monitoring()
         if not os.path.isdir(full_monitor_path):
             return web.Response(status=400, text=f"Invalid relative_path: {relative_path}, path not found")
-        for route in PromptServer.instance.app.router.routes():
-            if route.name == 'static_gallery_placeholder':
-                route.resource._directory = pathlib.Path(full_monitor_path)
-                gallery_log(f"Serving static files from {full_monitor_path} at /static_gallery")
-                break
-        else:
-            gallery_log("Error: Placeholder static route not found!")
-            return web.Response(status=500, text="Placeholder route not found.")
-        monitor = FileSystemMonitor(full_monitor_path, interval=1.0, use_polling_observer=use_polling_observer, extensions=scan_extensions, deduplicate_symlinks=deduplicate_symlinks)
-        monitor.start_monitoring()
+        client_id = data.get("client_id") or DEFAULT_CLIENT
+        # Stopping a replaced idle monitor joins its observer thread
+        await asyncio.get_running_loop().run_in_executor(
+            None, lambda: get_monitor_registry().acquire(client_id, full_monitor_path, scan_extensions, deduplicate_symlinks, use_polling_observer)
+        )
         return web.Response(text="Gallery monitor started", content_type="text/plain")
     except Exception as e:
         gallery_log(f"Error starting gallery monitor: {e}")
@@ -202,17 +762,13 @@ async def start_gallery_monitor(request):
 
 @PromptServer.instance.routes.post("/Gallery/monitor/stop")
 async def stop_gallery_monitor(request):
-    """Endpoint to stop gallery monitoring."""
-    global monitor
-    from .gallery_config import gallery_log
-    if monitor and monitor.thread and monitor.thread.is_alive():
-        monitor.stop_monitoring()
-        monitor = None
-    for route in PromptServer.instance.app.router.routes():
-        if route.name == 'static_gallery_placeholder':
-            route.resource._directory = pathlib.Path(PLACEHOLDER_DIR)
-            gallery_log(f"Serving static files from {PLACEHOLDER_DIR} at /static_gallery")
-            break
+    """Endpoint to stop gallery monitoring for client_id, the monitor keeps running while other clients hold its root."""
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    client_id = (data.get("client_id") if isinstance(data, dict) else None) or DEFAULT_CLIENT
+    await asyncio.get_running_loop().run_in_executor(None, get_monitor_registry().release, client_id)
     return web.Response(text="Gallery monitor stopped", content_type="text/plain")
 
 @PromptServer.instance.routes.patch("/Gallery/updateImages")
@@ -220,93 +776,219 @@ async def newSettings(request):
     # This route is no longer used
     return web.Response(status=200)
 
+def delete_gallery_file(image_url):
+    """Deletes the file behind a /static_gallery URL. Returns (status, message, deleted_path)."""
+    if not image_url:
+        return 400, "image_path is required", None
+    parts = split_static_url(image_url)
+    if parts is None:
+        return 400, "Invalid image_path format", None
+    static_dir, relative_path = parts
+    full_image_path = os.path.normpath(os.path.join(static_dir, relative_path))
+    if not os.path.exists(full_image_path):
+        return 404, f"File not found: {full_image_path}", None
+    real_full_path = os.path.realpath(full_image_path)
+    real_static_dir = os.path.realpath(static_dir)
+    if not os.path.commonpath([real_full_path, real_static_dir]) == real_static_dir:
+        return 403, "Access denied: File outside of static directory", None
+    os.remove(full_image_path)
+    return 200, f"Image deleted: {image_url}", full_image_path
+
+
+def move_gallery_file(source_path, target_path, static_dir):
+    """Moves a file within the served directory, paths may start with its folder name.
+    Returns (status, message, (full_source_path, full_target_path))."""
+    if not source_path or not target_path or not isinstance(source_path, str) or not isinstance(target_path, str):
+        return 400, "source_path and target_path are required", None
+    static_dir_basename = os.path.basename(os.path.normpath(static_dir))
+    def make_path(p):
+        if os.path.isabs(p):
+            return os.path.normpath(p)
+        if p.startswith(static_dir_basename + os.sep):
+            p = p[len(static_dir_basename + os.sep):]
+        elif p.startswith(static_dir_basename + "/"):
+            p = p[len(static_dir_basename + "/") :]
+        return os.path.normpath(os.path.join(static_dir, p))
+    full_source_path = make_path(source_path)
+    full_target_path = make_path(target_path)
+    gallery_log(f"full_source_path: {full_source_path}")
+    gallery_log(f"full_target_path: {full_target_path}")
+    if not os.path.exists(full_source_path):
+        return 404, f"Source file not found: {full_source_path}", None
+
+    real_source_path = os.path.realpath(full_source_path)
+    real_target_path = os.path.realpath(full_target_path)
+    real_static_dir = os.path.realpath(static_dir)
+    real_comfy_path = os.path.realpath(comfy_path)
+
+    if not os.path.commonpath([real_source_path, real_static_dir]) == real_static_dir or \
+        not os.path.commonpath([real_target_path, real_static_dir]) == real_static_dir or \
+        not os.path.commonpath([real_source_path, real_comfy_path]) == real_comfy_path or \
+        not os.path.commonpath([real_target_path, real_comfy_path]) == real_comfy_path:
+        return 403, "Access denied: File outside of allowed directory", None
+    if os.path.isdir(full_target_path):
+        full_target_path = os.path.join(full_target_path, os.path.basename(full_source_path))
+    target_dir = os.path.dirname(full_target_path)
+    if not os.path.exists(target_dir):
+        os.makedirs(target_dir, exist_ok=True)
+    shutil.move(full_source_path, full_target_path)
+    return 200, f"Image moved from {source_path} to {target_path}", (full_source_path, full_target_path)
+
+
+def notify_monitor(paths, full_rescan=False):
+    """Applies files changed by the gallery itself ({path: exists_now}) to the index of every monitor
+    whose root contains them in one update, instead of waiting for one watchdog event per file.
+    Blocking, run it in an executor."""
+    for current, root_paths in get_monitor_registry().monitors_for_paths(paths):
+        current.event_handler.apply_local_changes(root_paths, full_rescan)
+
+
+def invalidate_listings():
+    """Drops listing results and bodies that may predate a delete or move."""
+    listing_scans.invalidate()
+    listing_cache.invalidate()
+
+
 @PromptServer.instance.routes.post("/Gallery/delete")
 async def delete_image(request):
     """Endpoint to delete an image."""
-    from .gallery_config import gallery_log
     try:
         data = await request.json()
         image_url = data.get("image_path")
-        if not image_url:
-            return web.Response(status=400, text="image_path is required")
-        if image_url.startswith("/static_gallery/"):
-            relative_path = image_url[len("/static_gallery/"):]
 
-        else:
-            return web.Response(status=400, text="Invalid image_path format")
-        static_route = next((r for r in PromptServer.instance.app.router.routes() if getattr(r, 'name', None) == 'static_gallery_placeholder'), None)
-        if static_route is not None:
-            static_dir = str(static_route.resource._directory)
-        else:
-            static_dir = folder_paths.get_output_directory()
-        full_image_path = os.path.normpath(os.path.join(static_dir, relative_path))
-        if not os.path.exists(full_image_path):
-            return web.Response(status=404, text=f"File not found: {full_image_path}")
-        real_full_path = os.path.realpath(full_image_path)
-        real_static_dir = os.path.realpath(static_dir)
-        if not os.path.commonpath([real_full_path, real_static_dir]) == real_static_dir:
-            return web.Response(status=403, text="Access denied: File outside of static directory")
-        os.remove(full_image_path)
-        return web.Response(text=f"Image deleted: {image_url}")
+        def run_delete():
+            status, message, deleted_path = delete_gallery_file(image_url)
+            if deleted_path is not None:
+                notify_monitor({deleted_path: False})
+            return status, message
+
+        status, message = await asyncio.get_running_loop().run_in_executor(None, run_delete)
+        if status == 200:
+            invalidate_listings()
+        return web.Response(status=status, text=message)
     except Exception as e:
         gallery_log(f"Error deleting image: {e}")
         return web.Response(status=500, text=str(e))
 
 @PromptServer.instance.routes.post("/Gallery/move")
 async def move_image(request):
-    """Endpoint to move an image to a new location, relative to the current gallery root (current_path)."""
-    from .gallery_config import disable_logs, gallery_log
+    """Endpoint to move an image to a new location, relative to the gallery root current_path (by default
+    the root of client_id)."""
     try:
         data = await request.json()
         source_path = data.get("source_path")
         target_path = data.get("target_path")
-        current_path = data.get("current_path") or data.get("relative_path") or "./"
+        current_path = data.get("current_path") or data.get("relative_path")
         gallery_log(f"source_path: {source_path}")
         gallery_log(f"target_path: {target_path}")
         gallery_log(f"current_path: {current_path}")
-        if not source_path or not target_path:
-            return web.Response(status=400, text="source_path and target_path are required")
-        static_route = next((r for r in PromptServer.instance.app.router.routes() if getattr(r, 'name', None) == 'static_gallery_placeholder'), None)
-        if static_route is not None:
-            static_dir = str(static_route.resource._directory)
-        else:
-            static_dir = folder_paths.get_output_directory()
-        static_dir_basename = os.path.basename(os.path.normpath(static_dir))
-        def make_path(p):
-            if os.path.isabs(p):
-                return os.path.normpath(p)
-            if p.startswith(static_dir_basename + os.sep):
-                p = p[len(static_dir_basename + os.sep):]
-            elif p.startswith(static_dir_basename + "/"):
-                p = p[len(static_dir_basename + "/") :]
-            return os.path.normpath(os.path.join(static_dir, p))
-        full_source_path = make_path(source_path)
-        full_target_path = make_path(target_path)
+        static_dir = request_root(current_path, data.get("client_id"))
         gallery_log(f"static_dir: {static_dir}")
-        gallery_log(f"full_source_path: {full_source_path}")
-        gallery_log(f"full_target_path: {full_target_path}")
-        if not os.path.exists(full_source_path):
-            return web.Response(status=404, text=f"Source file not found: {full_source_path}")
-        
-        real_source_path = os.path.realpath(full_source_path)
-        real_target_path = os.path.realpath(full_target_path)
-        real_static_dir = os.path.realpath(static_dir)
-        real_comfy_path = os.path.realpath(comfy_path)
-
-        if not os.path.commonpath([real_source_path, real_static_dir]) == real_static_dir or \
-            not os.path.commonpath([real_target_path, real_static_dir]) == real_static_dir or \
-            not os.path.commonpath([real_source_path, real_comfy_path]) == real_comfy_path or \
-            not os.path.commonpath([real_target_path, real_comfy_path]) == real_comfy_path:
-            return web.Response(status=403, text="Access denied: File outside of allowed directory")
-        if os.path.isdir(full_target_path):
-            full_target_path = os.path.join(full_target_path, os.path.basename(full_source_path))
-        target_dir = os.path.dirname(full_target_path)
-        if not os.path.exists(target_dir):
-            os.makedirs(target_dir, exist_ok=True)
-        shutil.move(full_source_path, full_target_path)
-        return web.Response(text=f"Image moved from {source_path} to {target_path}")
+
+        def run_move():
+            status, message, moved = move_gallery_file(source_path, target_path, static_dir)
+            if moved is not None:
+                notify_monitor({moved[0]: False, moved[1]: True}, full_rescan=os.path.isdir(moved[1]))
+            return status, message
+
+        status, message = await asyncio.get_running_loop().run_in_executor(None, run_move)
+        if status == 200:
+            invalidate_listings()
+        return web.Response(status=status, text=message)
     except Exception as e:
         gallery_log(f"Error moving image: {e}")
         import traceback
         traceback.print_exc()
-        return web.Response(status=500, text=str(e))
\ No newline at end of file
+        return web.Response(status=500, text=str(e))
+
+@PromptServer.instance.routes.post("/Gallery/delete_batch")
+async def delete_images(request):
+    """Endpoint to delete a batch of images: {"image_paths": [...]}, returns a result per path."""
+    try:
+        data = await request.json()
+        if not isinstance(data, dict):
+            return web.Response(status=400, text="Expected a JSON object")
+        image_urls = data.get("image_paths")
+        if not isinstance(image_urls, list) or not image_urls:
+            return web.Response(status=400, text="image_paths must be a non-empty list")
+        if len(image_urls) > MAX_FILE_BATCH:
+            return web.Response(status=400, text=f"At most {MAX_FILE_BATCH} paths per request")
+
+        def run_batch():
+            results, deleted_paths = [], {}
+            for image_url in image_urls:
+                try:
+                    status, message, deleted_path = delete_gallery_file(image_url)
+                except Exception as e:
+                    status, message, deleted_path = 500, str(e), None
+                if deleted_path is not None:
+                    deleted_paths[deleted_path] = False
+                results.append({"image_path": image_url, "status": status, "message": message})
+            # One coalesced index update and Gallery.file_change message for the whole batch
+            notify_monitor(deleted_paths)
+            return results, len(deleted_paths)
+
+        results, deleted = await asyncio.get_running_loop().run_in_executor(None, run_batch)
+        if deleted:
+            invalidate_listings()
+        return web.json_response({"results": results, "deleted": deleted, "failed": len(results) - deleted})
+    except Exception as e:
+        gallery_log(f"Error deleting images: {e}")
+        return web.Response(status=500, text=str(e))
+
+@PromptServer.instance.routes.post("/Gallery/move_batch")
+async def move_images(request):
+    """Endpoint to move a batch of images: {"moves": [{"source_path", "target_path"}]}, or
+    {"source_paths": [...], "target_path": folder} to move them all into one folder, within the root
+    relative_path (by default the root of client_id). Returns a result per move."""
+    try:
+        data = await request.json()
+        if not isinstance(data, dict):
+            return web.Response(status=400, text="Expected a JSON object")
+        moves = data.get("moves")
+        if moves is None and isinstance(data.get("source_paths"), list):
+            moves = [{"source_path": source_path, "target_path": data.get("target_path")} for source_path in data["source_paths"]]
+        if not isinstance(moves, list) or not moves or not all(isinstance(move, dict) for move in moves):
+            return web.Response(status=400, text="moves must be a non-empty list of {source_path, target_path}")
+        if len(moves) > MAX_FILE_BATCH:
+            return web.Response(status=400, text=f"At most {MAX_FILE_BATCH} moves per request")
+        static_dir = request_root(data.get("relative_path"), data.get("client_id"))
+
+        def run_batch():
+            results, changed_paths, moved, full_rescan = [], {}, 0, False
+            for move in moves:
+                source_path, target_path = move.get("source_path"), move.get("target_path")
+                try:
+                    status, message, moved_paths = move_gallery_file(source_path, target_path, static_dir)
+                except Exception as e:
+                    status, message, moved_paths = 500, str(e), None
+                if moved_paths is not None:
+                    moved += 1
+                    changed_paths[moved_paths[0]] = False
+                    changed_paths[moved_paths[1]] = True
+                    full_rescan = full_rescan or os.path.isdir(moved_paths[1])
+                results.append({"source_path": source_path, "target_path": target_path, "status": status, "message": message})
+            notify_monitor(changed_paths, full_rescan)
+            return results, moved
+
+        results, moved = await asyncio.get_running_loop().run_in_executor(None, run_batch)
+        if moved:
+            invalidate_listings()
+        return web.json_response({"results": results, "moved": moved, "failed": len(results) - moved})
+    except Exception as e:
+        gallery_log(f"Error moving images: {e}")
+        return web.Response(status=500, text=str(e))
+
+
+def start_startup_warmup():
+    """Starts indexing the gallery root (the output directory unless relativePath is set) in the background
+    if user_settings.json opts in with warmupOnStartup. Called once when the package is imported."""
+    saved = load_settings()
+    if not saved.get("warmupOnStartup"):
+        return None
+    full_path = resolve_gallery_path(saved.get("relativePath") or "./")
+    if not os.path.isdir(full_path):
+        gallery_log(f"StartupWarmup: {full_path} not found, skipping")
+        return None
+    get_image_hasher()  # Its queue thread starts here at normal priority, never from the niced warm-up thread
+    return start_warmup(full_path, saved.get("scanExtensions", DEFAULT_EXTENSIONS), saved.get("deduplicateSymlinks", True))
@@ -0,0 +1,50 @@
+# single_flight.py
+import asyncio
+
+
+class SingleFlight:
+    """Runs blocking calls in an executor, sharing one in-flight call per key between concurrent
+    awaiters and reusing finished results for a short TTL. Must only be used from the event loop."""
+
+    def __init__(self, ttl=2.0):
+        self.ttl = ttl
+        self.inflight = {}  # key -> asyncio.Future of the running call
+        self.results = {}  # key -> (expires_at, result)
+        self.generation = 0  # Bumped by invalidate() so calls started before it are not reused
+
+    async def run(self, key, func, *args):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        cached = self.results.get(key)
+        if cached is not None:
+            if cached[0] > now:
+                return cached[1]
+            del self.results[key]
+
+        future = self.inflight.get(key)
+        if future is None:
+            future = loop.run_in_executor(None, func, *args)
+            self.inflight[key] = future
+
+            def on_done(done, key=key, generation=self.generation):
+                if self.inflight.get(key) is done:
+                    del self.inflight[key]
+                if generation != self.generation:
+                    return  # Invalidated while running, the result may predate the change
+                if not done.cancelled() and done.exception() is None and self.ttl > 0:
+                    self.results[key] = (loop.time() + self.ttl, done.result())
+                self._prune(loop.time())
+
+            future.add_done_callback(on_done)
+        # Shield so one client disconnecting does not cancel the call the others are waiting on
+        return await asyncio.shield(future)
+
+    def invalidate(self):
+        """Drops reusable results, e.g. after files were moved or deleted. Later calls start a fresh run."""
+        self.generation += 1
+        self.results.clear()
+        self.inflight.clear()
+
+    def _prune(self, now):
+        for key in [key for key, (expires_at, _) in self.results.items() if expires_at <= now]:
+            del self.results[key]
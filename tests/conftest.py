@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from run_benchmarks import load_gallery  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def output_dir(tmp_path_factory):
+    """The output directory of the stub folder_paths, tests create their gallery roots below it."""
+    return str(tmp_path_factory.mktemp("output"))
+
+
+@pytest.fixture(scope="session")
+def gallery(output_dir, tmp_path_factory):
+    """{module name: module} of the custom node package, imported against the benchmark stubs with its
+    caches and index in a temporary directory."""
+    return load_gallery(output_dir, str(tmp_path_factory.mktemp("work")))
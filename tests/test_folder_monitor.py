@@ -0,0 +1,34 @@
+from types import SimpleNamespace
+
+
+def fingerprint(gallery, inode, mtime_ns, size):
+    return gallery["folder_scanner"].file_fingerprint(SimpleNamespace(st_ino=inode, st_mtime_ns=mtime_ns, st_size=size))
+
+
+def test_detect_folder_changes(gallery):
+    detect_folder_changes = gallery["folder_monitor"].detect_folder_changes
+    old = {
+        "out": {"a.png": fingerprint(gallery, 1, 10, 100), "b.png": fingerprint(gallery, 2, 10, 100)},
+        "out/same": {"c.png": fingerprint(gallery, 3, 10, 100)},
+        "out/gone": {"d.png": fingerprint(gallery, 4, 10, 100)},
+    }
+    new = {
+        # b.png rewritten in place (same inode), e.png new
+        "out": {"a.png": fingerprint(gallery, 1, 10, 100), "b.png": fingerprint(gallery, 2, 20, 120), "e.png": fingerprint(gallery, 5, 10, 100)},
+        "out/same": {"c.png": fingerprint(gallery, 3, 10, 100)},
+        "out/new": {"f.png": fingerprint(gallery, 6, 10, 100)},
+    }
+    assert detect_folder_changes(old, new) == {
+        "out": {"b.png": "update", "e.png": "create"},
+        "out/gone": {"d.png": "remove"},
+        "out/new": {"f.png": "create"},
+    }
+    assert detect_folder_changes(new, new) == {}
+
+
+def test_replaced_file_is_an_update(gallery):
+    # A file replaced by a rename keeps its name but gets another inode
+    detect_folder_changes = gallery["folder_monitor"].detect_folder_changes
+    old = {"out": {"a.png": fingerprint(gallery, 1, 10, 100)}}
+    new = {"out": {"a.png": fingerprint(gallery, 7, 10, 100)}}
+    assert detect_folder_changes(old, new) == {"out": {"a.png": "update"}}
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+from urllib.parse import quote
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+MTIME_NS = 1_700_000_000_000_000_000
+
+
+def make_png(path, mtime_ns):
+    info = PngInfo()
+    info.add_text("prompt", json.dumps({"3": {"class_type": "KSampler", "inputs": {"seed": 1}}}))
+    Image.new("RGB", (8, 4)).save(path, pnginfo=info)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.fixture(scope="module")
+def fetch(gallery):
+    """fetch(*urls) returns (status, body) per url from the gallery routes, body decoded as JSON for 200 responses."""
+    server = gallery["server"].PromptServer.instance
+    server.app.add_routes(server.routes)
+    loop = asyncio.new_event_loop()
+    client = TestClient(TestServer(server.app), loop=loop)
+    loop.run_until_complete(client.start_server())
+
+    async def get_all(urls):
+        results = []
+        for url in urls:
+            response = await client.get(url)
+            results.append((response.status, await response.json() if response.status == 200 else await response.text()))
+        return results
+
+    yield lambda *urls: loop.run_until_complete(get_all(urls))
+    loop.run_until_complete(client.close())
+    loop.close()
+
+
+def page_through(fetch, url):
+    """Follows next_cursor from url, returns the pages."""
+    pages = []
+    cursor = None
+    while True:
+        [(status, page)] = fetch(url + (f"&cursor={cursor}" if cursor else ""))
+        assert status == 200, page
+        pages.append(page)
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def test_pages_keep_the_sort_order_across_ties(gallery):
+    server = gallery["server"]
+    # Same timestamps and the same names in two folders: ties are broken by name, then folder
+    folders = {
+        folder_key: {name: {"name": name, "timestamp": 1.0 if name < "c" else 2.0} for name in ("a", "b", "c", "d")}
+        for folder_key in ("root", "root/sub")
+    }
+    for sort, (key_func, descending, _) in server.LISTING_SORTS.items():
+        def in_order(items):
+            return sorted(items, key=lambda item: key_func(item[0], folders[item[0]][item[1]]), reverse=descending)
+
+        expected = in_order((folder_key, name) for folder_key, content in folders.items() for name in content)
+        seen, cursor = [], None
+        while True:
+            # Pages group their entries by folder, each page is one slice of the order
+            page, cursor, counts = server.paginate_folders(folders, 3, cursor, sort=sort)
+            seen.extend(in_order((folder_key, name) for folder_key, content in page.items() for name in content))
+            if cursor is None:
+                break
+        assert counts == {"root": 4, "root/sub": 4}
+        assert seen == expected, sort
+
+
+def test_paginated_listing_reads_metadata_for_the_page_only(gallery, fetch, output_dir):
+    root = os.path.join(output_dir, "paged")
+    os.makedirs(root)
+    for index in range(5):
+        make_png(os.path.join(root, f"img_{index}.png"), MTIME_NS + index * 1_000_000_000)
+
+    pages = page_through(fetch, "/Gallery/images?relative_path=paged&limit=2&sort=newest")
+    names = [name for page in pages for content in page["folders"].values() for name in content]
+    assert names == [f"img_{index}.png" for index in reversed(range(5))]
+    assert all(entry["metadata"]["prompt"] for page in pages for content in page["folders"].values() for entry in content.values())
+
+    # A new file only gets its metadata read once it is on a requested page
+    make_png(os.path.join(root, "img_old.png"), MTIME_NS - 1_000_000_000)
+    gallery["server"].invalidate_listings()  # Recent scans are shared for a moment
+    fetch("/Gallery/images?relative_path=paged&limit=2&sort=newest")
+    cache = gallery["metadata_cache"].get_metadata_cache()
+    stat = os.stat(os.path.join(root, "img_old.png"))
+    assert cache.get(os.path.realpath(os.path.join(root, "img_old.png")), stat.st_mtime_ns, stat.st_size) is None
+
+
+def test_light_pages_carry_date_and_resolution(fetch, output_dir):
+    root = os.path.join(output_dir, "paged_light")
+    os.makedirs(root)
+    make_png(os.path.join(root, "a.png"), MTIME_NS)
+    [page] = page_through(fetch, "/Gallery/images?relative_path=paged_light&limit=10&mode=light")
+    entry = page["folders"]["paged_light"]["a.png"]
+    assert entry["resolution"] == "8x4" and entry["date"] and "metadata" not in entry
+
+
+def test_invalid_cursors_are_rejected(gallery, fetch):
+    encode_cursor = gallery["server"].encode_cursor
+    cursors = [
+        "not a cursor",
+        encode_cursor("name_asc", ("a.png", "root")),  # Another sort order
+        encode_cursor("newest", ("a.png", 1.0, "root")),  # Values of the wrong type
+        encode_cursor("newest", (1.0, "a.png")),  # Too short
+        encode_cursor("newest", (True, "a.png", "root")),
+    ]
+    results = fetch(*[f"/Gallery/images?limit=2&sort=newest&cursor={quote(cursor)}" for cursor in cursors])
+    assert [status for status, _ in results] == [400] * len(cursors)
@@ -0,0 +1,165 @@
+import io
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from media_metadata import read_media_info  # noqa: E402
+
+
+def box(box_type, payload=b""):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def tkhd_v1(width, height):
+    # version/flags, creation and modification time, track id, reserved, duration, then
+    # reserved, layer, alternate group, volume, reserved and the matrix before width and height
+    payload = b"\x01\x00\x00\x00" + bytes(32) + bytes(52)
+    return box(b"tkhd", payload + struct.pack(">II", width << 16, height << 16))
+
+
+def mp4(keys_payload):
+    ilst = box(b"ilst", box(b"\xa9cmt", box(b"data", struct.pack(">II", 1, 0) + b"hello")))
+    meta = box(b"meta", box(b"hdlr", bytes(25)) + box(b"keys", keys_payload) + ilst)
+    mvhd = box(b"mvhd", bytes(12) + struct.pack(">II", 1000, 2500) + bytes(80))
+    moov = box(b"moov", mvhd + box(b"trak", tkhd_v1(640, 360)) + meta)
+    return io.BytesIO(box(b"ftyp", b"isom" + bytes(4)) + moov)
+
+
+def test_version_1_tkhd_resolution():
+    info = read_media_info(mp4(struct.pack(">II", 0, 0)))
+    assert (info["width"], info["height"], info["duration"]) == (640, 360, 2.5)
+
+
+def test_keys_with_zero_key_size():
+    # A huge entry count with a zero-sized key used to loop in place, appending empty names
+    info = read_media_info(mp4(struct.pack(">II", 0, 0xFFFFFFFF) + struct.pack(">I4s", 0, b"mdta")))
+    assert info["tags"] == {"comment": "hello"}
+
+
+def test_keys_overrunning_the_atom():
+    info = read_media_info(mp4(struct.pack(">II", 0, 2) + struct.pack(">I4s", 200, b"mdta") + b"prompt"))
+    assert info["tags"] == {"comment": "hello"}
+
+
+class CountingFile(io.BytesIO):
+    """BytesIO counting the bytes read, to check that payloads are seeked over."""
+
+    bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def assert_truncations_fail_cleanly(data):
+    for length in range(len(data)):
+        try:
+            read_media_info(io.BytesIO(data[:length]))
+        except ValueError:
+            pass
+
+
+# --- Matroska / WebM ---
+
+def ebml(element_id, payload=b""):
+    # Sizes as 8-byte variable length integers, as muxers that patch sizes afterwards write them
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, "big") + b"\x01" + len(payload).to_bytes(7, "big") + payload
+
+
+def uint(element_id, value):
+    return ebml(element_id, value.to_bytes(max(1, (value.bit_length() + 7) // 8), "big"))
+
+
+def simple_tag(name, value):
+    return ebml(0x67C8, ebml(0x45A3, name.encode()) + ebml(0x4487, value.encode()))
+
+
+HEADER = ebml(0x1A45DFA3, ebml(0x4282, b"webm"))
+INFO = ebml(0x1549A966, uint(0x2AD7B1, 1000000) + ebml(0x4489, struct.pack(">d", 2500.0)))
+TRACKS = ebml(0x1654AE6B, ebml(0xAE, uint(0xD7, 1) + ebml(0xE0, uint(0xB0, 640) + uint(0xBA, 360))))
+TAGS = ebml(0x1254C367, ebml(0x7373, ebml(0x63C0) + simple_tag("PROMPT", '{"1": {}}') + simple_tag("WORKFLOW", '{"nodes": []}'))
+                        # Per-track statistics are not file metadata
+                        + ebml(0x7373, ebml(0x63C0, uint(0x63C5, 1)) + simple_tag("DURATION", "00:00:02.5")))
+
+
+def test_matroska_info_tracks_and_tags():
+    info = read_media_info(io.BytesIO(HEADER + ebml(0x18538067, INFO + TRACKS + TAGS)))
+    assert (info["width"], info["height"], info["duration"]) == (640, 360, 2.5)
+    assert info["tags"] == {"prompt": '{"1": {}}', "workflow": '{"nodes": []}'}
+
+
+def test_matroska_tags_after_the_clusters_through_the_seek_head():
+    cluster = ebml(0x1F43B675, uint(0xE7, 0) + bytes(1024 * 1024))
+    seek_head = ebml(0x114D9B74, ebml(0x4DBB, ebml(0x53AB, bytes.fromhex("1254C367")) + ebml(0x53AC, bytes(8))))
+    tags_position = len(seek_head) + len(INFO) + len(TRACKS) + len(cluster)
+    seek_head = seek_head.replace(ebml(0x53AC, bytes(8)), ebml(0x53AC, tags_position.to_bytes(8, "big")))
+    f = CountingFile(HEADER + ebml(0x18538067, seek_head + INFO + TRACKS + cluster + TAGS))
+    info = read_media_info(f)
+    assert info["tags"]["prompt"] == '{"1": {}}' and info["width"] == 640
+    assert f.bytes_read < 4096
+
+
+def test_matroska_oversized_integers_are_not_read():
+    # A Duration and a SeekPosition claiming megabytes, inside a file that holds them
+    f = CountingFile(HEADER + ebml(0x18538067, ebml(0x1549A966, ebml(0x4489, bytes(8 * 1024 * 1024))) + TRACKS))
+    info = read_media_info(f)
+    assert info["width"] == 640 and info["duration"] is None
+    assert f.bytes_read < 4096
+    f = CountingFile(HEADER + ebml(0x18538067, ebml(0x114D9B74, ebml(0x4DBB, ebml(0x53AC, bytes(8 * 1024 * 1024)))) + TRACKS))
+    try:
+        read_media_info(f)
+    except ValueError:
+        pass
+    assert f.bytes_read < 4096
+
+
+def test_truncated_matroska():
+    assert_truncations_fail_cleanly(HEADER + ebml(0x18538067, INFO + TRACKS + TAGS))
+
+
+# --- FLAC ---
+
+def flac_block(block_type, payload, last=False):
+    return bytes([block_type | (0x80 if last else 0)]) + len(payload).to_bytes(3, "big") + payload
+
+
+def vorbis_comment(*comments, count=None):
+    payload = struct.pack("<I", 6) + b"ffmpeg" + struct.pack("<I", len(comments) if count is None else count)
+    for comment in comments:
+        payload += struct.pack("<I", len(comment.encode())) + comment.encode()
+    return payload
+
+
+# 44.1 kHz, 2 channels, 16 bits, 88200 samples
+STREAMINFO = bytes(10) + ((44100 << 44) | (1 << 41) | (15 << 36) | 88200).to_bytes(8, "big") + bytes(16)
+
+
+def test_flac_streaminfo_and_vorbis_comment():
+    data = b"fLaC" + flac_block(0, STREAMINFO) + flac_block(4, vorbis_comment("PROMPT={\"1\": {}}", "Title=test"), last=True)
+    info = read_media_info(io.BytesIO(data))
+    assert info["duration"] == 2.0 and info["width"] is None
+    assert info["tags"] == {"prompt": '{"1": {}}', "title": "test"}
+
+
+def test_flac_after_an_id3_tag_skips_pictures():
+    id3 = b"ID3\x04\x00\x00" + bytes([0, 0, 1, 0]) + bytes(128)  # 128 byte tag, syncsafe size
+    picture = flac_block(6, bytes(1024 * 1024))
+    f = CountingFile(id3 + b"fLaC" + flac_block(0, STREAMINFO) + picture + flac_block(4, vorbis_comment("workflow={}"), last=True))
+    info = read_media_info(f)
+    assert info["tags"] == {"workflow": "{}"} and info["duration"] == 2.0
+    assert f.bytes_read < 4096
+
+
+def test_flac_comment_count_beyond_the_block():
+    data = b"fLaC" + flac_block(0, STREAMINFO) + flac_block(4, vorbis_comment("title=a", count=0xFFFFFFFF), last=True)
+    try:
+        read_media_info(io.BytesIO(data))
+    except ValueError:
+        pass
+
+
+def test_truncated_flac():
+    assert_truncations_fail_cleanly(b"fLaC" + flac_block(0, STREAMINFO) + flac_block(4, vorbis_comment("prompt={}"), last=True))
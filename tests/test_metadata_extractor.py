@@ -0,0 +1,106 @@
+import io
+import json
+
+import pytest
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+PROMPT = json.dumps({"3": {"class_type": "KSampler", "inputs": {"seed": 1}}})
+WORKFLOW = json.dumps({"nodes": [{"id": 3, "type": "KSampler"}]})
+
+
+def png(**options):
+    info = PngInfo()
+    info.add_text("prompt", PROMPT)
+    info.add_text("workflow", WORKFLOW, zip=True)
+    info.add_itxt("comment", "café")
+    info.add_itxt("parameters", "steps: 20", zip=True)
+    return save(Image.new("RGB", (16, 8)), "PNG", pnginfo=info, **options)
+
+
+def jpeg(**options):
+    exif = Image.Exif()
+    exif[0x010F] = "Make"
+    exif[0x0110] = "Model"
+    exif.get_ifd(0x8769)[0x9003] = "2024:01:01 00:00:00"
+    return save(Image.new("RGB", (16, 8)), "JPEG", exif=exif, **options)
+
+
+def save(image, image_format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+SAMPLES = {
+    "text.png": lambda: png(),
+    "dpi.png": lambda: png(dpi=(72, 72)),  # pHYs, read by PIL
+    "palette.png": lambda: save(Image.new("P", (16, 8)), "PNG"),
+    "exif.jpg": lambda: jpeg(),
+    "progressive.jpg": lambda: jpeg(progressive=True),
+    "plain.jpg": lambda: save(Image.new("L", (16, 8)), "JPEG"),
+    "lossy.webp": lambda: save(Image.new("RGB", (16, 8)), "WEBP"),
+    "lossless.webp": lambda: save(Image.new("RGBA", (16, 8)), "WEBP", lossless=True),
+    "exif.webp": lambda: save(Image.new("RGB", (16, 8)), "WEBP", exif=b"Exif\0\0" + Image.Exif().tobytes()),
+    "image.gif": lambda: save(Image.new("P", (16, 8)), "GIF", comment=b"hello"),
+    "animated.gif": lambda: save(Image.new("L", (16, 8)), "GIF", save_all=True, loop=0,
+                                 append_images=[Image.new("L", (16, 8), 255)]),
+}
+
+
+def read_both(extractor, path):
+    """(buildMetadataFast result, buildMetadata result), each the metadata or the exception type raised."""
+    results = []
+    for build in (extractor.buildMetadataFast, lambda p: extractor.buildMetadata(p)[2]):
+        try:
+            results.append(build(path))
+        except Exception as e:
+            results.append(type(e))
+    return results
+
+
+@pytest.mark.parametrize("name", SAMPLES)
+def test_header_reader_matches_pil(gallery, tmp_path, monkeypatch, name):
+    path = str(tmp_path / name)
+    with open(path, "wb") as f:
+        f.write(SAMPLES[name]())
+    extractor = gallery["metadata_extractor"]
+    fast, full = read_both(extractor, path)
+    assert fast == full
+    assert fast["fileinfo"]["resolution"] == "16x8"
+    if name != "dpi.png":
+        # Read from the headers, without falling back to PIL
+        monkeypatch.setattr(extractor, "buildMetadata", None)
+        assert extractor.buildMetadataFast(path) == full
+
+
+@pytest.mark.parametrize("name", SAMPLES)
+def test_truncated_headers(gallery, tmp_path, name):
+    data = SAMPLES[name]()
+    path = str(tmp_path / name)
+    for length in range(0, len(data), max(1, len(data) // 400)):
+        with open(path, "wb") as f:
+            f.write(data[:length])
+        fast, full = read_both(gallery["metadata_extractor"], path)
+        # Up to the first scan the header reader sees what PIL sees, including the files PIL rejects
+        if isinstance(full, dict):
+            assert fast == full, length
+        else:
+            assert not isinstance(fast, dict), length
+
+
+def test_oversized_png_text_chunk_is_not_read(gallery, tmp_path):
+    extractor = gallery["metadata_extractor"]
+    # A tEXt chunk claiming more than PIL keeps, in a file too short to hold it
+    data = png()
+    chunk = (extractor.MAX_TEXT_MEMORY + 1).to_bytes(4, "big") + b"tEXt"
+    reads = []
+
+    class CountingFile(io.BytesIO):
+        def read(self, size=-1):
+            reads.append(size)
+            return super().read(size)
+
+    with pytest.raises(extractor._NeedsPIL):
+        extractor._read_png_header(CountingFile(data[:33] + chunk + b"prompt\0" + data[33:]))
+    assert max(reads) < 1024
@@ -0,0 +1,67 @@
+import pytest
+
+
+def entry(name, checkpoint, sampler, text, timestamp=1_700_000_000.0):
+    prompt = {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": checkpoint}},
+        "2": {"class_type": "CLIPTextEncode", "inputs": {"text": text, "clip": ["1", 1]}},
+        "3": {"class_type": "KSampler", "inputs": {"sampler_name": sampler, "positive": ["2", 0], "model": ["1", 0]}},
+    }
+    return {
+        "name": name,
+        "url": f"/static_gallery/root/{name}",
+        "timestamp": timestamp,
+        "type": "image",
+        "metadata": {"fileinfo": {"resolution": "512x512"}, "prompt": prompt},
+    }
+
+
+def counts(result, facet):
+    return {item["value"]: item["count"] for item in result["facets"][facet]}
+
+
+@pytest.fixture
+def index(gallery, tmp_path):
+    return gallery["search_index"].SearchIndex(db_path=str(tmp_path / "search_index.db"))
+
+
+def test_search_and_facets_follow_added_and_removed_files(index):
+    index.update("root", [
+        ("out", entry("fox.png", "sdxl.safetensors", "euler", "a red fox")),
+        ("out", entry("fox2.png", "sdxl.safetensors", "dpmpp_2m", "a sleeping fox")),
+        ("out/sub", entry("cat.png", "flux.safetensors", "euler", "a cat")),
+    ])
+    assert sorted(hit["name"] for hit in index.search("root", "fox")[0]) == ["fox.png", "fox2.png"]
+    facets = index.facets("root")
+    assert facets["total"] == 3
+    assert counts(facets, "checkpoint") == {"sdxl.safetensors": 2, "flux.safetensors": 1}
+    assert counts(facets, "sampler") == {"euler": 2, "dpmpp_2m": 1}
+    assert counts(facets, "resolution") == {"512x512": 3}
+    assert index.facets("root", folder="out/sub")["total"] == 1
+
+    index.update("root", [], ["/static_gallery/root/fox2.png", "/static_gallery/root/cat.png"])
+    assert [hit["name"] for hit in index.search("root", "fox")[0]] == ["fox.png"]
+    assert index.search("root", "cat")[0] == []
+    facets = index.facets("root")
+    assert facets["total"] == 1
+    # Values no file is counted under any more are gone, not listed with a zero count
+    assert counts(facets, "checkpoint") == {"sdxl.safetensors": 1}
+    assert counts(facets, "sampler") == {"euler": 1}
+    assert index.facets("root", folder="out/sub")["total"] == 0
+
+
+def test_sync_folder_and_prune_folders(index):
+    index.sync_folder("root", "out", {"fox.png": entry("fox.png", "sdxl.safetensors", "euler", "a red fox")})
+    index.sync_folder("root", "out/sub", {"cat.png": entry("cat.png", "flux.safetensors", "euler", "a cat")})
+    assert index.facets("root")["total"] == 2
+
+    # fox.png was deleted and owl.png added, a re-sync only touches those two
+    index.sync_folder("root", "out", {"owl.png": entry("owl.png", "sdxl.safetensors", "euler", "an owl")})
+    assert index.search("root", "fox")[0] == []
+    assert [hit["name"] for hit in index.search("root", "owl")[0]] == ["owl.png"]
+    assert counts(index.facets("root"), "checkpoint") == {"sdxl.safetensors": 1, "flux.safetensors": 1}
+
+    index.prune_folders("root", {"out"})
+    facets = index.facets("root")
+    assert facets["total"] == 1 and counts(facets, "checkpoint") == {"sdxl.safetensors": 1}
+    assert index.search("root", "cat")[0] == []
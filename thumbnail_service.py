@@ -0,0 +1,191 @@
+# thumbnail_service.py
+import os
+import hashlib
+import threading
+from concurrent.futures import Future
+from .gallery_config import gallery_log
+from .worker_pool import create_worker_pool, load_worker_module
+
+# Thumbnail cache lives next to user_settings.json
+THUMBNAIL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "thumbnail_cache")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Requested sizes are snapped up to one of these so thumbnails are shared between clients
+THUMBNAIL_SIZES = (128, 256, 512, 1024)
+DEFAULT_THUMBNAIL_SIZE = 512
+# format name -> (PIL format, content type, file extension)
+THUMBNAIL_FORMATS = {
+    "webp": ("WEBP", "image/webp", ".webp"),
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+}
+DEFAULT_THUMBNAIL_FORMAT = "webp"
+
+_THUMBNAIL_QUALITY = 80
+_THUMBNAIL_WORKERS = min(4, (os.cpu_count() or 2))
+# Evict down to this fraction of max_bytes so eviction does not run after every thumbnail
+_EVICT_TARGET_RATIO = 0.9
+
+
+def snap_thumbnail_size(size):
+    """Returns the smallest supported thumbnail size >= size (the largest one if size is bigger)."""
+    for allowed in THUMBNAIL_SIZES:
+        if size <= allowed:
+            return allowed
+    return THUMBNAIL_SIZES[-1]
+
+
+class ThumbnailService:
+    """Generates thumbnails in a process pool and keeps them in a content-addressed LRU disk cache."""
+
+    def __init__(self, cache_dir=THUMBNAIL_DIR, max_bytes=DEFAULT_MAX_BYTES, workers=_THUMBNAIL_WORKERS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.evict_lock = threading.Lock()
+        self.inflight = {}  # key -> Future resolving to the thumbnail path
+        self.pool = None  # Created on first miss, most sessions only ever hit the cache
+        self.total_bytes = None  # Computed from disk on first store
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.errors = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(real_path, stat, size, thumbnail_format):
+        """Content address of a thumbnail: changes whenever the source file or the requested output changes."""
+        raw = f"{real_path}\0{stat.st_mtime_ns}\0{stat.st_size}\0{size}\0{thumbnail_format}"
+        return hashlib.sha1(raw.encode("utf-8", "surrogateescape")).hexdigest()
+
+    def path_for(self, key, thumbnail_format):
+        # Two-level layout keeps directories small on large caches
+        return os.path.join(self.cache_dir, key[:2], key + THUMBNAIL_FORMATS[thumbnail_format][2])
+
+    def get_thumbnail(self, full_path, size=DEFAULT_THUMBNAIL_SIZE, thumbnail_format=DEFAULT_THUMBNAIL_FORMAT, stat=None):
+        """Returns (key, Future) where the future resolves to the thumbnail path, already done on cache hits."""
+        if stat is None:
+            stat = os.stat(full_path)
+        key = self.make_key(os.path.realpath(full_path), stat, size, thumbnail_format)
+        dest_path = self.path_for(key, thumbnail_format)
+        with self.lock:
+            future = self.inflight.get(key)
+            if future is not None:
+                return key, future
+            if os.path.exists(dest_path):
+                self.hits += 1
+                try:
+                    os.utime(dest_path)  # mtime doubles as last access time for LRU eviction
+                except OSError:
+                    pass
+                future = Future()
+                future.set_result(dest_path)
+                return key, future
+            self.misses += 1
+            future = self._submit_locked(full_path, dest_path, size, thumbnail_format)
+            self.inflight[key] = future
+        future.add_done_callback(lambda done, key=key: self._on_generated(key, done))
+        return key, future
+
+    def prefetch(self, full_path):
+        """Queues the default thumbnail for a new file so it is ready before the client asks."""
+        try:
+            self.get_thumbnail(full_path)
+        except Exception as e:
+            gallery_log(f"ThumbnailService: could not queue thumbnail for {full_path}: {e}")
+
+    def _submit_locked(self, full_path, dest_path, size, thumbnail_format):
+        worker = load_worker_module()
+        args = (worker.generate_thumbnail, full_path, dest_path, size, THUMBNAIL_FORMATS[thumbnail_format][0], _THUMBNAIL_QUALITY)
+        if self.pool is None:
+            self.pool = create_worker_pool(self.workers)
+        try:
+            return self.pool.submit(*args)
+        except Exception as e:
+            # A crashed worker breaks the whole process pool, keep serving from threads
+            gallery_log(f"ThumbnailService: worker pool failed, switching to threads: {e}")
+            self.pool = create_worker_pool(self.workers, use_processes=False)
+            return self.pool.submit(*args)
+
+    def _on_generated(self, key, future):
+        with self.lock:
+            self.inflight.pop(key, None)
+        try:
+            dest_path = future.result()
+            added = os.path.getsize(dest_path)
+        except Exception as e:
+            self.errors += 1
+            gallery_log(f"ThumbnailService: error generating thumbnail: {e}")
+            return
+        self.generated += 1
+        with self.lock:
+            if self.total_bytes is not None:
+                self.total_bytes += added
+        if self.total_bytes is None or self.total_bytes > self.max_bytes:
+            threading.Thread(target=self._evict, daemon=True).start()
+
+    def _evict(self):
+        """Recomputes the cache size from disk and deletes least recently used thumbnails above max_bytes."""
+        if not self.evict_lock.acquire(blocking=False):
+            return  # Another eviction pass is already running
+        try:
+            files = []
+            total = 0
+            for root, _, names in os.walk(self.cache_dir):
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+            evicted = 0
+            if total > self.max_bytes:
+                target = int(self.max_bytes * _EVICT_TARGET_RATIO)
+                files.sort()
+                for _, file_size, path in files:
+                    if total <= target:
+                        break
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    total -= file_size
+                    evicted += 1
+                gallery_log(f"ThumbnailService: evicted {evicted} thumbnails")
+            with self.lock:
+                self.total_bytes = total
+                self.evictions += evicted
+        finally:
+            self.evict_lock.release()
+
+    def stats(self):
+        """Returns cache counters."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else None,
+                "generated": self.generated,
+                "errors": self.errors,
+                "evictions": self.evictions,
+                "inflight": len(self.inflight),
+            }
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_thumbnail_service():
+    """Returns the shared ThumbnailService."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = ThumbnailService()
+    return _service
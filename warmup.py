@@ -0,0 +1,167 @@
+# warmup.py
+import os
+import sys
+import threading
+import time
+
+from .folder_scanner import _walk_folders, resolve_metadata
+from .gallery_config import gallery_log
+from .json_fragments import get_fragment_cache
+from .metadata_cache import get_metadata_cache
+from .monitor_registry import get_monitor_registry
+from .search_index import get_search_index
+
+# Seconds after import before warming up, ComfyUI is still loading the other custom nodes then
+WARMUP_DELAY = 15.0
+# Share of the wall time the warm-up works, it sleeps the rest: 0.2 sleeps 4 s per second of work
+WARMUP_DUTY_CYCLE = 0.2
+# Files per step, their metadata is read one file at a time on a single thread
+WARMUP_BATCH = 32
+_NICENESS = 19
+# SetThreadPriority mode lowering CPU, I/O and memory priority of the calling thread
+_THREAD_MODE_BACKGROUND_BEGIN = 0x00010000
+
+
+def _lower_priority():
+    """Lowers the priority of the calling thread. On Linux priorities are per thread and inherited by the
+    threads it starts, the I/O scheduler derives the I/O priority of a thread from its niceness."""
+    try:
+        if sys.platform.startswith("linux"):
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), _NICENESS)
+        elif sys.platform == "win32":
+            import ctypes
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetThreadPriority(kernel32.GetCurrentThread(), _THREAD_MODE_BACKGROUND_BEGIN)
+    except Exception as e:
+        gallery_log(f"StartupWarmup: Could not lower the thread priority: {e}")
+
+
+class StartupWarmup:
+    """Indexes a gallery root in the background before the gallery is first opened: directory listings,
+    the metadata cache, JSON fragments and the search index folder by folder as it walks.
+
+    Runs on one low priority thread in small steps with sleeps in between, so it does not compete with
+    model loading. Nothing waits for it: listings requested meanwhile scan as usual and find the part
+    warmed up so far in the caches. It ends early once a ready monitor indexed the root."""
+
+    def __init__(self, full_path, extensions=None, deduplicate_symlinks=True, duty_cycle=WARMUP_DUTY_CYCLE):
+        self.full_path = full_path
+        self.extensions = extensions
+        self.deduplicate_symlinks = deduplicate_symlinks
+        self.duty_cycle = duty_cycle
+        self.state = "pending"  # pending, running, done, superseded, stopped, failed
+        self.folders = 0
+        self.files = 0
+        self.started_at = None
+        self.finished_at = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self, delay=WARMUP_DELAY):
+        self.thread = threading.Thread(target=self._run, args=(delay,), name="gallery_warmup", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        """Warms up on the calling thread, returns the final state."""
+        self.state = "running"
+        self.started_at = time.time()
+        try:
+            self._warm()
+        except Exception as e:
+            self.state = "failed"
+            gallery_log(f"StartupWarmup: Error warming up {self.full_path}: {e}")
+        self.finished_at = time.time()
+        gallery_log(f"StartupWarmup: {self.state} after {self.finished_at - self.started_at:.1f}s, {self.files} files in {self.folders} folders")
+        return self.state
+
+    def _run(self, delay):
+        if self.stopped.wait(delay):
+            self.state = "stopped"
+            return
+        _lower_priority()
+        self.run()
+
+    def _pause(self, busy_seconds):
+        """Sleeps long enough to keep the duty cycle, returns False if the warm-up should end."""
+        if self.duty_cycle < 1.0 and self.stopped.wait(busy_seconds * (1.0 - self.duty_cycle) / self.duty_cycle):
+            self.state = "stopped"
+            return False
+        if self.stopped.is_set():
+            self.state = "stopped"
+            return False
+        current = get_monitor_registry().get(self.full_path)
+        if current is not None and current.event_handler.index_ready:
+            self.state = "superseded"  # The monitor's full scan filled the same caches
+            return False
+        return True
+
+    def _warm(self):
+        base_name = os.path.basename(self.full_path)
+        real_root = os.path.realpath(self.full_path)
+        fragments = get_fragment_cache()
+        index = get_search_index()
+        # Folders are indexed and released one by one, only what the final cleanup needs is kept
+        folder_keys = set()
+        real_paths = set()
+        busy_since = time.perf_counter()
+        # A serial walk: listing ahead on a thread pool would run outside the pauses
+        for folder_key, folder_content, folder_tasks, fingerprints in _walk_folders(self.full_path, base_name, True, self.extensions, self.deduplicate_symlinks, True, walk_workers=1):
+            tasks_by_name = {filename: (full_path, cache_key) for _, filename, full_path, cache_key in folder_tasks}
+            names = list(folder_content)
+            for start in range(0, len(names), WARMUP_BATCH):
+                batch = names[start:start + WARMUP_BATCH]
+                tasks = [tasks_by_name[name] for name in batch if name in tasks_by_name]
+                # Perceptual hashes need full decodes outside the duty cycle, /Gallery/duplicates computes them on request
+                metadata_by_path = resolve_metadata(tasks, workers=1, enqueue_hashes=False)
+                for name in batch:
+                    if name in tasks_by_name:
+                        folder_content[name]["metadata"] = metadata_by_path.get(tasks_by_name[name][0], {})
+                fragments.fragments_for({name: folder_content[name] for name in batch}, fingerprints)
+                self.files += len(batch)
+                if not self._pause(time.perf_counter() - busy_since):
+                    return
+                busy_since = time.perf_counter()
+            if index is not None:
+                index.sync_folder(real_root, folder_key, folder_content)
+            folder_keys.add(folder_key)
+            real_paths.update(cache_key[0] for _, _, _, cache_key in folder_tasks)
+            self.folders += 1
+        # Only a complete walk tells which files and folders are gone
+        cache = get_metadata_cache()
+        if cache is not None:
+            cache.purge_missing(real_root, real_paths)
+        if index is not None:
+            index.prune_folders(real_root, folder_keys)
+        self.state = "done"
+
+    def stats(self):
+        """Returns the progress for /Gallery/stats."""
+        end = self.finished_at or time.time()
+        return {
+            "path": self.full_path,
+            "state": self.state,
+            "folders": self.folders,
+            "files": self.files,
+            "seconds": (end - self.started_at) if self.started_at else None,
+        }
+
+
+_warmup = None
+
+
+def start_warmup(full_path, extensions=None, deduplicate_symlinks=True):
+    """Starts the process-wide warm-up of full_path after WARMUP_DELAY, once."""
+    global _warmup
+    if _warmup is None:
+        _warmup = StartupWarmup(full_path, extensions, deduplicate_symlinks)
+        _warmup.start()
+        gallery_log(f"StartupWarmup: Indexing {full_path} in the background")
+    return _warmup
+
+
+def get_warmup():
+    """Returns the startup warm-up, or None if it was not enabled."""
+    return _warmup
@@ -0,0 +1,39 @@
+# worker_pool.py
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from .gallery_config import gallery_log
+
+# Worker functions live in gallery_workers.py. It is loaded under this fixed top-level name in
+# the server and in every pool process, so pickled references to its functions resolve in the
+# children without importing the custom node package (whose name ComfyUI picks at load time).
+WORKER_MODULE_NAME = "comfyui_gallery_workers"
+WORKER_MODULE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gallery_workers.py")
+
+# Source executed by the pool initializer. builtins.exec is picklable under every start method,
+# unlike any function defined in this package.
+_LOAD_WORKER_MODULE = (
+    "import importlib.util, sys\n"
+    f"if {WORKER_MODULE_NAME!r} not in sys.modules:\n"
+    f"    spec = importlib.util.spec_from_file_location({WORKER_MODULE_NAME!r}, {WORKER_MODULE_PATH!r})\n"
+    "    module = importlib.util.module_from_spec(spec)\n"
+    f"    sys.modules[{WORKER_MODULE_NAME!r}] = module\n"
+    "    spec.loader.exec_module(module)\n"
+)
+
+
+def load_worker_module():
+    """Returns the gallery_workers module as registered under WORKER_MODULE_NAME."""
+    exec(_LOAD_WORKER_MODULE, {})
+    return sys.modules[WORKER_MODULE_NAME]
+
+
+def create_worker_pool(max_workers, use_processes=True):
+    """Creates a pool able to run gallery_workers functions, falling back to threads if processes are unavailable."""
+    load_worker_module()
+    if use_processes:
+        try:
+            return ProcessPoolExecutor(max_workers=max_workers, initializer=exec, initargs=(_LOAD_WORKER_MODULE, {}))
+        except Exception as e:
+            gallery_log(f"Gallery Node: process pool unavailable, using threads: {e}")
+    return ThreadPoolExecutor(max_workers=max_workers)